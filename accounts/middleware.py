@@ -0,0 +1,13 @@
+from .models import subscription_request_scope
+
+
+class SubscriptionCacheMiddleware:
+    """Merkt sich subscription_for() für die Dauer eines Requests — _read_only,
+    app und die cloud_*-Views fragen dieselbe Subscription sonst mehrfach ab."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with subscription_request_scope():
+            return self.get_response(request)
@@ -1,8 +1,13 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
 
@@ -65,11 +70,52 @@ class Subscription(models.Model):
         return 'Abgelaufen, nur Ansicht'
 
 
+# user_id → Subscription für die Dauer eines Requests (SubscriptionCacheMiddleware).
+# None ausserhalb eines Requests (Management-Commands, Shell).
+_request_subscriptions = ContextVar('request_subscriptions', default=None)
+
+
+@contextmanager
+def subscription_request_scope():
+    token = _request_subscriptions.set({})
+    try:
+        yield
+    finally:
+        _request_subscriptions.reset(token)
+
+
+def _cache_key(user_id):
+    return f'subscription:{user_id}'
+
+
 def subscription_for(user):
     """Subscription holen; für Alt-User (vor Einführung registriert) wird
-    sie nachträglich angelegt — Trial ab Registrierungsdatum."""
-    sub, _created = Subscription.objects.get_or_create(
-        user=user,
-        defaults={'trial_ends': user.date_joined + timedelta(days=settings.TRIAL_DAYS)},
-    )
+    sie nachträglich angelegt — Trial ab Registrierungsdatum.
+
+    Gecacht: innerhalb eines Requests (jede weitere Abfrage kostet keine
+    Query) und prozessübergreifend SUBSCRIPTION_CACHE_SECONDS im Default-
+    Cache. Speichern/Löschen invalidiert; bei LocMem (pro Prozess) sehen die
+    anderen Worker eine Änderung spätestens nach Ablauf der TTL."""
+    memo = _request_subscriptions.get()
+    if memo is not None and user.pk in memo:
+        return memo[user.pk]
+    sub = cache.get(_cache_key(user.pk))
+    # Schutz gegen wiederverwendete ids (SQLite vergibt sie z.B. nach einem
+    # Rollback neu): eine Subscription ist nie älter als ihr User.
+    if sub is None or sub.user_id != user.pk or sub.created_at < user.date_joined:
+        sub, _created = Subscription.objects.get_or_create(
+            user=user,
+            defaults={'trial_ends': user.date_joined + timedelta(days=settings.TRIAL_DAYS)},
+        )
+        cache.set(_cache_key(user.pk), sub, settings.SUBSCRIPTION_CACHE_SECONDS)
+    if memo is not None:
+        memo[user.pk] = sub
     return sub
+
+
+@receiver([post_save, post_delete], sender=Subscription)
+def _invalidate_subscription(sender, instance, **kwargs):
+    cache.delete(_cache_key(instance.user_id))
+    memo = _request_subscriptions.get()
+    if memo is not None and memo.get(instance.user_id) is not instance:
+        memo.pop(instance.user_id, None)
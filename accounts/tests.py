@@ -1,4 +1,5 @@
 from datetime import timedelta
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth.models import User
@@ -7,7 +8,7 @@ from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 
-from .models import Subscription, subscription_for
+from .models import Subscription, subscription_for, subscription_request_scope
 
 
 class RegistrationTests(TestCase):
@@ -240,6 +241,45 @@ class SubscriptionTests(TestCase):
         self.assertTrue(sub.is_active)
 
 
+class SubscriptionCacheTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = _make_user()
+        subscription_for(self.user)
+
+    def test_repeated_lookups_cost_no_queries(self):
+        with subscription_request_scope():
+            with self.assertNumQueries(0):  # aus dem TTL-Cache, danach gemerkt
+                first = subscription_for(self.user)
+                self.assertIs(subscription_for(self.user), first)
+
+    def test_save_invalidates_cache(self):
+        sub = Subscription.objects.get(user=self.user)
+        sub.trial_ends = timezone.now() - timedelta(days=1)
+        sub.save()
+        with self.assertNumQueries(1):
+            self.assertFalse(subscription_for(self.user).is_active)
+
+    def test_stale_entry_of_reused_user_id_is_ignored(self):
+        old_sub = subscription_for(self.user)
+        old_sub.created_at = self.user.date_joined - timedelta(days=1)
+        from django.core.cache import cache
+        cache.set(f'subscription:{self.user.pk}', old_sub)
+        self.assertNotEqual(subscription_for(self.user).created_at, old_sub.created_at)
+
+    @override_settings(BETA_PRICING=False)
+    def test_cloud_list_reads_subscription_once(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client.login(username='test@example.ch', password='sicher-genug-42')
+        with mock.patch.object(Subscription.objects, 'get_or_create',
+                               wraps=Subscription.objects.get_or_create) as lookup:
+            self.client.get(reverse('cloud_list'))
+            self.client.get(reverse('cloud_list'))
+        self.assertEqual(lookup.call_count, 1)
+
+
 @override_settings(BETA_PRICING=False)
 class AnalyzeGateTests(TestCase):
     """analyze_page: 403 nach Ablauf, sonst passiert das Gate (dann 404,
@@ -108,6 +108,8 @@ def _delete_user_files(user):
     Project-Zeile kappt die letzte Verknüpfung zum User."""
     for stored in user.stored_projects.all():
         stored.file_path.unlink(missing_ok=True)
+    # Blobs der Online-Ablage: sobald die StoredProject-Zeilen weg sind,
+    # unreferenziert — gc_cloud_blobs löscht sie nach der Schonfrist.
     for project in user.projects.all():
         shutil.rmtree(settings.PROJECTS_DIR / str(project.id), ignore_errors=True)
 
@@ -45,6 +45,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.SubscriptionCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -71,31 +72,67 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
-# SQLite-Tuning für gunicorn mit mehreren Workern:
-# - WAL: Leser blockieren Schreiber nicht mehr (Standard-Journal tut das);
-#   legt db.sqlite3-wal/-shm neben die DB (gitignored, Backup nutzt eh die
-#   Online-Backup-API und ist davon unabhängig)
-# - synchronous=NORMAL: empfohlene Paarung mit WAL (volle Integrität bei
-#   App-Crash; nur bei OS-/Stromausfall können letzte Commits fehlen)
-# - timeout: Schreiber warten bis 20 s auf das Lock statt sofort
-#   "database is locked" zu werfen
-# - transaction_mode=IMMEDIATE: Schreib-Transaktionen nehmen das Lock sofort
-#   statt erst beim ersten Write — verhindert die Lock-Upgrade-Falle, bei
-#   der das timeout nicht greift
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-        'OPTIONS': {
-            'transaction_mode': 'IMMEDIATE',
-            'timeout': 20,
-            'init_command': (
-                'PRAGMA journal_mode=WAL;'
-                'PRAGMA synchronous=NORMAL;'
-            ),
-        },
+# Datenbank: SQLite (Default, ein Server, wenig parallele Schreiber) oder
+# PostgreSQL (DJANGO_DB_ENGINE=postgresql), sobald das eine SQLite-Schreiblock
+# bei parallelen Analysen/Uploads/Cloud-Saves zum Engpass wird. Umzug einer
+# bestehenden db.sqlite3: `manage.py copy_sqlite_to_db` (siehe dort).
+# Tests laufen gegen beide: DJANGO_DB_ENGINE=postgresql python manage.py test
+DB_ENGINE = os.environ.get('DJANGO_DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    # Verbindungen wiederverwenden statt pro Request neu aufbauen: entweder
+    # persistent pro Worker-Thread (CONN_MAX_AGE) oder — DJANGO_DB_POOL=True,
+    # braucht psycopg[pool] — über den psycopg-Pool pro Prozess. Beides
+    # zusammen lässt Django nicht zu. CONN_HEALTH_CHECKS verwirft vom Server
+    # geschlossene Verbindungen, bevor ein Request sie benutzt.
+    # Anzahl Verbindungen ≈ gunicorn-Worker × (Threads bzw. Pool-Grösse) —
+    # unter max_connections des Servers bleiben.
+    DB_POOL = os.environ.get('DJANGO_DB_POOL', 'False') == 'True'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DJANGO_DB_NAME', 'planvision'),
+            'USER': os.environ.get('DJANGO_DB_USER', 'planvision'),
+            'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', ''),
+            'HOST': os.environ.get('DJANGO_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DJANGO_DB_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': 1,
+                    'max_size': int(os.environ.get('DJANGO_DB_POOL_SIZE', 4)),
+                    'timeout': 20,
+                },
+            } if DB_POOL else {},
+        }
+    }
+else:
+    # SQLite-Tuning für gunicorn mit mehreren Workern:
+    # - WAL: Leser blockieren Schreiber nicht mehr (Standard-Journal tut das);
+    #   legt db.sqlite3-wal/-shm neben die DB (gitignored, Backup nutzt eh die
+    #   Online-Backup-API und ist davon unabhängig)
+    # - synchronous=NORMAL: empfohlene Paarung mit WAL (volle Integrität bei
+    #   App-Crash; nur bei OS-/Stromausfall können letzte Commits fehlen)
+    # - timeout: Schreiber warten bis 20 s auf das Lock statt sofort
+    #   "database is locked" zu werfen
+    # - transaction_mode=IMMEDIATE: Schreib-Transaktionen nehmen das Lock sofort
+    #   statt erst beim ersten Write — verhindert die Lock-Upgrade-Falle, bei
+    #   der das timeout nicht greift
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DJANGO_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                ),
+            },
+        }
     }
-}
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -133,6 +170,10 @@ BUG_REPORTS_DIR = BASE_DIR / 'bug_reports'
 TRAINING_DATA_DIR = BASE_DIR / 'training_data_opt-in'
 # Aufbewahrungsdauer für projects/<uuid>/ (Arbeits-/Zwischenspeicher).
 PROJECT_RETENTION_DAYS = int(os.environ.get('PROJECT_RETENTION_DAYS', 14))
+# cleanup_projects räumt pro Lauf höchstens so viele Ordner bzw. so lange
+# (Sekunden) auf; der Rest folgt im nächsten Lauf (Cron stündlich).
+CLEANUP_MAX_DIRS = int(os.environ.get('CLEANUP_MAX_DIRS', 5000))
+CLEANUP_TIME_BUDGET = float(os.environ.get('CLEANUP_TIME_BUDGET', 600))
 
 # BETA_MODE: Schalter für anonymen Zugriff (kein Login). Wenn True, löst er aus:
 #   - Kein Login nötig: alle Endpunkte (App, Upload, Analyse, Bug-Reports)
@@ -157,6 +198,9 @@ BETA_PRICING = os.environ.get('BETA_PRICING', 'True') == 'True'
 # Preis wie auf der Landingpage.
 TRIAL_DAYS = 30
 LICENSE_PRICE_CHF = 240
+# accounts.models.subscription_for: Subscription so lange im Default-Cache
+# (plus pro Request gemerkt). Speichern invalidiert im eigenen Prozess.
+SUBSCRIPTION_CACHE_SECONDS = 30
 # Feedback-Dankeschön (Akquise-Phase): Wer die drei Feedback-Fragen in der App
 # beantwortet, bekommt einmalig eine auf 6 Monate verlängerte Testphase
 # (trial_ends = jetzt + FEEDBACK_REWARD_DAYS, siehe core.views.submit_feedback).
@@ -167,6 +211,9 @@ DEFAULT_MAX_PROJECTS = 50
 # Online-Ablage: dauerhaft gespeicherte .planli-Projekte pro User
 # (StoredProject). Wie training_data_opt-in nie vom Cleanup berührt.
 CLOUD_PROJECTS_DIR = BASE_DIR / 'cloud_projects'
+# Diagnose-Dateien, z.B. per ?profile=1 erfasste Request-Profile
+# (core/profiling.py, Liste im Admin).
+DIAGNOSTICS_DIR = BASE_DIR / 'diagnostics'
 # Stiller technischer Deckel pro Projekt (Ausreisser-Schutz, kein beworbenes Limit)
 MAX_PROJECT_MB = 200
 
@@ -192,5 +239,56 @@ DEFAULT_FROM_EMAIL = os.environ.get('DJANGO_DEFAULT_FROM_EMAIL', 'Planli <norepl
 # Leer = deaktiviert; sobald gesetzt, wird das Tracking-Snippet auf allen Seiten geladen.
 PLAUSIBLE_DOMAIN = 'planli.net'
 
+# /statistik: Kontext wird so lange im Cache gehalten (Default-Cache, LocMem
+# pro Prozess). Abgeschlossene Tage kommen aus den Rollups (core/stats.py).
+STATISTIK_CACHE_SECONDS = 300
+# Beta-Tracking (core/tracking.py): AnalysisEvents gepuffert schreiben — ab so
+# vielen Events bzw. spätestens nach so vielen Sekunden.
+TRACKING_FLUSH_SIZE = 50
+TRACKING_FLUSH_SECONDS = 5
+# Prometheus-Metriken (core/metrics.py, /metrics): jeder gunicorn-Worker
+# schreibt seine Werte höchstens alle METRICS_FLUSH_SECONDS nach
+# METRICS_DIR/<pid>.json, /metrics fasst alle zusammen. Leer = nur der eigene
+# Prozess (Dev). Auf dem Server z. B. /run/planvision/metrics, beim Start leeren.
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = 5
+# Bearer-Token für den Prometheus-Scraper; Staff sieht /metrics auch ohne.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 PDF_DPI = 150
 JPEG_QUALITY = 70
+# Kachel-Pyramide für den Seiten-Viewer (DeepZoom, siehe core/page_images.py):
+# Kantenlänge einer Kachel und Überlappung zu den Nachbarkacheln in px.
+TILE_SIZE = 256
+TILE_OVERLAP = 1
+# Moderne Bildformate für die Seitenanzeige (core/page_images.negotiate_variant):
+# per Accept-Header statt des JPEGs ausgeliefert, beim ersten Abruf erzeugt.
+# Komma-Liste aus webp, avif, png (png = verlustfreie Palette, nur für reine
+# Schwarz-Weiss-Pläne). AVIF ist am kleinsten, kostet aber spürbar CPU beim
+# ersten Abruf — daher opt-in. Leer = immer nur das JPEG.
+PAGE_IMAGE_VARIANTS = [f.strip() for f in os.environ.get('PAGE_IMAGE_VARIANTS', 'webp,png').split(',') if f.strip()]
+PAGE_WEBP_QUALITY = 80
+PAGE_AVIF_QUALITY = 60
+# Inhaltsadressierter Render-Cache (core/render_cache.py): dasselbe PDF wird
+# nur einmal gerendert, Sessions bekommen Hardlinks. Gleiches Dateisystem wie
+# PROJECTS_DIR, sonst wird kopiert statt verlinkt. Nicht unter projects/ —
+# der Cleanup löscht dort alles ohne Project-Zeile.
+RENDER_CACHE_DIR = BASE_DIR / 'render_cache'
+# Plattenbudget für projects/ in MB (0 = aus). Darüber werden die Seiten-Renders
+# der am längsten nicht benutzten Sessions verdrängt (core/disk_quota.py) —
+# im Hintergrund nach einem Upload und per cleanup_projects --enforce-budget.
+PROJECTS_DISK_BUDGET_MB = int(os.environ.get('PROJECTS_DISK_BUDGET_MB', 0))
+# Vorschaubilder der Seitenliste (thumb_<s>_<i>.webp): längste Seite in px.
+THUMBNAIL_SIZE = 200
+THUMBNAIL_QUALITY = 75
+# Auslieferung der Projektdateien (core/file_delivery.py): die View prüft nur
+# den Zugriff, die Bytes schickt nginx (X-Accel-Redirect) bzw. Apache/lighttpd
+# (X-Sendfile) — so blockiert kein Bild-Download einen Worker, der Analysen
+# rechnet. '' = Python streamt selbst (runserver/Dev). /static/ liefert nginx
+# ohnehin direkt aus STATIC_ROOT.
+FILE_DELIVERY = os.environ.get('FILE_DELIVERY', '')
+# Verzeichnis → interne nginx-Location (`internal;` + `alias` auf das Verzeichnis)
+FILE_DELIVERY_ACCEL_LOCATIONS = {
+    PROJECTS_DIR: '/_protected/projects/',
+    CLOUD_PROJECTS_DIR: '/_protected/cloud/',
+}
@@ -1,12 +1,15 @@
 from django.contrib import admin
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
 
-from .models import Project, BugReport, AnalysisEvent, FeedbackResponse
+from .models import Project, BugReport, AnalysisEvent, FeedbackResponse, RequestProfile
 
 
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
-    list_display = ('id', 'created_at', 'user', 'original_filename', 'consent_training', 'files_deleted')
-    list_filter = ('consent_training', 'files_deleted', 'created_at')
+    list_display = ('id', 'created_at', 'user', 'original_filename', 'consent_training', 'files_deleted',
+                    'disk_bytes', 'last_accessed_at', 'renders_evicted')
+    list_filter = ('consent_training', 'files_deleted', 'renders_evicted', 'created_at')
     search_fields = ('original_filename', 'user__username')
     readonly_fields = ('id', 'created_at')
 
@@ -57,3 +60,27 @@ class BugReportAdmin(admin.ModelAdmin):
     @admin.display(boolean=True, description='Screenshot')
     def has_screenshot(self, obj):
         return bool(obj.screenshot)
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'user', 'method', 'path', 'status_code', 'duration_ms', 'has_trace', 'downloads')
+    list_filter = ('view_name', 'has_trace', 'created_at')
+    search_fields = ('path', 'user__username')
+    readonly_fields = ('id', 'created_at', 'user', 'method', 'path', 'view_name', 'status_code', 'duration_ms',
+                       'has_trace', 'downloads', 'top_functions_pre')
+    exclude = ('top_functions',)
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description='Dateien')
+    def downloads(self, obj):
+        links = [format_html('<a href="{}">pstats</a>', reverse('profile_download', args=[obj.id, 'pstats']))]
+        if obj.has_trace:
+            links.append(format_html('<a href="{}">Chrome-Trace</a>', reverse('profile_download', args=[obj.id, 'trace'])))
+        return format_html_join(' · ', '{}', ((link,) for link in links))
+
+    @admin.display(description='Top-Funktionen (kumuliert)')
+    def top_functions_pre(self, obj):
+        return format_html('<pre style="font-size: 11px">{}</pre>', obj.top_functions)
@@ -7,9 +7,13 @@ class CoreConfig(AppConfig):
     name = 'core'
 
     def ready(self):
+        import time
         from model_handler import load_model, cleanup_memory
+        from . import metrics
         try:
+            start = time.perf_counter()
             load_model()
+            metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - start)
         except Exception as e:
             import logging
             logging.getLogger(__name__).error(f"Error loading model: {e}")
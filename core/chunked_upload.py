@@ -0,0 +1,108 @@
+"""
+Fortsetzbare Uploads in Stücken (grosse PDFs, .planli-Projekte, Bug-Report-ZIPs).
+
+Protokoll (noch ohne Browser-Client — das ausgelieferte dist/-Bundle lädt
+klassisch per Multipart hoch, die Endpoints nehmen beides an):
+  1. POST /upload/chunked          purpose, filename, size[, session_id]
+     → {upload_id, offset: 0, chunk_size}
+  2. PUT  /upload/chunked/<id>     Header Upload-Offset, Body: rohe Bytes
+     → {offset}. Passt der Offset nicht (Stück doppelt, Verbindung abgerissen):
+     409 mit dem Stand des Servers — der Client setzt dort fort.
+     GET /upload/chunked/<id> → {offset, size} nach einem Abbruch.
+  3. Der eigentliche Endpoint (upload, upload_append, cloud/projects/save,
+     report_bug) bekommt statt der Datei upload_id + sha256 und übernimmt die
+     fertige Datei (finalize → ChunkedFile).
+
+Die Teildatei liegt von Anfang an im Zielverzeichnis (.upload_<id>.part), der
+Abschluss ist ein os.replace statt einer weiteren Kopie. Jedes Stück wird
+direkt aus dem Request-Stream angehängt — Django puffert nie den ganzen Body.
+"""
+import fcntl
+import hashlib
+import os
+import shutil
+from datetime import timedelta
+
+from django.core.files import File
+
+# Empfohlene Stückgrösse (der Client darf kleiner schicken) — muss unter
+# nginx' client_max_body_size bleiben.
+CHUNK_SIZE = 4 * 1024 * 1024
+# Nicht abgeschlossene Uploads räumt cleanup_projects nach dieser Frist weg.
+EXPIRY = timedelta(days=1)
+
+_READ_BLOCK = 64 * 1024
+
+
+class OffsetConflict(Exception):
+    """Das Stück passt nicht an den aktuellen Stand der Teildatei."""
+
+    def __init__(self, offset):
+        super().__init__(f'Erwarteter Offset: {offset}')
+        self.offset = offset
+
+
+def append_chunk(upload, stream, offset, length):
+    """Hängt `length` Bytes aus `stream` an die Teildatei an, sofern sie
+    gerade `offset` Bytes lang ist. Gibt den neuen Stand zurück.
+
+    Parallele PUTs auf denselben Upload serialisiert ein flock; ein Stück,
+    das über die angekündigte Grösse hinausginge, wird ganz abgelehnt.
+    """
+    with open(upload.part_path, 'ab') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise OffsetConflict(current)
+        if current + length > upload.size:
+            raise ValueError('Stück überschreitet die angekündigte Dateigrösse.')
+        remaining = length
+        while remaining > 0:
+            block = stream.read(min(_READ_BLOCK, remaining))
+            if not block:
+                break  # Client hat abgebrochen — das Empfangene bleibt, Fortsetzen ab hier
+            f.write(block)
+            remaining -= len(block)
+        f.flush()
+        return os.fstat(f.fileno()).st_size
+
+
+def finalize(upload, sha256):
+    """Abgeschlossenen Upload prüfen (vollständig, Prüfsumme) und als Datei
+    für den Ziel-Endpoint zurückgeben. ValueError bei unvollständigem Upload
+    oder falscher Prüfsumme."""
+    if upload.offset != upload.size:
+        raise ValueError('Upload unvollständig.')
+    digest = hashlib.sha256()
+    with open(upload.part_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    if digest.hexdigest() != (sha256 or '').lower():
+        raise ValueError('Prüfsumme stimmt nicht — Datei bitte erneut hochladen.')
+    return ChunkedFile(upload)
+
+
+def discard(upload):
+    """Teildatei und DB-Zeile entfernen (Abbruch / abgelaufen)."""
+    try:
+        upload.part_path.unlink()
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+class ChunkedFile(File):
+    """Fertiger Upload mit der Schnittstelle einer UploadedFile (name, size,
+    read, chunks). move_to() übernimmt die Teildatei ohne Kopie."""
+
+    def __init__(self, upload):
+        super().__init__(open(upload.part_path, 'rb'), name=upload.filename)
+        self.upload = upload
+
+    def move_to(self, dest):
+        self.close()
+        try:
+            os.replace(self.upload.part_path, dest)
+        except OSError:  # anderes Dateisystem
+            shutil.move(str(self.upload.part_path), str(dest))
+        self.upload.delete()
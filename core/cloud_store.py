@@ -0,0 +1,348 @@
+"""
+Online-Ablage als inhaltsadressierte Blobs statt ganzer .planli-ZIPs.
+
+Zwischen zwei Speichervorgängen ändert sich meist nur canvas_data.json —
+pages/*.jpg und sources/*.pdf bleiben identisch. Deshalb wird jedes
+ZIP-Mitglied einzeln unter seinem SHA-256 abgelegt:
+
+    CLOUD_PROJECTS_DIR/blobs/<sha[:2]>/<sha256>
+
+StoredProject.manifest hält die Reihenfolge der Mitglieder:
+    [{"name": "pages/page_1.jpg", "sha256": "…", "size": 123, "crc32": 4711}, …]
+cloud_download setzt daraus wieder ein .planli zusammen (zip_layout): nur
+"stored"-Einträge (keine Kompression — JPEG/PDF schrumpfen ohnehin kaum),
+CRC aus dem Manifest. Damit ist jedes Byte des Archivs vorab bekannt:
+Content-Length und Range-Requests funktionieren, ohne das ZIP je auf der
+Platte oder im Speicher zusammenzusetzen. Ab 4 GB schreibt zip_layout
+zip64-Felder.
+
+Delta-Speichern: der Client schickt das Manifest und nur die Mitglieder, die
+der Server noch nicht hat (zweiter Anlauf nach 409 mit `missing`). Als
+"vorhanden" zählen dabei nur Blobs aus den eigenen Projekten des Users —
+sonst liesse sich mit einem bekannten Hash fremder Inhalt erschleichen.
+
+Projekte von vor dieser Umstellung (manifest=None) liegen weiter als
+<id>.planli und werden unverändert ausgeliefert; beim nächsten Speichern
+wandern sie in den Blob-Store.
+
+Index für die Projektliste (build_index, beim Speichern): Seitenzahl,
+format_version, Label-Übersicht und ein Vorschaubild der ersten Seite —
+gelesen werden nur metadata.json, labels.json und pages/page_1.jpg, so dass
+cloud_list mit einer einzigen Query auskommt. Vorschaubilder liegen unter
+thumbs/<sha256 des Seitenbilds>.webp und teilen sich so wie die Blobs.
+
+Blobs ohne Verweis räumt gc_cloud_blobs weg (mit Schonfrist, damit ein
+gerade laufender Delta-Save seine schon vorhandenen Blobs nicht verliert —
+touch() frischt deren mtime auf). Das gilt auch nach dem Löschen eines
+Projekts oder Kontos: sofort gelöschte Blobs könnte ein paralleler Save
+(eigener Delta-Save oder fremder Upload mit demselben Inhalt) bereits
+eingeplant haben — sein Manifest zeigte dann ins Leere.
+"""
+import hashlib
+import json
+import os
+import re
+import struct
+import tempfile
+import zipfile
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+from PIL import Image
+
+from . import page_images
+
+SHA256_RE = re.compile(r'[0-9a-f]{64}')
+_READ_BLOCK = 1024 * 1024
+# Neueste .planli-Version, die der Client schreibt (project-zip.js CURRENT_VERSION)
+SUPPORTED_FORMAT_VERSION = 3
+MAX_INDEXED_LABELS = 20
+
+
+class TooLarge(ValueError):
+    """Entpackter Inhalt über dem Deckel (MAX_PROJECT_MB)."""
+
+
+def blobs_dir():
+    return settings.CLOUD_PROJECTS_DIR / 'blobs'
+
+
+def blob_path(sha256):
+    return blobs_dir() / sha256[:2] / sha256
+
+
+def thumbs_dir():
+    return settings.CLOUD_PROJECTS_DIR / 'thumbs'
+
+
+def thumbnail_path(page_sha256):
+    return thumbs_dir() / f'{page_sha256}.webp'
+
+
+def _put_blob(stream, max_bytes=None):
+    """Stream als Blob ablegen (atomar, vorhandene Blobs bleiben). Gibt
+    (sha256, size, crc32) zurück; TooLarge nach mehr als max_bytes."""
+    digest = hashlib.sha256()
+    size = crc = 0
+    blobs_dir().mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=blobs_dir())
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for block in iter(lambda: stream.read(_READ_BLOCK), b''):
+                digest.update(block)
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+                if max_bytes is not None and size > max_bytes:
+                    raise TooLarge('Entpacktes Projekt zu gross.')
+                f.write(block)
+        sha256 = digest.hexdigest()
+        target = blob_path(sha256)
+        target.parent.mkdir(exist_ok=True)
+        os.replace(tmp, target)
+        return sha256, size, crc
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def unpack(zip_file, max_bytes):
+    """Alle Mitglieder eines .planli (Datei-Objekt) als Blobs ablegen.
+    Gibt {name: manifest-eintrag} in ZIP-Reihenfolge zurück.
+    zipfile.BadZipFile bei kaputtem Archiv, TooLarge, wenn der Inhalt
+    entpackt mehr als max_bytes hätte (ZIP-Bombe): geprüft vorab an den
+    deklarierten Grössen und beim Schreiben an den tatsächlich gelesenen Bytes."""
+    entries = {}
+    with zipfile.ZipFile(zip_file) as archive:
+        infos = [info for info in archive.infolist() if not info.is_dir()]
+        if sum(info.file_size for info in infos) > max_bytes:
+            raise TooLarge('Entpacktes Projekt zu gross.')
+        for info in infos:
+            with archive.open(info) as member:
+                sha256, size, crc = _put_blob(member, max_bytes)
+            max_bytes -= size
+            entries[info.filename] = {'name': info.filename, 'sha256': sha256, 'size': size, 'crc32': crc}
+    return entries
+
+
+def parse_manifest(raw):
+    """Client-Manifest (JSON-Liste) prüfen; ValueError bei ungültigem Aufbau
+    oder unsicheren Pfaden. Übernommen werden nur Name und SHA-256 — Grösse
+    und CRC setzt cloud_save aus den Blobs selbst (die Grösse geht in den
+    Speicher-Deckel und die ZIP-Header des Downloads)."""
+    try:
+        items = json.loads(raw)
+    except ValueError:
+        raise ValueError('Ungültiges Manifest.')
+    if not isinstance(items, list):
+        raise ValueError('Ungültiges Manifest.')
+    manifest, names = [], set()
+    for item in items:
+        try:
+            name, sha256 = item['name'], item['sha256']
+        except (TypeError, KeyError):
+            raise ValueError('Ungültiges Manifest.')
+        if (not isinstance(name, str) or not name or name.startswith('/') or '..' in name.split('/')
+                or name in names or not isinstance(sha256, str) or not SHA256_RE.fullmatch(sha256)):
+            raise ValueError(f'Ungültiger Manifest-Eintrag: {name!r}')
+        names.add(name)
+        manifest.append({'name': name, 'sha256': sha256})
+    return manifest
+
+
+def _read_json(manifest_by_name, name):
+    entry = manifest_by_name.get(name)
+    if entry is None:
+        return None
+    try:
+        return json.loads(blob_path(entry['sha256']).read_bytes())
+    except ValueError:
+        raise ValueError(f'{name} ist kein gültiges JSON.')
+
+
+def _ensure_thumbnail(page_sha256):
+    """Vorschaubild der ersten Seite (einmal pro Seitenbild). False, wenn das
+    Bild sich nicht öffnen lässt — das Projekt bleibt trotzdem speicherbar."""
+    path = thumbnail_path(page_sha256)
+    if path.exists():
+        return True
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Eigene Temp-Datei pro Schreiber: zwei Saves mit derselben ersten Seite
+    # schreiben sonst ineinander
+    fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f, Image.open(blob_path(page_sha256)) as image:
+            image.draft('RGB', (settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE))
+            page_images.save_thumbnail(image.convert('RGB'), f)
+        os.replace(tmp, path)
+    except (OSError, Image.DecompressionBombError):
+        return False
+    finally:
+        Path(tmp).unlink(missing_ok=True)
+    return True
+
+
+def build_index(manifest):
+    """Index-Felder für StoredProject aus dem Manifest (siehe Modul-Doku).
+    ValueError, wenn das Archiv kein gültiges Planli-Projekt ist."""
+    by_name = {entry['name']: entry for entry in manifest}
+    metadata = _read_json(by_name, 'metadata.json')
+    if not isinstance(metadata, dict):
+        raise ValueError('Kein Planli-Projekt (metadata.json fehlt).')
+    page_count, format_version = metadata.get('page_count'), metadata.get('format_version', 1)
+    if not isinstance(page_count, int) or page_count < 0:
+        raise ValueError('Ungültige Seitenzahl in metadata.json.')
+    if not isinstance(format_version, int) or not 1 <= format_version <= SUPPORTED_FORMAT_VERSION:
+        raise ValueError(f'Unbekannte Projektversion: {format_version!r}.')
+
+    labels = _read_json(by_name, 'labels.json') or []
+    if not isinstance(labels, list):
+        raise ValueError('labels.json ist keine Liste.')
+    labels_summary = [{'name': str(label.get('name', ''))[:100], 'color': str(label.get('color', ''))[:20]}
+                      for label in labels[:MAX_INDEXED_LABELS] if isinstance(label, dict)]
+
+    first_page = by_name.get('pages/page_1.jpg')
+    thumbnail_sha = first_page['sha256'] if first_page and _ensure_thumbnail(first_page['sha256']) else ''
+    return {
+        'page_count': page_count,
+        'format_version': format_version,
+        'labels_summary': labels_summary,
+        'thumbnail_sha': thumbnail_sha,
+    }
+
+
+def user_blobs(user):
+    """Blobs aus den Projekten des Users: {sha256: crc32}."""
+    return {entry['sha256']: entry.get('crc32')
+            for manifest in user.stored_projects.exclude(manifest=None).values_list('manifest', flat=True)
+            for entry in manifest}
+
+
+def blob_size(sha256):
+    return blob_path(sha256).stat().st_size
+
+
+def ensure_crc(manifest):
+    """Fehlende CRC32 (Manifeste aus Delta-Saves ohne bekannte CRC)
+    nachrechnen. True, wenn das Manifest ergänzt wurde."""
+    changed = False
+    for entry in manifest:
+        if entry.get('crc32') is None:
+            crc = 0
+            with open(blob_path(entry['sha256']), 'rb') as f:
+                for block in iter(lambda: f.read(_READ_BLOCK), b''):
+                    crc = zlib.crc32(block, crc)
+            entry['crc32'] = crc
+            changed = True
+    return changed
+
+
+def touch(manifest):
+    """mtime der referenzierten Blobs auffrischen (GC-Schonfrist). Gibt die
+    Namen fehlender Blobs zurück."""
+    missing = []
+    for entry in manifest:
+        try:
+            os.utime(blob_path(entry['sha256']))
+        except FileNotFoundError:
+            missing.append(entry['name'])
+    return missing
+
+
+def manifest_etag(manifest):
+    digest = hashlib.sha256(''.join(e['name'] + e['sha256'] for e in manifest).encode())
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+# ── ZIP-Layout ────────────────────────────────────────────────────────────────
+# Feste Zeitstempel (1980-01-01 00:00, DOS-Epoche): das Archiv muss bei jedem
+# Abruf byte-identisch sein, sonst passt ein fortgesetzter Range-Download nicht
+# mehr zum Anfang. Die Bytes hängen so nur vom Manifest ab (= ETag).
+_DOS_TIME, _DOS_DATE = 0, (1 << 5) | 1
+_UTF8_FLAG = 0x0800
+_ZIP64_SENTINEL = 0xFFFFFFFF
+# Ab hier zip64-Felder (Grössen/Offsets passen nicht mehr in 32 Bit).
+ZIP64_THRESHOLD = 0xFFFFFFFF
+
+
+def _local_header(name, crc, size):
+    zip64 = size >= ZIP64_THRESHOLD
+    extra = struct.pack('<HHQQ', 1, 16, size, size) if zip64 else b''
+    stored_size = _ZIP64_SENTINEL if zip64 else size
+    return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, _UTF8_FLAG, zipfile.ZIP_STORED,
+                       _DOS_TIME, _DOS_DATE, crc, stored_size, stored_size, len(name), len(extra)) + name + extra
+
+
+def _central_header(name, crc, size, offset):
+    zip64_fields = []
+    if size >= ZIP64_THRESHOLD:
+        zip64_fields += [size, size]
+    if offset >= ZIP64_THRESHOLD:
+        zip64_fields.append(offset)
+    extra = b''
+    if zip64_fields:
+        extra = struct.pack(f'<HH{len(zip64_fields)}Q', 1, 8 * len(zip64_fields), *zip64_fields)
+    version = 45 if zip64_fields else 20
+    stored_size = _ZIP64_SENTINEL if size >= ZIP64_THRESHOLD else size
+    stored_offset = _ZIP64_SENTINEL if offset >= ZIP64_THRESHOLD else offset
+    return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, version, version, _UTF8_FLAG, zipfile.ZIP_STORED,
+                       _DOS_TIME, _DOS_DATE, crc, stored_size, stored_size, len(name), len(extra),
+                       0, 0, 0, 0, stored_offset) + name + extra
+
+
+def _end_records(count, cd_offset, cd_size):
+    records = b''
+    if count >= 0xFFFF or cd_offset >= ZIP64_THRESHOLD or cd_size >= ZIP64_THRESHOLD:
+        zip64_end = cd_offset + cd_size
+        records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        records += struct.pack('<IIQI', 0x07064b50, 0, zip64_end, 1)
+        count, cd_offset, cd_size = 0xFFFF, _ZIP64_SENTINEL, _ZIP64_SENTINEL
+    return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0)
+
+
+def zip_layout(manifest):
+    """Das .planli als Folge von Segmenten (Header-Bytes bzw. (Blob-Pfad,
+    Grösse)). Gibt (Gesamtgrösse, read) zurück; read(start, end) liefert die
+    Bytes [start, end) — passend für file_delivery.ranged_response.
+    Setzt vollständige CRCs im Manifest voraus (ensure_crc)."""
+    segments, central = [], []
+    offset = 0
+    for entry in manifest:
+        name = entry['name'].encode()
+        header = _local_header(name, entry['crc32'], entry['size'])
+        central.append(_central_header(name, entry['crc32'], entry['size'], offset))
+        segments += [header, (blob_path(entry['sha256']), entry['size'])]
+        offset += len(header) + entry['size']
+    central_dir = b''.join(central)
+    segments += [central_dir, _end_records(len(manifest), offset, len(central_dir))]
+    size = offset + len(central_dir) + len(segments[-1])
+
+    def read(start, end):
+        pos = 0
+        for segment in segments:
+            length = len(segment) if isinstance(segment, bytes) else segment[1]
+            lo, hi = max(start, pos) - pos, min(end, pos + length) - pos
+            if lo < hi:
+                if isinstance(segment, bytes):
+                    yield segment[lo:hi]
+                else:
+                    with open(segment[0], 'rb') as f:
+                        f.seek(lo)
+                        remaining = hi - lo
+                        while remaining > 0:
+                            block = f.read(min(_READ_BLOCK, remaining))
+                            if not block:
+                                break
+                            remaining -= len(block)
+                            yield block
+            pos += length
+            if pos >= end:
+                break
+    return size, read
+
+
+def referenced_blobs():
+    """Hashes aller Blobs, auf die noch ein Projekt verweist."""
+    from .models import StoredProject
+    qs = StoredProject.objects.exclude(manifest=None).order_by()  # ohne Sortierung, liest ohnehin alle
+    return {entry['sha256'] for manifest in qs.values_list('manifest', flat=True) for entry in manifest}
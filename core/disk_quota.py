@@ -0,0 +1,194 @@
+"""
+Plattenbudget für projects/ (Arbeitsdaten der Sessions).
+
+Die Aufbewahrungsfrist (cleanup_projects --days) greift erst nach Tagen — ein
+Schwung grosser Uploads kann die Platte vorher füllen. Deshalb:
+
+  - Project.disk_bytes: Grösse von projects/<uuid>/, erfasst nach jedem
+    Render (Upload, Anhängen, Wiederherstellen). Hardlinks in den Render-Cache
+    zählen voll mit — die Summe ist eine obere Schranke.
+  - Project.last_accessed_at: letzter Zugriff auf die Session (geschrieben
+    höchstens alle TOUCH_INTERVAL).
+  - PROJECTS_DISK_BUDGET_MB: liegt die Summe darüber, verdrängt enforce() die
+    Renders der am längsten nicht benutzten Sessions (LRU), bis wieder
+    TARGET_RATIO des Budgets erreicht sind. Nur abgeleitete Bilder (page_*,
+    thumb_*, tiles/, variants/) — document_<n>.pdf bleibt, die Session wird
+    beim nächsten Zugriff daraus neu gerendert (views._restore_renders).
+    Danach entfernt render_cache.evict() die Cache-Einträge, an denen keine
+    Session mehr hängt; erst damit ist der Platz wirklich frei.
+
+Ausgelöst im Hintergrund nach einem Upload, der das Budget überschreitet
+(schedule()), oder per cleanup_projects --enforce-budget.
+"""
+import fcntl
+import logging
+import os
+import shutil
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import page_images, render_cache
+
+logger = logging.getLogger(__name__)
+
+TOUCH_INTERVAL = timedelta(minutes=5)
+# Sessions, die gerade benutzt werden, bleiben verschont.
+MIN_IDLE = timedelta(minutes=30)
+TARGET_RATIO = 0.9
+BATCH_SIZE = 200
+RENDER_PREFIXES = ('page_', 'thumb_')
+DERIVED_DIRS = (page_images.TILES_DIR_NAME, page_images.VARIANTS_DIR_NAME)
+
+_lock = threading.Lock()
+_thread = None
+
+
+def budget_bytes():
+    return settings.PROJECTS_DISK_BUDGET_MB * 1024 * 1024
+
+
+def directory_bytes(path):
+    """Summe der Dateigrössen unter path (rekursiv, ohne Symlinks zu folgen)."""
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        total += directory_bytes(entry.path)
+                    else:
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return total
+
+
+def record_usage(project_dir, project_id):
+    """Project.disk_bytes nach einem Render neu erfassen."""
+    from .models import Project
+
+    Project.objects.filter(id=project_id).update(disk_bytes=directory_bytes(project_dir))
+
+
+def touch(project):
+    """Zugriff vermerken (LRU) — höchstens ein UPDATE pro TOUCH_INTERVAL."""
+    now = timezone.now()
+    if project.last_accessed_at is None or now - project.last_accessed_at >= TOUCH_INTERVAL:
+        type(project).objects.filter(pk=project.pk).update(last_accessed_at=now)
+        project.last_accessed_at = now
+
+
+def usage():
+    """Erfasste Belegung aller Sessions, deren Dateien noch da sind."""
+    from .models import Project
+
+    return Project.objects.filter(files_deleted=False).aggregate(total=Sum('disk_bytes'))['total'] or 0
+
+
+def evict_renders(project_dir, claim=lambda: True):
+    """Abgeleitete Bilder einer Session löschen, die PDFs bleiben. claim()
+    (das UPDATE auf renders_evicted) und das Löschen laufen unter derselben
+    Sperre wie views._restore_renders — ein Request mittendrin sähe sonst
+    halb gelöschte Renders als vollständig an. False, wenn claim() scheitert."""
+    uploads = project_dir / 'uploads'
+    if not uploads.is_dir():
+        return claim()
+    with page_images._exclusive(uploads / '.restore.lock'):
+        if not claim():
+            return False
+        for entry in list(os.scandir(uploads)):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in DERIVED_DIRS:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                elif entry.name.startswith(RENDER_PREFIXES):
+                    os.remove(entry.path)
+            except OSError:
+                continue
+    return True
+
+
+def enforce(dry_run=False):
+    """Über dem Budget: Renders der am längsten nicht benutzten Sessions
+    verdrängen, bis TARGET_RATIO des Budgets erreicht ist. Gibt (Sessions,
+    freigegebene Bytes) zurück; im dry-run geschätzt aus disk_bytes."""
+    from .models import Project
+
+    budget = budget_bytes()
+    total = usage()
+    if not budget or total <= budget:
+        return 0, 0
+    target = budget * TARGET_RATIO
+    cutoff = timezone.now() - MIN_IDLE
+    idle = Q(last_accessed_at__lt=cutoff) | Q(last_accessed_at__isnull=True, created_at__lt=cutoff)
+    candidates = (Project.objects
+                  .filter(idle, files_deleted=False, renders_evicted=False, disk_bytes__gt=0)
+                  .annotate(last_used=Coalesce('last_accessed_at', 'created_at'))
+                  .order_by('last_used')
+                  .values_list('id', 'disk_bytes'))
+
+    evicted, freed = 0, 0
+    for pk, disk_bytes in candidates.iterator(chunk_size=BATCH_SIZE):
+        if total - freed <= target:
+            break
+        project_dir = settings.PROJECTS_DIR / str(pk)
+        remaining = 0
+        if not dry_run:
+            # Erst beanspruchen, dann löschen: wurde die Session seit der
+            # Kandidatenabfrage wieder benutzt (oder von einem anderen Lauf
+            # schon verdrängt), trifft das UPDATE keine Zeile.
+            claim = Project.objects.filter(idle, pk=pk, renders_evicted=False)
+            if not evict_renders(project_dir, lambda: bool(claim.update(renders_evicted=True))):
+                continue
+            remaining = directory_bytes(project_dir)
+            Project.objects.filter(pk=pk).update(disk_bytes=remaining)
+        freed += max(0, disk_bytes - remaining)
+        evicted += 1
+
+    if not dry_run:
+        # Cache-Einträge, an denen jetzt keine Session mehr hängt
+        render_cache.evict(MIN_IDLE.total_seconds())
+    logger.info('Plattenbudget: %d Sessions verdrängt, %.1f MB frei (Budget %d MB)',
+                evicted, freed / 1024 / 1024, settings.PROJECTS_DISK_BUDGET_MB)
+    return evicted, freed
+
+
+def _run():
+    """Hintergrund-Lauf; eine Dateisperre hält parallele Worker fern."""
+    try:
+        settings.PROJECTS_DIR.mkdir(parents=True, exist_ok=True)
+        with open(settings.PROJECTS_DIR / '.disk_quota.lock', 'a') as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                enforce()
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+    except Exception:
+        logger.exception('Plattenbudget konnte nicht durchgesetzt werden')
+    finally:
+        connection.close()  # Verbindung des Threads nicht offen halten
+
+
+def schedule():
+    """Nach einem Upload: über dem Budget → enforce() in einem Hintergrund-Thread
+    (pro Prozess höchstens einer). Gibt True zurück, wenn gestartet."""
+    global _thread
+    if not budget_bytes() or usage() <= budget_bytes():
+        return False
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return False
+        _thread = threading.Thread(target=_run, name='disk-budget-evict', daemon=True)
+        _thread.start()
+    return True
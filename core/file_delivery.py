@@ -0,0 +1,166 @@
+"""
+Auslieferung geschützter Dateien (Seiten-Renders, Kacheln, Cloud-Projekte).
+
+Die View prüft nur noch den Zugriff (_get_project / _get_stored_project) und
+überlässt die Bytes dem Frontproxy — so belegt ein Bild-Download keinen
+gunicorn-Worker, der gerade eine Analyse rechnen könnte.
+
+settings.FILE_DELIVERY:
+    ''         – Python streamt die Datei selbst (Dev/runserver)
+    'accel'    – nginx: X-Accel-Redirect auf eine `internal`-Location
+    'sendfile' – Apache mod_xsendfile / lighttpd: X-Sendfile mit dem Dateipfad
+
+nginx (zu FILE_DELIVERY_ACCEL_LOCATIONS passend):
+    location /_protected/projects/ {
+        internal;
+        alias /opt/Planvision/projects/;
+    }
+    location /_protected/cloud/ {
+        internal;
+        alias /opt/Planvision/cloud_projects/;
+    }
+Cache-Control, Content-Type und Content-Disposition der Django-Antwort
+übernimmt nginx dabei unverändert.
+
+Bedingte Requests: jede Antwort trägt ETag (mtime+Grösse) und Last-Modified;
+If-None-Match / If-Modified-Since beantwortet schon Django mit 304 — ein
+unverändertes Cloud-Projekt (bis MAX_PROJECT_MB) kostet beim erneuten Öffnen
+also keinen Download. Byte-Ranges (abgebrochene Downloads fortsetzen) macht
+beim Handoff der Proxy, im Dev-Fallback ranged_response().
+"""
+import mimetypes
+import re
+from pathlib import Path
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def _accel_uri(path):
+    """Interne nginx-URI für `path` — None, wenn er unter keiner der
+    konfigurierten Locations liegt (dann streamt Python selbst)."""
+    resolved = Path(path).resolve()
+    for root, prefix in settings.FILE_DELIVERY_ACCEL_LOCATIONS.items():
+        try:
+            rel = resolved.relative_to(Path(root).resolve())
+        except ValueError:
+            continue
+        return prefix.rstrip('/') + '/' + quote(rel.as_posix())
+    return None
+
+
+def file_etag(stat):
+    """Starker ETag aus mtime (ns) und Grösse — ohne die Datei zu lesen.
+    Alle ausgelieferten Dateien werden nur per os.replace/Neuschreiben
+    geändert, das setzt die mtime neu."""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def not_modified(request, etag, last_modified=None):
+    """304 (bzw. 412 bei If-Match) für bedingte Requests, sonst None."""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        response['ETag'] = etag
+    return response
+
+
+def _requested_range(request, size, etag, last_modified):
+    """(start, end) des angefragten Byte-Bereichs (end exklusiv), None = ganze
+    Datei. start >= end heisst: nicht erfüllbar (416).
+
+    Nur ein einzelner Bereich — mehrteilige Ranges (multipart/byteranges)
+    braucht kein Client hier, sie werden wie ungültige ignoriert (RFC 9110
+    erlaubt das). If-Range mit veraltetem Validator → ganze Datei.
+    """
+    match = RANGE_RE.fullmatch(request.headers.get('Range', '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        return None
+    first, last = match.groups()
+    if not first:
+        return max(size - int(last), 0) if int(last) else size, size
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    return start, min(int(last) + 1, size) if last else size
+
+
+def ranged_response(request, size, read, content_type, etag, last_modified=None,
+                    as_attachment=False, filename=''):
+    """Streaming-Antwort mit ETag, 304-Behandlung und Byte-Ranges.
+
+    `read(start, end)` liefert die Bytes [start, end) als Iterator — so lässt
+    sich nicht nur eine Datei, sondern jede Byte-Quelle bekannter Grösse
+    ausliefern.
+    """
+    unchanged = not_modified(request, etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+    byte_range = _requested_range(request, size, etag, last_modified)
+    if byte_range is None:
+        start, end, status = 0, size, 200
+    else:
+        start, end = byte_range
+        if start >= end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        status = 206
+    response = StreamingHttpResponse(read(start, end), status=status, content_type=content_type)
+    response['Content-Length'] = str(end - start)
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if as_attachment:
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+
+def _read_file(path):
+    def read(start, end):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(FileResponse.block_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    return read
+
+
+def file_response(request, path, content_type=None, as_attachment=False, filename=None):
+    """Antwort, die `path` ausliefert — je nach FILE_DELIVERY über den
+    Frontproxy oder (Fallback) direkt aus Python."""
+    stat = Path(path).stat()
+    etag, last_modified = file_etag(stat), int(stat.st_mtime)
+    content_type = content_type or mimetypes.guess_type(str(path))[0] or 'application/octet-stream'
+    filename = filename or Path(path).name
+
+    mode = settings.FILE_DELIVERY
+    accel_uri = _accel_uri(path) if mode == 'accel' else None
+    if mode == 'sendfile' or accel_uri:
+        unchanged = not_modified(request, etag, last_modified)
+        if unchanged is not None:
+            return unchanged
+        response = HttpResponse(content_type=content_type)
+        if accel_uri:
+            response['X-Accel-Redirect'] = accel_uri
+        else:
+            response['X-Sendfile'] = str(Path(path).resolve())
+        if as_attachment:
+            response['Content-Disposition'] = content_disposition_header(True, filename)
+        return response
+    return ranged_response(request, stat.st_size, _read_file(path), content_type, etag,
+                           last_modified, as_attachment=as_attachment, filename=filename)
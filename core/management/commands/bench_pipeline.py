@@ -0,0 +1,205 @@
+"""
+End-to-End-Benchmark der Analyse-Pipeline im Prozess — ohne HTTP, ohne
+Parallelität (dafür gibt es scripts/loadtest.py).
+
+Jede PDF eines Referenz-Korpus wird wie beim Upload gerendert (pdf2image,
+PDF_DPI, JPEG_QUALITY) und jede Seite wie von analyze_page analysiert
+(model_handler.predict_image: preprocess → inference → snap → NMS, mit
+StageTimings). Ausgegeben werden Median/p95/Summe pro Schritt, Durchsatz
+(Seiten/s inkl. Rendern), Spitzen-RSS und die Treffer pro Seite; mit
+--output zusätzlich als JSON.
+
+Zwei solche JSON-Läufe (z.B. vor/nach einer Config-Änderung oder einem
+Modellwechsel) vergleicht --diff: Schritte, Durchsatz, Speicher und die
+Seiten, deren Trefferzahl sich geändert hat.
+
+Aufruf:
+    python manage.py bench_pipeline pfad/zum/korpus --output vorher.json
+    python manage.py bench_pipeline pfad/zum/korpus --max-pages 3 --label neues-modell --output nachher.json
+    python manage.py bench_pipeline --diff vorher.json nachher.json
+
+Auf dem Zielrechner laufen lassen (CPU-Server ≠ Dev-PC mit GPU); der erste
+Lauf nach dem Start enthält das Laden des Modells (Schritt load_model).
+"""
+import io
+import json
+import statistics
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pdf2image import convert_from_path
+from PyPDF2 import PdfReader
+
+import model_handler
+from model_handler import StageTimings, _peak_rss_mb, predict_image
+
+# Klassen-IDs -> Kürzel (wie debug_snap)
+LABEL_NAMES = {0: 'BG', 1: 'Fenster', 2: 'Tür', 3: 'Wand', 4: 'Gaube', 5: 'Dach'}
+
+
+def _p95(values):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+
+def summarize(pages, wall_s, peak_rss_mb):
+    """Kennzahlen eines Laufs aus den einzelnen Seiten."""
+    stages = {}
+    for page in pages:
+        for name, ms in [('render', page['render_ms'])] + list(page['stages'].items()):
+            stages.setdefault(name, []).append(ms)
+    return {
+        'pages': len(pages),
+        'wall_s': round(wall_s, 2),
+        'pages_per_s': round(len(pages) / wall_s, 3) if wall_s else None,
+        'peak_rss_mb': peak_rss_mb,
+        'detections': sum(page['detections'] for page in pages),
+        'stages': {
+            name: {'median_ms': round(statistics.median(ms), 1), 'p95_ms': _p95(ms), 'total_ms': round(sum(ms), 1)}
+            for name, ms in stages.items()
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = "Misst die Analyse-Pipeline (Rendern bis NMS) über einen Korpus von Referenz-PDFs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', nargs='?', help='Verzeichnis mit Referenz-PDFs (rekursiv)')
+        parser.add_argument('--max-pages', type=int, default=0, help='höchstens N Seiten pro PDF (0 = alle)')
+        parser.add_argument('--dpi', type=int, default=settings.PDF_DPI)
+        parser.add_argument('--plan-scale', type=float, default=100)
+        parser.add_argument('--threshold', type=float, default=0.5)
+        parser.add_argument('--label', default='', help='Name des Laufs (erscheint im Vergleich)')
+        parser.add_argument('--output', help='Ergebnis als JSON hierhin schreiben')
+        parser.add_argument('--diff', nargs=2, metavar=('VORHER', 'NACHHER'),
+                            help='zwei JSON-Läufe vergleichen statt zu messen')
+
+    def handle(self, *args, **options):
+        if options['diff']:
+            runs = []
+            for path in options['diff']:
+                try:
+                    runs.append(json.loads(Path(path).read_text()))
+                except (OSError, ValueError) as e:
+                    raise CommandError(f"{path}: {e}")
+            self.print_diff(*runs)
+            return
+
+        if not options['corpus']:
+            raise CommandError("Korpus-Verzeichnis oder --diff angeben.")
+        corpus = Path(options['corpus'])
+        pdfs = sorted(corpus.rglob('*.pdf')) if corpus.is_dir() else []
+        if not pdfs:
+            raise CommandError(f"Keine PDFs in {corpus} gefunden.")
+
+        pages = []
+        wall_start = time.perf_counter()
+        for pdf in pdfs:
+            pages.extend(self.bench_pdf(pdf, corpus, options))
+        wall_s = time.perf_counter() - wall_start
+
+        run = {
+            'meta': {
+                'label': options['label'] or datetime.now().strftime('%Y-%m-%d %H:%M'),
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'model': Path(model_handler.MODEL_PATH).name,
+                'device': str(model_handler.device),
+                'afterprocess': model_handler.AFTERPROCESS,
+                'snap': model_handler.resolved_snap_options(),
+                'dpi': options['dpi'],
+                'threshold': options['threshold'],
+                'plan_scale': options['plan_scale'],
+            },
+            'summary': summarize(pages, wall_s, _peak_rss_mb()),
+            'pages': pages,
+        }
+        self.print_run(run)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(run, indent=2, ensure_ascii=False))
+            self.stdout.write(f"Geschrieben: {options['output']}")
+
+    def bench_pdf(self, pdf, corpus, options):
+        page_sizes = [(float(p.mediabox.width) * 0.352778, float(p.mediabox.height) * 0.352778)
+                      for p in PdfReader(str(pdf)).pages]
+        last_page = options['max_pages'] or None
+        start = time.perf_counter()
+        images = convert_from_path(str(pdf), dpi=options['dpi'], last_page=last_page)
+        # Rendern ist ein Aufruf pro PDF — auf die Seiten verteilt
+        render_ms = round((time.perf_counter() - start) * 1000 / max(len(images), 1), 1)
+
+        results = []
+        for number, image in enumerate(images, start=1):
+            # Wie beim Upload: die Analyse bekommt das gespeicherte JPEG
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=settings.JPEG_QUALITY, optimize=True)
+            timings = StageTimings()
+            boxes, labels, scores, areas = predict_image(
+                buffer.getvalue(),
+                format_size=page_sizes[number - 1],
+                dpi=options['dpi'],
+                plan_scale=options['plan_scale'],
+                threshold=options['threshold'],
+                timings=timings,
+            )
+            page = {
+                'pdf': str(pdf.relative_to(corpus)),
+                'page': number,
+                'width': timings.info.get('width'),
+                'height': timings.info.get('height'),
+                'detections': len(boxes),
+                'labels': dict(Counter(LABEL_NAMES.get(int(label), str(label)) for label in labels)),
+                'render_ms': render_ms,
+                'stages': {name: stage['ms'] for name, stage in timings.stages.items()},
+            }
+            results.append(page)
+            self.stdout.write(f"  {page['pdf']} S.{number}: {page['detections']} Treffer, "
+                              f"{sum(page['stages'].values()) + render_ms:.0f} ms")
+        del images
+        model_handler.cleanup_memory()
+        return results
+
+    def print_run(self, run):
+        summary = run['summary']
+        self.stdout.write(f"\n── {run['meta']['label']} ({run['meta']['model']}, {run['meta']['device']}) ──")
+        self.stdout.write(f"{'Schritt':<12} {'Median':>9} {'p95':>9} {'Summe':>10}")
+        for name, stage in summary['stages'].items():
+            self.stdout.write(f"{name:<12} {stage['median_ms']:>7.1f}ms {stage['p95_ms']:>7.1f}ms "
+                              f"{stage['total_ms'] / 1000:>9.1f}s")
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['pages']} Seiten in {summary['wall_s']:.1f}s = {summary['pages_per_s']} Seiten/s, "
+            f"{summary['detections']} Treffer, Spitzen-RSS {summary['peak_rss_mb']} MB"
+        ))
+
+    def print_diff(self, before, after):
+        a, b = before['summary'], after['summary']
+        self.stdout.write(f"Vorher:  {before['meta']['label']} ({before['meta']['model']})")
+        self.stdout.write(f"Nachher: {after['meta']['label']} ({after['meta']['model']})\n")
+        self.stdout.write(f"{'Schritt (Median)':<18} {'vorher':>9} {'nachher':>9} {'Faktor':>8}")
+        for name in dict.fromkeys(list(a['stages']) + list(b['stages'])):
+            old, new = a['stages'].get(name, {}).get('median_ms'), b['stages'].get(name, {}).get('median_ms')
+            ratio = f"{new / old:.2f}×" if old and new is not None else '–'
+            self.stdout.write(f"{name:<18} {_fmt(old, 'ms'):>9} {_fmt(new, 'ms'):>9} {ratio:>8}")
+        for key, unit in [('pages_per_s', '/s'), ('peak_rss_mb', 'MB'), ('detections', '')]:
+            self.stdout.write(f"{key:<18} {_fmt(a.get(key), unit):>9} {_fmt(b.get(key), unit):>9}")
+
+        old_pages = {(p['pdf'], p['page']): p for p in before['pages']}
+        changed = []
+        for page in after['pages']:
+            old = old_pages.get((page['pdf'], page['page']))
+            if old and old['detections'] != page['detections']:
+                changed.append((page['pdf'], page['page'], old['detections'], page['detections']))
+        if changed:
+            self.stdout.write(f"\nTrefferzahl geändert auf {len(changed)} Seiten:")
+            for pdf, number, old, new in changed:
+                self.stdout.write(f"  {pdf} S.{number}: {old} → {new}")
+        else:
+            self.stdout.write("\nTrefferzahl auf allen gemeinsamen Seiten unverändert.")
+
+
+def _fmt(value, unit):
+    return '–' if value is None else f"{value:g}{unit}"
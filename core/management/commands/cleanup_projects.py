@@ -10,22 +10,51 @@ Verhalten:
   - Löscht projects/<uuid>/, wenn die zugehörige Project-Zeile älter als N Tage ist,
     und setzt Project.files_deleted=True (die DB-Zeile bleibt für die Statistik).
   - Verwaiste Ordner ohne Project-Zeile werden nach Verzeichnis-mtime gelöscht.
+  - Abgebrochene fortsetzbare Uploads (ChunkedUpload, älter als
+    core.chunked_upload.EXPIRY) samt Teildatei.
+  - Render-Cache-Einträge (core/render_cache.py), an denen keine Session
+    mehr hängt und die N Tage nicht benutzt wurden.
+  - Mit --enforce-budget: über PROJECTS_DISK_BUDGET_MB die Renders der am
+    längsten nicht benutzten Sessions verdrängen (core/disk_quota.py).
+
+Inkrementell: Projekte werden in Batches à BATCH_SIZE abgearbeitet (ein
+UPDATE pro Batch statt einem save() pro Zeile, die SQLite-Schreibsperre wird
+nur kurz gehalten), die Ordner von --workers Threads parallel gelöscht. Nach
+--max-dirs Ordnern oder --time-budget Sekunden ist Schluss; was liegen bleibt,
+übernimmt der nächste Lauf (files_deleted=True markiert das Erledigte).
 
 Aufruf:
-    python manage.py cleanup_projects [--days N] [--dry-run]
+    python manage.py cleanup_projects [--days N] [--dry-run] [--max-dirs N]
+        [--time-budget SEK] [--workers N] [--enforce-budget] [-v 2]
 
-Cron (Server, täglich 03:00):
-    0 3 * * * cd /opt/Planvision && env/bin/python manage.py cleanup_projects \
+Cron (Server, stündlich):
+    17 * * * * cd /opt/Planvision && env/bin/python manage.py cleanup_projects \
         >> /var/log/planvision_cleanup.log 2>&1
 """
+import os
 import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.utils import timezone
 
-from core.models import Project
+from core import chunked_upload, disk_quota, render_cache
+from core.models import ChunkedUpload, Project
+
+BATCH_SIZE = 500
+
+
+def _project_id(name):
+    """Ordnername -> Project-PK; None, wenn es keine UUID ist (dann kann es
+    auch keine Project-Zeile dazu geben)."""
+    try:
+        return uuid.UUID(name)
+    except ValueError:
+        return None
 
 
 class Command(BaseCommand):
@@ -40,57 +69,141 @@ class Command(BaseCommand):
             '--dry-run', action='store_true',
             help='Nur anzeigen, was gelöscht würde – nichts verändern.',
         )
+        parser.add_argument(
+            '--max-dirs', type=int, default=settings.CLEANUP_MAX_DIRS,
+            help='Höchstens N Ordner pro Lauf löschen, 0 = unbegrenzt (Default: settings.CLEANUP_MAX_DIRS).',
+        )
+        parser.add_argument(
+            '--time-budget', type=float, default=settings.CLEANUP_TIME_BUDGET,
+            help='Nach so vielen Sekunden keinen neuen Batch beginnen, 0 = unbegrenzt '
+                 '(Default: settings.CLEANUP_TIME_BUDGET).',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Threads für das Löschen der Ordner (Default: 4).',
+        )
+        parser.add_argument(
+            '--enforce-budget', action='store_true',
+            help='Zusätzlich das Plattenbudget (settings.PROJECTS_DISK_BUDGET_MB) per LRU durchsetzen.',
+        )
 
     def handle(self, *args, **options):
         days = options['days']
-        dry_run = options['dry_run']
+        self.dry_run = options['dry_run']
+        self.max_dirs = options['max_dirs']
+        self.deadline = time.monotonic() + options['time_budget'] if options['time_budget'] else None
+        self.verbose = options['verbosity'] >= 2
+        self.deleted_dirs = 0
         cutoff = timezone.now() - timedelta(days=days)
         projects_dir = settings.PROJECTS_DIR
 
-        prefix = '[dry-run] ' if dry_run else ''
+        self.prefix = prefix = '[dry-run] ' if self.dry_run else ''
         self.stdout.write(f"{prefix}Cleanup projects/ – älter als {days} Tage (cutoff {cutoff:%Y-%m-%d %H:%M}).")
 
         if not projects_dir.exists():
             self.stdout.write("projects/ existiert nicht – nichts zu tun.")
             return
 
-        # Bekannte, abgelaufene Projekte (Dateien noch vorhanden).
-        expired = Project.objects.filter(created_at__lt=cutoff, files_deleted=False)
-        known_ids = set(str(pk) for pk in Project.objects.values_list('id', flat=True))
-
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as self.pool:
+            removed = self.expire_projects(projects_dir, cutoff)
+            orphans = self.remove_orphans(projects_dir, cutoff.timestamp())
+
+        # Abgebrochene Uploads (Teildateien liegen auch ausserhalb von projects/).
+        stale_uploads = ChunkedUpload.objects.filter(created_at__lt=timezone.now() - chunked_upload.EXPIRY)
+        stale_count = 0
+        for upload in stale_uploads.iterator():
+            stale_count += 1
+            if not self.dry_run:
+                chunked_upload.discard(upload)
+
+        # Render-Cache: erst nach dem Löschen der Sessions, deren Hardlinks
+        # den Eintrag sonst noch als benutzt ausweisen.
+        evicted = render_cache.evict(days * 86400, dry_run=self.dry_run)
+
+        if options['enforce_budget']:
+            sessions, freed = disk_quota.enforce(dry_run=self.dry_run)
+            self.stdout.write(f"{prefix}Plattenbudget: Renders von {sessions} Sessions verdrängt, "
+                              f"{freed / 1024 / 1024:.1f} MB frei.")
+
+        summary = (f"{prefix}Fertig: {removed} abgelaufene Projekt-Ordner, {orphans} verwaiste Ordner, "
+                   f"{stale_count} abgebrochene Uploads, {evicted} Render-Cache-Einträge.")
+        if self.exhausted():
+            summary += " Limit erreicht – Rest im nächsten Lauf."
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def exhausted(self):
+        """--max-dirs oder --time-budget aufgebraucht?"""
+        if self.max_dirs and self.deleted_dirs >= self.max_dirs:
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remove_dirs(self, paths):
+        """Ordner parallel löschen (bzw. im dry-run nur auflisten)."""
+        if not self.dry_run:
+            list(self.pool.map(lambda path: shutil.rmtree(path, ignore_errors=True), paths))
+        self.deleted_dirs += len(paths)
+        if self.verbose:
+            for path in paths:
+                self.stdout.write(f"  {self.prefix}entfernt: {os.path.basename(path)}")
+
+    def expire_projects(self, projects_dir, cutoff):
+        """Abgelaufene Projekte, deren Dateien noch da sind, batchweise:
+        Ordner löschen, dann ein UPDATE für den ganzen Batch."""
+        expired = (Project.objects.filter(created_at__lt=cutoff, files_deleted=False)
+                   .order_by('created_at').values_list('id', flat=True))
         removed = 0
-        freed_dirs = []
-
-        for project in expired.iterator():
-            path = projects_dir / str(project.id)
-            if path.exists():
-                freed_dirs.append(path)
-                if not dry_run:
-                    shutil.rmtree(path, ignore_errors=True)
-            if not dry_run:
-                project.files_deleted = True
-                project.save(update_fields=['files_deleted'])
-            removed += 1
-
-        # Verwaiste Ordner ohne Project-Zeile: nach Verzeichnis-mtime.
-        orphan_cutoff_ts = cutoff.timestamp()
+        batch = []
+        # Im dry-run bleibt files_deleted=False – über die Batches iterieren
+        # statt immer wieder die ersten BATCH_SIZE Zeilen abzufragen.
+        ids = expired.iterator(chunk_size=BATCH_SIZE)
+        while not self.exhausted():
+            batch = [pk for _, pk in zip(range(self.batch_limit()), ids)]
+            if not batch:
+                break
+            paths = []
+            for pk in batch:
+                path = os.path.join(projects_dir, str(pk))
+                if os.path.isdir(path):
+                    paths.append(path)
+            self.remove_dirs(paths)
+            if not self.dry_run:
+                Project.objects.filter(id__in=batch).update(files_deleted=True)
+            removed += len(batch)
+        return removed
+
+    def remove_orphans(self, projects_dir, cutoff_ts):
+        """Ordner ohne Project-Zeile (nach Verzeichnis-mtime). Die Existenz
+        wird pro Batch mit einer Abfrage geprüft statt alle IDs zu laden."""
         orphans = 0
-        for entry in projects_dir.iterdir():
-            if not entry.is_dir() or entry.name in known_ids:
-                continue
-            try:
-                mtime = entry.stat().st_mtime
-            except OSError:
-                continue
-            if mtime < orphan_cutoff_ts:
-                freed_dirs.append(entry)
-                orphans += 1
-                if not dry_run:
-                    shutil.rmtree(entry, ignore_errors=True)
-
-        for path in freed_dirs:
-            self.stdout.write(f"  {prefix}entfernt: {path.name}")
-
-        self.stdout.write(self.style.SUCCESS(
-            f"{prefix}Fertig: {removed} abgelaufene Projekt-Ordner, {orphans} verwaiste Ordner."
-        ))
+        candidates = []
+
+        def flush():
+            nonlocal orphans
+            ids = [pk for pk in (_project_id(entry.name) for entry in candidates) if pk is not None]
+            known = {str(pk) for pk in Project.objects.filter(id__in=ids).values_list('id', flat=True)}
+            paths = [entry.path for entry in candidates if str(_project_id(entry.name)) not in known]
+            self.remove_dirs(paths)
+            orphans += len(paths)
+            candidates.clear()
+
+        with os.scandir(projects_dir) as entries:
+            for entry in entries:
+                if self.exhausted():
+                    break
+                try:
+                    if not entry.is_dir(follow_symlinks=False) or entry.stat().st_mtime >= cutoff_ts:
+                        continue
+                except OSError:
+                    continue
+                candidates.append(entry)
+                if len(candidates) >= self.batch_limit():
+                    flush()
+        if candidates:
+            flush()
+        return orphans
+
+    def batch_limit(self):
+        """Batchgrösse, gekappt auf die restlichen --max-dirs."""
+        if not self.max_dirs:
+            return BATCH_SIZE
+        return max(1, min(BATCH_SIZE, self.max_dirs - self.deleted_dirs))
@@ -0,0 +1,142 @@
+"""
+Kopiert eine bestehende SQLite-Datenbank in die konfigurierte Datenbank
+(gedacht: Umzug auf PostgreSQL, siehe DJANGO_DB_ENGINE in config/settings.py).
+
+Ablauf beim Umzug:
+    1. App stoppen (keine Schreibzugriffe mehr auf db.sqlite3), Backup ziehen
+    2. Ziel-DB anlegen und migrieren:
+           DJANGO_DB_ENGINE=postgresql ... python manage.py migrate
+    3. Daten kopieren:
+           DJANGO_DB_ENGINE=postgresql ... python manage.py copy_sqlite_to_db db.sqlite3
+    4. App mit DJANGO_DB_ENGINE=postgresql starten
+
+Kopiert werden alle Tabellen aller installierten Apps mit unveränderten
+Primärschlüsseln (Sessions inklusive — niemand wird ausgeloggt), in einer
+Transaktion; danach werden die Sequenzen der Ziel-DB nachgezogen. Beide DBs
+müssen auf demselben Migrationsstand sein. Die Ziel-DB muss leer sein
+(abgesehen von dem, was `migrate` selbst anlegt: ContentTypes/Permissions
+werden ersetzt).
+"""
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.migrations.executor import MigrationExecutor
+
+SOURCE_ALIAS = 'sqlite_source'
+BATCH_SIZE = 2000
+# Legt `migrate` in der Ziel-DB selbst an — werden durch die Quelle ersetzt.
+# Reihenfolge = Löschreihenfolge (abhängige Tabellen zuerst: Permission
+# verweist auf ContentType).
+REPLACED_ON_TARGET = ('auth.permission', 'contenttypes.contenttype')
+
+
+@contextmanager
+def _keep_timestamps(models):
+    """auto_now/auto_now_add würden beim Einfügen die Originalzeiten
+    überschreiben — für die Dauer der Kopie abschalten."""
+    fields = [f for model in models for f in model._meta.local_fields
+              if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = "Kopiert eine SQLite-Datenbank in die konfigurierte (leere, migrierte) Datenbank."
+
+    def add_arguments(self, parser):
+        parser.add_argument('sqlite_path', help='Pfad der Quell-Datenbank (db.sqlite3).')
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Ziel-Datenbank-Alias (Default: default).',
+        )
+
+    def handle(self, *args, **options):
+        source_path = Path(options['sqlite_path'])
+        if not source_path.is_file():
+            raise CommandError(f"{source_path} nicht gefunden.")
+        target = options['database']
+        # Quelle nur für diesen Lauf registrieren, nicht in settings.DATABASES
+        source = SQLiteDatabaseWrapper({
+            **connections[target].settings_dict,
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': str(source_path),
+            'OPTIONS': {},
+            'CONN_MAX_AGE': 0,
+        }, alias=SOURCE_ALIAS)
+        connections[SOURCE_ALIAS] = source
+        try:
+            self._check_migrations(target)
+            models = [m for m in apps.get_models(include_auto_created=True)
+                      if m._meta.managed and not m._meta.proxy]
+            self._check_target_empty(models, target)
+            with _keep_timestamps(models), transaction.atomic(using=target):
+                self._clear_replaced(models, target)
+                total = sum(self._copy(model, target) for model in models)
+                self._reset_sequences(models, target)
+        finally:
+            source.close()
+            del connections[SOURCE_ALIAS]
+        self.stdout.write(self.style.SUCCESS(
+            f"Fertig: {total} Zeilen aus {len(models)} Tabellen nach '{target}' kopiert."
+        ))
+
+    def _check_migrations(self, target):
+        applied = [set(MigrationExecutor(connections[alias]).loader.applied_migrations)
+                   for alias in (SOURCE_ALIAS, target)]
+        if applied[0] != applied[1]:
+            raise CommandError(
+                "Quelle und Ziel haben nicht denselben Migrationsstand — "
+                "beide mit `manage.py migrate` auf den aktuellen Stand bringen.")
+
+    def _check_target_empty(self, models, target):
+        filled = [m._meta.label for m in models
+                  if m._meta.label_lower not in REPLACED_ON_TARGET and m._base_manager.using(target).exists()]
+        if filled:
+            raise CommandError(f"Ziel-DB ist nicht leer ({', '.join(filled)}).")
+
+    def _clear_replaced(self, models, target):
+        """Von `migrate` angelegte Zeilen vor der Kopie entfernen — mit rohem
+        DELETE: das ORM-delete() kaskadiert (ContentType → Permission →
+        User-/Gruppen-Permissions) und würde sonst schon kopierte Zeilen
+        wieder löschen."""
+        by_label = {m._meta.label_lower: m for m in models}
+        connection = connections[target]
+        with connection.cursor() as cursor:
+            for label in REPLACED_ON_TARGET:
+                if label in by_label:
+                    cursor.execute(f'DELETE FROM {connection.ops.quote_name(by_label[label]._meta.db_table)}')
+
+    def _copy(self, model, target):
+        # Fremdschlüssel prüft Postgres erst beim Commit (DEFERRABLE INITIALLY
+        # DEFERRED) — die Reihenfolge der Tabellen spielt daher keine Rolle.
+        manager = model._base_manager
+        copied, batch = 0, []
+        for obj in manager.using(SOURCE_ALIAS).order_by('pk').iterator(chunk_size=BATCH_SIZE):
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                manager.using(target).bulk_create(batch)
+                copied, batch = copied + len(batch), []
+        if batch:
+            manager.using(target).bulk_create(batch)
+            copied += len(batch)
+        if copied:
+            self.stdout.write(f"  {model._meta.db_table}: {copied}")
+        return copied
+
+    def _reset_sequences(self, models, target):
+        connection = connections[target]
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
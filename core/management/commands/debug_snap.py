@@ -21,6 +21,16 @@ unterscheidung ist dort wirkungslos. Dieses Tool rechnet bewusst auf dem FARB-
 Render, damit --ink-mode (schwarz/rot vs. jede Farbe) sichtbar wird; das ist das
 *vorgeschlagene* Verhalten, das man vor einer Produktionsumstellung hier prüft.
 
+Detektions-Cache: die rohen KI-Boxen je Seite landen in <out>/.detections/
+(Schlüssel: SHA-256 der PDF, Seite, DPI, Modelldatei, --threshold). Ein
+erneuter Lauf mit anderem --select/--search/--min-darkness/--ink-mode rechnet
+nur noch Snap und Overlay — das Modell läuft erst wieder, wenn sich PDF, DPI,
+Schwelle oder Modell ändern (oder mit --no-cache; nötig nach Änderungen an
+preprocess_image, die der Schlüssel nicht sieht).
+
+Mehrseitige PDFs: --jobs N verteilt die Seiten auf N Prozesse (jeder lädt das
+Modell selbst — RAM beachten; die Torch-Threads werden aufgeteilt).
+
 Aufruf:
     python manage.py debug_snap pfad/zur/datei.pdf
     python manage.py debug_snap datei.pdf --page 3 --search 16 --min-darkness 25
@@ -29,11 +39,18 @@ Aufruf:
     python manage.py debug_snap datei.pdf --crops                # zusätzlich Zoom-Crops je Box
     python manage.py debug_snap datei.pdf --ink-bg --min-darkness 120  # Hintergrund = was die Schwelle übriglässt
     python manage.py debug_snap datei.pdf --auto-darkness --crops      # adaptive Schwelle pro Kante (Option B)
+    python manage.py debug_snap datei.pdf --jobs 4               # Seiten parallel
+    python manage.py debug_snap datei.pdf --no-cache             # Modell neu laufen lassen
 
 Benötigt PyMuPDF (fitz):  pip install PyMuPDF
 """
 
+import hashlib
 import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -43,6 +60,8 @@ from django.conf import settings
 import torch
 from torchvision import transforms
 
+import model_handler
+from core.render_cache import pdf_digest
 from model_handler import load_model, resize_image_if_large
 from image_preprocessing import preprocess_image
 from utils import refine_boxes_to_lines, _find_lines, _snap_edge, _ink_from_image, _resolve_darkness
@@ -51,6 +70,12 @@ from utils import refine_boxes_to_lines, _find_lines, _snap_edge, _ink_from_imag
 # Klassen-IDs -> Kürzel (vgl. CLAUDE.md: 6 Klassen inkl. Background)
 LABEL_NAMES = {0: 'BG', 1: 'Fenster', 2: 'Tür', 3: 'Wand', 4: 'Gaube', 5: 'Dach'}
 
+CACHE_DIR_NAME = '.detections'
+# Optionen, die ein Seiten-Job braucht (die übrigen, z.B. stdout, lassen sich
+# nicht an einen Pool-Prozess übergeben)
+PAGE_OPTIONS = ('dpi', 'threshold', 'search', 'min_darkness', 'ink_mode', 'select', 'only_windows',
+                'crops', 'ink_bg', 'auto_darkness')
+
 
 def _raw_boxes(image_bytes, threshold):
     """
@@ -176,6 +201,153 @@ def _auto_ink_mask(ink, boxes, search):
     return mask
 
 
+def _model_tag():
+    """Identität der Modelldatei (Name, Grösse, mtime) — ein neues Modell
+    macht die gecachten Detektionen ungültig."""
+    path = Path(model_handler.MODEL_PATH)
+    try:
+        st = path.stat()
+    except OSError:
+        return path.name
+    return f'{path.name}:{st.st_size}:{st.st_mtime_ns}'
+
+
+def _cache_path(cache_dir, digest, pno, dpi, threshold):
+    """Cache-Datei der rohen Detektionen einer Seite."""
+    key = hashlib.sha256(json.dumps([_model_tag(), dpi, threshold]).encode()).hexdigest()[:12]
+    return Path(cache_dir) / f'{digest[:16]}_p{pno + 1}_{key}.npz'
+
+
+def _detections(render, threshold, cache_path=None):
+    """Rohe Detektionen (boxes, labels, scores, aus_cache) der gerenderten
+    Seite — aus cache_path, sonst per _raw_boxes und dann dort abgelegt."""
+    if cache_path is not None and cache_path.exists():
+        try:
+            with np.load(cache_path) as data:
+                return data['boxes'], data['labels'], data['scores'], True
+        except (OSError, ValueError, KeyError):
+            pass  # kaputte Datei: neu rechnen und überschreiben
+
+    buf = io.BytesIO()
+    render.save(buf, format='PNG')
+    _gray, boxes, labels, scores = _raw_boxes(buf.getvalue(), threshold)
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_name(f'.{cache_path.name}.{os.getpid()}.tmp')
+        with open(tmp, 'wb') as f:
+            np.savez(f, boxes=boxes, labels=labels, scores=scores)
+        os.replace(tmp, cache_path)
+    return boxes, labels, scores, False
+
+
+def _init_worker(threads):
+    """Pool-Prozess (spawn): Django einrichten — CoreConfig.ready lädt dabei
+    das Modell — und die Torch-Threads unter den Prozessen aufteilen."""
+    import django
+    django.setup()
+    torch.set_num_threads(threads)
+
+
+def _process_page(pdf_path, pno, opts, out_dir, cache_path):
+    """Eine Seite rendern, erkennen (bzw. aus dem Cache), snappen und die
+    Overlays schreiben. Läuft im Hauptprozess oder in einem Pool-Prozess;
+    gibt die Kennzahlen für die Zusammenfassung zurück."""
+    import fitz  # PyMuPDF
+    from PIL import Image, ImageDraw
+
+    search, min_darkness = opts['search'], opts['min_darkness']
+    scale_px = opts['dpi'] / 72.0
+    with fitz.open(str(pdf_path)) as doc:
+        pix = doc[pno].get_pixmap(matrix=fitz.Matrix(scale_px, scale_px), alpha=False)
+    render = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+    boxes, labels, scores, cached = _detections(render, opts['threshold'], cache_path)
+
+    if opts['only_windows'] and len(boxes):
+        m = labels == 1
+        boxes, labels, scores = boxes[m], labels[m], scores[m]
+
+    # Wichtig: Snap/Ink auf dem FARB-Render (nicht der Graustufe aus
+    # preprocess_image) – nur so können die Farbmodi schwarz/rot von
+    # bunten Hilfslinien trennen. Geometrie identisch (gleiche Auflösung).
+    color = np.array(render)
+    # 'auto' = adaptive Schwelle pro Kante (Option B), sonst fester Wert
+    md_param = 'auto' if opts['auto_darkness'] else min_darkness
+    refined = refine_boxes_to_lines(boxes, color, search=search,
+                                    min_darkness=md_param, ink_mode=opts['ink_mode'],
+                                    select=opts['select'])
+    ink = _ink_from_image(color, opts['ink_mode'])
+
+    # Optional: Hintergrund durch das geschwellte Bild ersetzen, um zu sehen,
+    # welche Linien der Snap "sieht". Erst NACH Inferenz/ink-Berechnung – das
+    # Modell bekommt weiterhin den echten Plan.
+    if opts['ink_bg']:
+        if opts['auto_darkness']:
+            # adaptive Schwelle pro Band anwenden (nur in den Such-Bändern)
+            mask = _auto_ink_mask(ink, boxes, search)
+        else:
+            mask = np.where(ink >= min_darkness, 0, 255).astype(np.uint8)
+        render = Image.fromarray(mask, mode='L').convert('RGB')
+
+    draw = ImageDraw.Draw(render)
+    page_moved = 0
+    deltas = []
+
+    for i, box in enumerate(boxes):
+        x1, y1, x2, y2 = (float(v) for v in box)
+        rx1, ry1, rx2, ry2 = (float(v) for v in refined[i])
+
+        edges = _edge_lines(ink, box, search, md_param, opts['select'])
+
+        # Suchbänder + Linien je Kante zeichnen
+        def draw_h_edge(info):
+            band_lo, band_hi, found, chosen = info
+            draw.rectangle([x1, band_lo, x2, band_hi], outline=(80, 120, 255), width=1)
+            for p in found:
+                draw.line([x1, p, x2, p], fill=(255, 150, 0), width=1)
+            if chosen is not None:
+                draw.line([x1, chosen, x2, chosen], fill=(0, 200, 0), width=2)
+
+        def draw_v_edge(info):
+            band_lo, band_hi, found, chosen = info
+            draw.rectangle([band_lo, y1, band_hi, y2], outline=(80, 120, 255), width=1)
+            for p in found:
+                draw.line([p, y1, p, y2], fill=(255, 150, 0), width=1)
+            if chosen is not None:
+                draw.line([chosen, y1, chosen, y2], fill=(0, 200, 0), width=2)
+
+        if 'top' in edges:    draw_h_edge(edges['top'])
+        if 'bottom' in edges: draw_h_edge(edges['bottom'])
+        if 'left' in edges:   draw_v_edge(edges['left'])
+        if 'right' in edges:  draw_v_edge(edges['right'])
+
+        # Boxen oben drauf
+        draw.rectangle([x1, y1, x2, y2], outline=(220, 0, 0), width=2)        # roh
+        draw.rectangle([rx1, ry1, rx2, ry2], outline=(0, 160, 0), width=2)    # gesnappt
+
+        edge_deltas = (abs(rx1 - x1), abs(ry1 - y1), abs(rx2 - x2), abs(ry2 - y2))
+        deltas.extend(edge_deltas)
+        if max(edge_deltas) >= 0.5:
+            page_moved += 1
+
+        if opts['crops']:
+            m = search + 8
+            cl, ct = max(0, int(min(x1, rx1) - m)), max(0, int(min(y1, ry1) - m))
+            cr, cb = int(max(x2, rx2) + m), int(max(y2, ry2) + m)
+            crop = render.crop((cl, ct, cr, cb))
+            z = max(1, int(round(400 / max(1, max(cr - cl, cb - ct)))))
+            if z > 1:
+                crop = crop.resize((crop.width * z, crop.height * z), Image.NEAREST)
+            name = LABEL_NAMES.get(int(labels[i]), str(labels[i]))
+            crop.save(out_dir / f"page_{pno + 1}_box{i:02d}_{name}.png")
+
+    out_png = out_dir / f"page_{pno + 1}.png"
+    render.save(out_png)
+    return {'page': pno + 1, 'boxes': len(boxes), 'moved': page_moved, 'deltas': deltas,
+            'out': out_png.name, 'cached': cached}
+
+
 class Command(BaseCommand):
     help = 'Visualisiert den Snap-to-Line (refine_boxes_to_lines) zur Diagnose von Box-Versatz.'
 
@@ -203,13 +375,18 @@ class Command(BaseCommand):
                             help='min-darkness ignorieren und die Schwelle pro Kante adaptiv aus '
                                  'dem Suchband ableiten (Option B, siehe utils._auto_darkness)')
         parser.add_argument('--out', type=str, default='', help='Ausgabeordner für Overlay-PNGs')
+        parser.add_argument('--jobs', type=int, default=1,
+                            help='Seiten auf N Prozesse verteilen (jeder lädt das Modell)')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Detektionen nicht aus dem Cache lesen, sondern neu rechnen (und ablegen)')
+        parser.add_argument('--cache-dir', type=str, default='',
+                            help=f'Ordner des Detektions-Caches (Default: <out>/{CACHE_DIR_NAME})')
 
     def handle(self, *args, **opts):
         try:
             import fitz  # PyMuPDF
         except ImportError:
             raise CommandError("PyMuPDF fehlt. Installieren mit:  pip install PyMuPDF")
-        from PIL import Image, ImageDraw
 
         pdf_path = Path(opts['pdf']).expanduser()
         if not pdf_path.exists():
@@ -218,116 +395,53 @@ class Command(BaseCommand):
         out_dir = Path(opts['out']) if opts['out'] else Path(str(pdf_path.with_suffix('')) + '_snapdiag')
         out_dir.mkdir(parents=True, exist_ok=True)
 
-        dpi, search, min_darkness = opts['dpi'], opts['search'], opts['min_darkness']
-        scale_px = dpi / 72.0
+        min_darkness = opts['min_darkness']
+        with fitz.open(str(pdf_path)) as doc:
+            page_count = len(doc)
+        pages = []
+        for pno in ([opts['page'] - 1] if opts['page'] else range(page_count)):
+            if pno < 0 or pno >= page_count:
+                self.stderr.write(f"Seite {pno + 1} ausserhalb des Bereichs – übersprungen")
+                continue
+            pages.append(pno)
 
-        doc = fitz.open(str(pdf_path))
-        pages = [opts['page'] - 1] if opts['page'] else range(len(doc))
+        cache_dir = Path(opts['cache_dir']) if opts['cache_dir'] else out_dir / CACHE_DIR_NAME
+        digest = pdf_digest(pdf_path)
+        page_opts = {key: opts[key] for key in PAGE_OPTIONS}
+        tasks = []
+        for pno in pages:
+            cache_path = _cache_path(cache_dir, digest, pno, opts['dpi'], opts['threshold'])
+            if opts['no_cache'] and cache_path.exists():
+                cache_path.unlink()
+            tasks.append((pdf_path, pno, page_opts, out_dir, cache_path))
+
+        jobs = max(1, min(opts['jobs'], len(tasks)))
+        if jobs > 1:
+            # spawn statt fork: der Elternprozess hat Torch schon initialisiert
+            pool = ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker,
+                                       initargs=(max(1, (os.cpu_count() or 1) // jobs),))
+            results = pool.map(_process_page, *zip(*tasks))
+        else:
+            pool = None
+            results = (_process_page(*task) for task in tasks)
 
-        tot_boxes = tot_moved = 0
+        tot_boxes = tot_moved = tot_cached = 0
         # Offset-Statistik je Kante (Betrag der Verschiebung in px)
         deltas = []
-
-        for pno in pages:
-            if pno < 0 or pno >= len(doc):
-                self.stderr.write(f"Seite {pno + 1} ausserhalb des Bereichs – übersprungen")
-                continue
-            page = doc[pno]
-            pix = page.get_pixmap(matrix=fitz.Matrix(scale_px, scale_px), alpha=False)
-            render = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
-            buf = io.BytesIO()
-            render.save(buf, format='PNG')
-
-            _gray, boxes, labels, scores = _raw_boxes(buf.getvalue(), opts['threshold'])
-
-            if opts['only_windows'] and len(boxes):
-                m = labels == 1
-                boxes, labels, scores = boxes[m], labels[m], scores[m]
-
-            # Wichtig: Snap/Ink auf dem FARB-Render (nicht der Graustufe aus
-            # preprocess_image) – nur so können die Farbmodi schwarz/rot von
-            # bunten Hilfslinien trennen. Geometrie identisch (gleiche Auflösung).
-            color = np.array(render)
-            # 'auto' = adaptive Schwelle pro Kante (Option B), sonst fester Wert
-            md_param = 'auto' if opts['auto_darkness'] else min_darkness
-            refined = refine_boxes_to_lines(boxes, color, search=search,
-                                            min_darkness=md_param, ink_mode=opts['ink_mode'],
-                                            select=opts['select'])
-            ink = _ink_from_image(color, opts['ink_mode'])
-
-            # Optional: Hintergrund durch das geschwellte Bild ersetzen, um zu sehen,
-            # welche Linien der Snap "sieht". Erst NACH Inferenz/ink-Berechnung – das
-            # Modell bekommt weiterhin den echten Plan.
-            if opts['ink_bg']:
-                if opts['auto_darkness']:
-                    # adaptive Schwelle pro Band anwenden (nur in den Such-Bändern)
-                    mask = _auto_ink_mask(ink, boxes, search)
-                else:
-                    mask = np.where(ink >= min_darkness, 0, 255).astype(np.uint8)
-                render = Image.fromarray(mask, mode='L').convert('RGB')
-
-            draw = ImageDraw.Draw(render)
-            page_moved = 0
-
-            for i, box in enumerate(boxes):
-                x1, y1, x2, y2 = (float(v) for v in box)
-                rx1, ry1, rx2, ry2 = (float(v) for v in refined[i])
-
-                edges = _edge_lines(ink, box, search, md_param, opts['select'])
-                for band_lo, band_hi, found, chosen in edges.values():
-                    pass  # gezeichnet unten je Orientierung
-
-                # Suchbänder + Linien je Kante zeichnen
-                def draw_h_edge(info):
-                    band_lo, band_hi, found, chosen = info
-                    draw.rectangle([x1, band_lo, x2, band_hi], outline=(80, 120, 255), width=1)
-                    for p in found:
-                        draw.line([x1, p, x2, p], fill=(255, 150, 0), width=1)
-                    if chosen is not None:
-                        draw.line([x1, chosen, x2, chosen], fill=(0, 200, 0), width=2)
-
-                def draw_v_edge(info):
-                    band_lo, band_hi, found, chosen = info
-                    draw.rectangle([band_lo, y1, band_hi, y2], outline=(80, 120, 255), width=1)
-                    for p in found:
-                        draw.line([p, y1, p, y2], fill=(255, 150, 0), width=1)
-                    if chosen is not None:
-                        draw.line([chosen, y1, chosen, y2], fill=(0, 200, 0), width=2)
-
-                if 'top' in edges:    draw_h_edge(edges['top'])
-                if 'bottom' in edges: draw_h_edge(edges['bottom'])
-                if 'left' in edges:   draw_v_edge(edges['left'])
-                if 'right' in edges:  draw_v_edge(edges['right'])
-
-                # Boxen oben drauf
-                draw.rectangle([x1, y1, x2, y2], outline=(220, 0, 0), width=2)        # roh
-                draw.rectangle([rx1, ry1, rx2, ry2], outline=(0, 160, 0), width=2)    # gesnappt
-
-                edge_deltas = (abs(rx1 - x1), abs(ry1 - y1), abs(rx2 - x2), abs(ry2 - y2))
-                moved = max(edge_deltas) >= 0.5
-                deltas.extend(edge_deltas)
-                tot_boxes += 1
-                if moved:
-                    tot_moved += 1
-                    page_moved += 1
-
-                if opts['crops']:
-                    m = search + 8
-                    cl, ct = max(0, int(min(x1, rx1) - m)), max(0, int(min(y1, ry1) - m))
-                    cr, cb = int(max(x2, rx2) + m), int(max(y2, ry2) + m)
-                    crop = render.crop((cl, ct, cr, cb))
-                    z = max(1, int(round(400 / max(1, max(cr - cl, cb - ct)))))
-                    if z > 1:
-                        crop = crop.resize((crop.width * z, crop.height * z), Image.NEAREST)
-                    name = LABEL_NAMES.get(int(labels[i]), str(labels[i]))
-                    crop.save(out_dir / f"page_{pno + 1}_box{i:02d}_{name}.png")
-
-            out_png = out_dir / f"page_{pno + 1}.png"
-            render.save(out_png)
-            self.stdout.write(
-                f"Seite {pno + 1}: {len(boxes)} Boxen, {page_moved} verschoben → {out_png.name}")
-
-        doc.close()
+        try:
+            for result in results:
+                tot_boxes += result['boxes']
+                tot_moved += result['moved']
+                tot_cached += result['cached']
+                deltas.extend(result['deltas'])
+                cache_note = " (Detektionen aus Cache)" if result['cached'] else ""
+                self.stdout.write(
+                    f"Seite {result['page']}: {result['boxes']} Boxen, {result['moved']} verschoben "
+                    f"→ {result['out']}{cache_note}")
+        finally:
+            if pool is not None:
+                pool.shutdown()
 
         self.stdout.write("")
         if tot_boxes:
@@ -345,6 +459,7 @@ class Command(BaseCommand):
             self.stdout.write(
                 f"Overlays: {out_dir}   (ink-mode: {opts['ink_mode']}, select: {opts['select']}, "
                 f"min-darkness: {dark_note}{bg_note})")
+            self.stdout.write(f"Detektionen aus Cache: {tot_cached}/{len(tasks)} Seiten ({cache_dir})")
             self.stdout.write(
                 "Legende: rot=KI-Box, grün=gesnappt, blau=Suchband, "
                 "orange=gefundene Linie, grün-dick=gewählte Linie")
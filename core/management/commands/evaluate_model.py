@@ -0,0 +1,329 @@
+"""
+Genauigkeits- und Laufzeit-Gate für Änderungen an Modell und Snap-to-Line.
+
+Statt eine neue Modelldatei, AFTERPROCESS oder eine andere select-Strategie
+nur mit debug_snap anzuschauen, läuft hier die volle Pipeline
+(model_handler.predict_image) über einen gelabelten Datensatz — dasselbe
+Format, das train_model.WindowDataset liest:
+
+    [{"image": "plan_01.jpg",
+      "annotations": [{"bbox": [x1, y1, x2, y2], "category_id": 1}, …]}, …]
+
+Gemessen werden:
+    mAP@0.5 und mAP@[.5:.95]   pro Klasse (all-point AP), gemittelt
+    mittlere IoU               der Treffer (gleiche Klasse, IoU ≥ --iou)
+    Kantenversatz              |vorhergesagte − gelabelte Kante| in px über
+                               alle vier Kanten der Treffer (Mittel, p95) —
+                               genau das, was der Snap verbessern soll
+    Laufzeit                   pro Bild (Median, p95) und pro Schritt
+
+Das Gate schlägt fehl (Exit-Code 1), wenn ein absolutes Budget gerissen
+wird (--min-map50, --max-edge-error, --max-p95-ms) oder — mit --baseline
+(ein früherer --output) — die Genauigkeit stärker fällt bzw. die Laufzeit
+stärker wächst als erlaubt.
+
+Aufruf:
+    python manage.py evaluate_model bilder/ annotations.json --output baseline.json
+    python manage.py evaluate_model bilder/ annotations.json --select second_inner --baseline baseline.json
+    python manage.py evaluate_model bilder/ annotations.json --no-snap --output ohne_snap.json
+    python manage.py evaluate_model bilder/ annotations.json --model fasterrcnn_model/neu.pth \\
+        --baseline baseline.json --max-latency-growth 0.1
+
+Baseline und Vergleich auf demselben Rechner laufen lassen (Laufzeit!).
+"""
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+import model_handler
+from model_handler import StageTimings, predict_image
+
+COCO_IOUS = [round(0.5 + 0.05 * i, 2) for i in range(10)]
+SELECTS = ['second_inner', 'nearest', 'edge', 'outer_near', 'innermost', 'outermost']
+INK_MODES = ['black', 'black_red', 'red', 'min']
+
+
+def min_darkness(value):
+    """--min-darkness: 'auto' oder eine Zahl (Schwelle 0-255)."""
+    if value == 'auto':
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Zahl oder 'auto' erwartet, nicht {value!r}")
+
+
+def box_iou(a, b):
+    """IoU-Matrix zwischen den Boxen a (N,4) und b (M,4)."""
+    a, b = np.asarray(a, dtype=np.float64).reshape(-1, 4), np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
+
+
+def match(pred, gt, iou_threshold):
+    """Greedy nach Score: jede Vorhersage bekommt die beste noch freie
+    Label-Box gleicher Klasse mit IoU ≥ iou_threshold.
+    pred: (boxes, labels, scores), gt: (boxes, labels).
+    Gibt [(pred_index, gt_index, iou)] zurück."""
+    p_boxes, p_labels, p_scores = pred
+    g_boxes, g_labels = gt
+    if not len(p_boxes) or not len(g_boxes):
+        return []
+    ious = box_iou(p_boxes, g_boxes)
+    ious[np.asarray(p_labels)[:, None] != np.asarray(g_labels)[None, :]] = 0.0
+    taken, pairs = set(), []
+    for i in np.argsort(-np.asarray(p_scores), kind='stable'):
+        candidates = [(ious[i, j], j) for j in range(len(g_boxes)) if j not in taken and ious[i, j] >= iou_threshold]
+        if candidates:
+            iou, j = max(candidates)
+            taken.add(j)
+            pairs.append((int(i), j, float(iou)))
+    return pairs
+
+
+def average_precision(results, label, iou_threshold):
+    """All-point AP einer Klasse über alle Bilder (None ohne Label-Boxen)."""
+    n_gt = sum(int(np.sum(np.asarray(r['gt_labels']) == label)) for r in results)
+    if n_gt == 0:
+        return None
+    scored = []  # (score, TP?)
+    for r in results:
+        keep = np.asarray(r['labels']) == label
+        pred = (np.asarray(r['boxes']).reshape(-1, 4)[keep], np.asarray(r['labels'])[keep],
+                np.asarray(r['scores'])[keep])
+        gt_keep = np.asarray(r['gt_labels']) == label
+        gt = (np.asarray(r['gt_boxes']).reshape(-1, 4)[gt_keep], np.asarray(r['gt_labels'])[gt_keep])
+        matched = {i for i, _j, _iou in match(pred, gt, iou_threshold)}
+        scored.extend((float(score), i in matched) for i, score in enumerate(pred[2]))
+    if not scored:
+        return 0.0
+    scored.sort(key=lambda s: -s[0])
+    tp = np.cumsum([hit for _score, hit in scored])
+    fp = np.cumsum([not hit for _score, hit in scored])
+    recall = tp / n_gt
+    precision = tp / np.maximum(tp + fp, 1)
+    # Precision-Hüllkurve (monoton fallend), dann Fläche über den Recall-Stufen
+    precision = np.concatenate([[0.0], precision, [0.0]])
+    recall = np.concatenate([[0.0], recall, [recall[-1]]])
+    for k in range(len(precision) - 2, -1, -1):
+        precision[k] = max(precision[k], precision[k + 1])
+    steps = np.where(recall[1:] != recall[:-1])[0]
+    return float(np.sum((recall[steps + 1] - recall[steps]) * precision[steps + 1]))
+
+
+def evaluate(results, iou_threshold=0.5):
+    """Genauigkeits- und Laufzeitkennzahlen aus den Ergebnissen pro Bild
+    (boxes/labels/scores, gt_boxes/gt_labels, ms, stages)."""
+    labels = sorted({int(label) for r in results for label in r['gt_labels']})
+    ap50 = {label: average_precision(results, label, 0.5) for label in labels}
+    ap_coco = {label: statistics.mean(average_precision(results, label, t) for t in COCO_IOUS) for label in labels}
+
+    ious, offsets = [], []
+    for r in results:
+        pred = (np.asarray(r['boxes']).reshape(-1, 4), r['labels'], r['scores'])
+        gt_boxes = np.asarray(r['gt_boxes']).reshape(-1, 4)
+        for i, j, iou in match(pred, (gt_boxes, r['gt_labels']), iou_threshold):
+            ious.append(iou)
+            offsets.extend(np.abs(pred[0][i] - gt_boxes[j]).tolist())
+
+    ms = sorted(r['ms'] for r in results)
+    stages = {}
+    for r in results:
+        for name, stage_ms in r['stages'].items():
+            stages.setdefault(name, []).append(stage_ms)
+    return {
+        'images': len(results),
+        'map50': round(statistics.mean(ap50.values()), 4) if ap50 else None,
+        'map50_95': round(statistics.mean(ap_coco.values()), 4) if ap_coco else None,
+        'ap50_per_class': {str(label): round(ap, 4) for label, ap in ap50.items()},
+        'mean_iou': round(statistics.mean(ious), 4) if ious else None,
+        'matched': len(ious),
+        'ground_truth': sum(len(r['gt_labels']) for r in results),
+        'predictions': sum(len(r['labels']) for r in results),
+        'edge_error_px': round(statistics.mean(offsets), 2) if offsets else None,
+        'edge_error_p95_px': round(float(np.percentile(offsets, 95)), 2) if offsets else None,
+        'latency_median_ms': round(statistics.median(ms), 1) if ms else None,
+        'latency_p95_ms': round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 1) if ms else None,
+        'stages_median_ms': {name: round(statistics.median(v), 1) for name, v in stages.items()},
+    }
+
+
+def check_budgets(metrics, options, baseline=None):
+    """Liste der verletzten Budgets (leer = bestanden)."""
+    failures = []
+
+    def below(key, limit, text):
+        if limit is not None and metrics[key] is not None and metrics[key] < limit:
+            failures.append(f"{text}: {metrics[key]} < {limit}")
+
+    def above(key, limit, text):
+        if limit is not None and metrics[key] is not None and metrics[key] > limit:
+            failures.append(f"{text}: {metrics[key]} > {limit}")
+
+    below('map50', options['min_map50'], 'mAP@0.5 unter Budget')
+    above('edge_error_px', options['max_edge_error'], 'Kantenversatz über Budget (px)')
+    above('latency_p95_ms', options['max_p95_ms'], 'Laufzeit p95 über Budget (ms)')
+    if baseline:
+        for key, text in [('map50', 'mAP@0.5'), ('map50_95', 'mAP@[.5:.95]'), ('mean_iou', 'mittlere IoU')]:
+            if baseline.get(key) is not None:
+                below(key, round(baseline[key] - options['max_map_drop'], 4), f'{text} gegenüber Baseline gefallen')
+        if baseline.get('edge_error_px') is not None:
+            above('edge_error_px', round(baseline['edge_error_px'] + options['max_edge_growth'], 2),
+                  'Kantenversatz gegenüber Baseline gestiegen (px)')
+        if baseline.get('latency_median_ms'):
+            above('latency_median_ms', round(baseline['latency_median_ms'] * (1 + options['max_latency_growth']), 1),
+                  'Laufzeit (Median) gegenüber Baseline gestiegen (ms)')
+    return failures
+
+
+class Command(BaseCommand):
+    help = "Misst mAP/IoU/Kantenversatz und Laufzeit auf einem gelabelten Datensatz; schlägt bei Regression fehl."
+
+    def add_arguments(self, parser):
+        parser.add_argument('image_folder')
+        parser.add_argument('annotation_file', help='JSON im Format von train_model.WindowDataset')
+        parser.add_argument('--threshold', type=float, default=0.5, help='Score-Schwelle wie in analyze_page')
+        parser.add_argument('--iou', type=float, default=0.5, help='IoU ab der eine Vorhersage als Treffer zählt')
+        parser.add_argument('--limit', type=int, default=0, help='nur die ersten N Bilder')
+        # Varianten der Pipeline
+        parser.add_argument('--model', help='andere Modelldatei (.pth) statt model_handler.MODEL_PATH')
+        parser.add_argument('--no-snap', action='store_true', help='AFTERPROCESS aus (rohe Netz-Boxen)')
+        parser.add_argument('--select', choices=SELECTS, help='Snap-Strategie (Default: SNAP_OPTIONS)')
+        parser.add_argument('--ink-mode', choices=INK_MODES)
+        parser.add_argument('--search', type=int)
+        parser.add_argument('--min-darkness', type=min_darkness, help="Zahl oder 'auto'")
+        # Budgets
+        parser.add_argument('--min-map50', type=float)
+        parser.add_argument('--max-edge-error', type=float, help='mittlerer Kantenversatz in px')
+        parser.add_argument('--max-p95-ms', type=float, help='Laufzeit p95 pro Bild')
+        parser.add_argument('--baseline', help='früherer --output zum Vergleich')
+        parser.add_argument('--max-map-drop', type=float, default=0.01,
+                            help='erlaubter Rückgang von mAP/IoU gegenüber der Baseline (Default 0.01)')
+        parser.add_argument('--max-edge-growth', type=float, default=0.5,
+                            help='erlaubter Anstieg des Kantenversatzes in px (Default 0.5)')
+        parser.add_argument('--max-latency-growth', type=float, default=0.2,
+                            help='erlaubter Anstieg der Median-Laufzeit (Default 0.2 = 20%%)')
+        parser.add_argument('--output', help='Kennzahlen (und Konfiguration) als JSON schreiben')
+
+    def handle(self, *args, **options):
+        try:
+            annotations = json.loads(Path(options['annotation_file']).read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Annotationen nicht lesbar: {e}")
+        if options['limit']:
+            annotations = annotations[:options['limit']]
+        baseline = None
+        if options['baseline']:
+            try:
+                baseline = json.loads(Path(options['baseline']).read_text())['metrics']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Baseline nicht lesbar: {e}")
+
+        config = self.configure(options)
+        try:
+            results = [self.run_image(entry, options) for entry in annotations]
+        finally:
+            self.restore()
+        results = [r for r in results if r is not None]
+        if not results:
+            raise CommandError("Keine auswertbaren Bilder.")
+
+        metrics = evaluate(results, options['iou'])
+        self.print_metrics(metrics, baseline)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps({'config': config, 'metrics': metrics}, indent=2))
+            self.stdout.write(f"Geschrieben: {options['output']}")
+
+        failures = check_budgets(metrics, options, baseline)
+        if failures:
+            raise CommandError("Gate nicht bestanden:\n  " + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Gate bestanden."))
+
+    def configure(self, options):
+        """Pipeline-Variante einstellen (model_handler-Globals), restore() setzt zurück."""
+        self._saved = (model_handler.MODEL_PATH, model_handler.model, model_handler.AFTERPROCESS,
+                       dict(model_handler.SNAP_OPTIONS))
+        if options['model']:
+            if not Path(options['model']).exists():
+                raise CommandError(f"Modelldatei nicht gefunden: {options['model']}")
+            model_handler.MODEL_PATH = str(Path(options['model']).resolve())
+            model_handler.model = None
+            # Jetzt laden, nicht im ersten Bild — sonst steckt die Ladezeit
+            # in dessen ms und bei wenigen Bildern im p95 (--max-p95-ms).
+            try:
+                model_handler.load_model()
+            except Exception as e:
+                self.restore()
+                raise CommandError(f"Modell nicht ladbar: {e}")
+        if options['no_snap']:
+            model_handler.AFTERPROCESS = False
+        for key in ('select', 'ink_mode', 'search', 'min_darkness'):
+            if options[key] is not None:
+                model_handler.SNAP_OPTIONS[key] = options[key]
+        return {
+            'model': Path(model_handler.MODEL_PATH).name,
+            'afterprocess': model_handler.AFTERPROCESS,
+            'snap': model_handler.resolved_snap_options(),
+            'threshold': options['threshold'],
+            'iou': options['iou'],
+            'images': options['annotation_file'],
+        }
+
+    def restore(self):
+        model_path, model, model_handler.AFTERPROCESS, snap = self._saved
+        if model_handler.MODEL_PATH != model_path:
+            model_handler.MODEL_PATH, model_handler.model = model_path, model
+        model_handler.SNAP_OPTIONS.clear()
+        model_handler.SNAP_OPTIONS.update(snap)
+
+    def run_image(self, entry, options):
+        path = Path(options['image_folder']) / entry['image']
+        if not path.exists():
+            self.stderr.write(f"Bild nicht gefunden, übersprungen: {path}")
+            return None
+        timings = StageTimings()
+        start = time.perf_counter()
+        boxes, labels, scores, _areas = predict_image(path.read_bytes(), threshold=options['threshold'],
+                                                      timings=timings)
+        # Laden des Modells (falls noch nicht geschehen) ist keine Laufzeit pro Bild
+        ms = (time.perf_counter() - start) * 1000 - timings.stages.get('load_model', {}).get('ms', 0)
+        return {
+            'boxes': np.asarray(boxes, dtype=np.float64).reshape(-1, 4),
+            'labels': [int(label) for label in labels],
+            'scores': [float(score) for score in scores],
+            'gt_boxes': [a['bbox'] for a in entry['annotations']],
+            'gt_labels': [int(a['category_id']) for a in entry['annotations']],
+            'ms': ms,
+            'stages': {name: stage['ms'] for name, stage in timings.stages.items()},
+        }
+
+    def print_metrics(self, metrics, baseline):
+        def row(key, text):
+            value = metrics[key]
+            old = baseline.get(key) if baseline else None
+            diff = f"  (Baseline {old})" if old is not None else ''
+            self.stdout.write(f"{text:<26} {value}{diff}")
+
+        self.stdout.write(f"{metrics['images']} Bilder, {metrics['ground_truth']} Label-Boxen, "
+                          f"{metrics['predictions']} Vorhersagen, {metrics['matched']} Treffer")
+        row('map50', 'mAP@0.5')
+        row('map50_95', 'mAP@[.5:.95]')
+        row('mean_iou', 'mittlere IoU')
+        row('edge_error_px', 'Kantenversatz Ø (px)')
+        row('edge_error_p95_px', 'Kantenversatz p95 (px)')
+        row('latency_median_ms', 'Laufzeit Median (ms)')
+        row('latency_p95_ms', 'Laufzeit p95 (ms)')
+        stages = ' '.join(f"{name}={ms:g}" for name, ms in metrics['stages_median_ms'].items())
+        self.stdout.write(f"{'Schritte (Median, ms)':<26} {stages}")
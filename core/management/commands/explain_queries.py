@@ -0,0 +1,106 @@
+"""
+Prüft die Query-Pläne der heissen Abfragen (EXPLAIN bzw. EXPLAIN QUERY PLAN)
+und meldet Full-Table-Scans und Sortierungen ohne Index.
+
+Gedacht nach Modell-/Query-Änderungen und gegen eine Kopie der Produktiv-DB:
+fehlt ein Index, wächst die Antwortzeit linear mit der Tabelle, was man mit
+der kleinen Dev-DB nicht merkt. Postgres wählt auf fast leeren Tabellen
+auch mit Index einen Seq Scan; dort wird für die Prüfung enable_seqscan
+abgeschaltet — gemeldet wird dann nur, was ohne Index gar nicht anders geht.
+
+Aufruf:
+    python manage.py explain_queries            # Pläne ausgeben, Scans markieren
+    python manage.py explain_queries --strict   # Exit-Code 1 bei unerwarteten Scans (CI)
+"""
+import re
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from accounts.models import Subscription
+from core.models import AnalysisEvent, ChunkedUpload, DailyStat, Project, SessionDay, StoredProject
+
+# SQLite: "SCAN core_project" ohne "USING (COVERING) INDEX"; Postgres: "Seq Scan on …"
+FULL_SCAN_RE = re.compile(r'\bSCAN (?!.*\bINDEX\b)(\w+)|Seq Scan on (\w+)')
+TEMP_SORT_RE = re.compile(r'USE TEMP B-TREE FOR ORDER BY')
+
+
+def hot_queries():
+    """(Name, QuerySet, Scan erwartet) — Scan erwartet heisst: die Abfrage
+    liest ihrer Natur nach die ganze (kleine bzw. Rollup-)Tabelle."""
+    user = User(pk=1)
+    now = timezone.now()
+    today = timezone.localdate()
+    return [
+        ('Projektzugriff (_get_project)',
+         Project.objects.filter(id='00000000-0000-0000-0000-000000000000', user=user).order_by('pk')[:1], False),
+        ('Cloud-Liste (cloud_list)', StoredProject.objects.filter(user=user).defer('manifest'), False),
+        ('Cloud-Projekt (_get_stored_project)',
+         StoredProject.objects.filter(id='00000000-0000-0000-0000-000000000000', user=user).order_by('pk')[:1],
+         False),
+        ('Subscription (subscription_for)', Subscription.objects.filter(user=user), False),
+        ('Cleanup: abgelaufene Projekte',
+         Project.objects.filter(created_at__lt=now - timedelta(days=14), files_deleted=False), False),
+        ('Cleanup: abgebrochene Uploads', ChunkedUpload.objects.filter(created_at__lt=now - timedelta(days=1)), False),
+        ('Statistik: Uploads heute', Project.objects.filter(created_at__gte=now - timedelta(days=1)), False),
+        ('Statistik: Analysen heute', AnalysisEvent.objects.filter(created_at__gte=now - timedelta(days=1)), False),
+        ('Rollup: Analysen pro Tag',
+         AnalysisEvent.objects.filter(created_at__gte=now - timedelta(days=1), created_at__lt=now)
+         .annotate(day=TruncDate('created_at')).values('day').annotate(n=Count('id')), False),
+        ('Rollup: Sessions pro Tag',
+         AnalysisEvent.objects.filter(created_at__gte=now - timedelta(days=1), created_at__lt=now)
+         .exclude(session_key='').values_list('session_key').distinct().order_by(), False),
+        ('Statistik: Tage pro Session',
+         SessionDay.objects.values('session_key').annotate(days=Count('day')).order_by(), True),
+        ('Statistik: Rollup-Summen', DailyStat.objects.filter(day__gt=today - timedelta(days=30)), True),
+        ('Blob-GC (referenced_blobs)',
+         StoredProject.objects.exclude(manifest=None).order_by().values_list('manifest'), True),
+    ]
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN der heissen Abfragen; markiert Full-Table-Scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Mit Fehler beenden, wenn eine Abfrage unerwartet die ganze Tabelle liest.',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Datenbank: {connection.vendor}")
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            plans = [(name, queryset.explain(), scan_expected) for name, queryset, scan_expected in hot_queries()]
+
+        problems = []
+        for name, plan, scan_expected in plans:
+            scans = sorted({table for match in FULL_SCAN_RE.finditer(plan) for table in match.groups() if table})
+            unsorted = bool(TEMP_SORT_RE.search(plan))
+            if (scans or unsorted) and not scan_expected:
+                problems.append(name)
+                status = self.style.ERROR('SCAN')
+            else:
+                status = self.style.SUCCESS('ok')
+            self.stdout.write(f"\n[{status}] {name}")
+            for line in plan.splitlines():
+                self.stdout.write(f"    {line}")
+            if scans:
+                self.stdout.write(f"    → Full Scan: {', '.join(scans)}" + (' (erwartet)' if scan_expected else ''))
+            if unsorted:
+                self.stdout.write("    → Sortierung ohne Index (temporärer B-Tree)")
+
+        if not problems:
+            self.stdout.write(self.style.SUCCESS(f"\nFertig: {len(plans)} Abfragen, keine unerwarteten Scans."))
+            return
+        message = f"{len(problems)} Abfrage(n) ohne passenden Index: {', '.join(problems)}"
+        if options['strict']:
+            raise CommandError(message)
+        self.stdout.write(self.style.WARNING(f"\n{message}"))
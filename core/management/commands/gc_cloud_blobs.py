@@ -0,0 +1,82 @@
+"""
+Räumt den Blob-Store der Online-Ablage auf (core/cloud_store.py).
+
+Ein Blob bleibt liegen, solange ein StoredProject-Manifest auf ihn verweist.
+Unreferenzierte Blobs (überschriebene Projektstände, abgebrochene
+Delta-Saves) werden erst nach einer Schonfrist gelöscht: ein gerade
+laufender Delta-Save frischt die mtime seiner wiederverwendeten Blobs auf,
+hat sein Manifest aber evtl. noch nicht gespeichert. Dasselbe gilt für die
+Vorschaubilder unter thumbs/ (benannt nach dem Blob des Seitenbilds).
+
+Aufruf:
+    python manage.py gc_cloud_blobs [--grace-hours N] [--dry-run]
+
+Cron (Server, täglich 03:30, nach cleanup_projects):
+    30 3 * * * cd /opt/Planvision && env/bin/python manage.py gc_cloud_blobs \
+        >> /var/log/planvision_cleanup.log 2>&1
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import cloud_store
+
+
+class Command(BaseCommand):
+    help = "Löscht unreferenzierte Blobs der Online-Ablage (nach Schonfrist)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=int, default=24,
+            help='Blobs jünger als N Stunden bleiben liegen (Default: 24).',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Nur anzeigen, was gelöscht würde – nichts verändern.',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        prefix = '[dry-run] ' if dry_run else ''
+        blobs_dir = cloud_store.blobs_dir()
+        if not blobs_dir.exists():
+            self.stdout.write("Kein Blob-Store vorhanden – nichts zu tun.")
+            return
+
+        cutoff = time.time() - options['grace_hours'] * 3600
+        # Erst die Liste der Blobs, dann die Referenzen: ein Blob, der zwischen
+        # beiden Schritten referenziert wird, ist jung und fällt unter die Schonfrist.
+        candidates = []
+        with os.scandir(blobs_dir) as shards:
+            for shard in shards:
+                if not shard.is_dir(follow_symlinks=False):
+                    # .tmp-* aus abgebrochenen Uploads
+                    candidates.append(shard)
+                    continue
+                with os.scandir(shard.path) as blobs:
+                    candidates.extend(blobs)
+        thumbs_dir = cloud_store.thumbs_dir()
+        if thumbs_dir.exists():
+            with os.scandir(thumbs_dir) as thumbs:
+                candidates.extend(thumbs)
+        referenced = cloud_store.referenced_blobs()
+
+        removed = freed = 0
+        for blob in candidates:
+            if blob.name.removesuffix('.webp') in referenced:
+                continue
+            try:
+                stat = blob.stat()
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime >= cutoff:
+                continue
+            removed += 1
+            freed += stat.st_size
+            if not dry_run:
+                os.unlink(blob.path)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Fertig: {removed} Blobs entfernt ({freed / 1024 / 1024:.1f} MB)."
+        ))
@@ -0,0 +1,42 @@
+"""
+Verdichtet Uploads und Analysen pro Tag für /statistik (core/stats.py).
+
+Die Statistik-Seite verdichtet fehlende Tage beim Aufruf selbst; der Cron
+hält die Rollups trotzdem aktuell, damit der erste Aufruf des Tages nicht
+die Arbeit macht. Gestern wird dabei immer neu gerechnet: AnalysisEvents
+kommen gepuffert an (core/tracking.py), ein Rollup kurz nach Mitternacht kann
+die letzten Events des Vortags noch nicht gesehen haben. Mit --days werden
+weitere Tage neu gerechnet (z.B. nach dem Löschen eines Kontos oder nach einer
+Korrektur der Rohdaten).
+
+Aufruf:
+    python manage.py rollup_stats              # gestern neu, fehlende Tage dazu
+    python manage.py rollup_stats --days 30    # die letzten 30 Tage neu
+
+Cron (Server, täglich 00:15):
+    15 0 * * * cd /opt/Planvision && env/bin/python manage.py rollup_stats \
+        >> /var/log/planvision_cleanup.log 2>&1
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import stats
+
+
+class Command(BaseCommand):
+    help = "Verdichtet Uploads/Analysen pro Tag für die Statistik-Seite."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=1,
+            help='Die letzten N abgeschlossenen Tage neu verdichten (Default: 1 = gestern).',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['days'] > 0:
+            since = timezone.localdate() - timedelta(days=options['days'])
+        rolled = stats.rollup(since=since)
+        self.stdout.write(self.style.SUCCESS(f"Fertig: {rolled} Tage verdichtet."))
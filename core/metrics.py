@@ -0,0 +1,273 @@
+"""
+Prometheus-Metriken der Analyse-Pipeline (Text-Exposition unter /metrics),
+ohne zusätzliche Abhängigkeit.
+
+gunicorn hat mehrere Worker-Prozesse: jeder sammelt seine Werte im Speicher
+und schreibt sie atomar nach METRICS_DIR/<pid>.json — Histogramme höchstens
+alle METRICS_FLUSH_SECONDS (was dazwischen anfällt, schreibt ein Timer nach),
+Gauges bei jeder Änderung, alles beim Beenden. /metrics liest alle Dateien
+und führt sie zusammen — Histogramme über alle Prozesse, auch beendete (sonst
+würden die Zähler beim Worker-Neustart zurückspringen), Gauges nur über
+laufende.
+Ohne METRICS_DIR (Dev, Tests) zeigt /metrics nur den eigenen Prozess.
+METRICS_DIR beim Deploy leeren (ExecStartPre=/bin/rm -rf …/metrics), sonst
+zählen Prozesse früherer Deploys weiter mit. Ein Worker, der seit dem Start
+nichts beobachtet hat, taucht erst nach seiner ersten Beobachtung auf.
+
+Prometheus meldet sich per Bearer-Token an (METRICS_TOKEN), Staff per Login:
+    scrape_configs:
+      - job_name: planli
+        scheme: https
+        metrics_path: /metrics
+        authorization: {credentials: '<METRICS_TOKEN>'}
+        static_configs: [{targets: ['planli.net']}]
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_registry = {}
+_last_flush = 0.0
+_timer_lock = threading.Lock()
+_pending = None  # threading.Timer für einen aufgeschobenen flush()
+
+
+def _label_key(labels):
+    return json.dumps(sorted(labels.items()))
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return f'{value:.6g}' if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.buckets = name, help, tuple(buckets)
+        # label_key → [kumulierte Bucket-Zähler…, count, sum]
+        self.values = {}
+        _registry[name] = self
+
+    def observe(self, value, **labels):
+        with _lock:
+            row = self.values.setdefault(_label_key(labels), [0] * len(self.buckets) + [0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += 1
+            row[-1] += value
+        _maybe_flush()
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def merge(self, per_process):
+        merged = {}
+        for _pid, values, _alive in per_process:
+            for key, row in values.items():
+                if len(row) != len(self.buckets) + 2:
+                    continue  # Datei mit anderen Buckets (früherer Deploy)
+                total = merged.setdefault(key, [0] * len(row))
+                merged[key] = [a + b for a, b in zip(total, row)]
+        return merged
+
+    def render(self, merged):
+        for key, row in sorted(merged.items()):
+            pairs = [tuple(p) for p in json.loads(key)]
+            for bound, count in zip(self.buckets, row):
+                yield f'{self.name}_bucket{_format_labels(pairs + [("le", _format_value(float(bound)))])} {count}'
+            yield f'{self.name}_bucket{_format_labels(pairs + [("le", "+Inf")])} {row[-2]}'
+            yield f'{self.name}_sum{_format_labels(pairs)} {_format_value(float(row[-1]))}'
+            yield f'{self.name}_count{_format_labels(pairs)} {row[-2]}'
+
+
+class Gauge:
+    """aggregate: 'sum' über die laufenden Prozesse, 'max' oder 'pid' (ein
+    Wert pro Prozess, mit pid-Label). `function` wird beim Schreiben der
+    Prozessdatei ausgewertet."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, aggregate='sum', function=None):
+        self.name, self.help, self.aggregate, self.function = name, help, aggregate, function
+        self.values = {}
+        _registry[name] = self
+
+    # Gauges schreiben bei jeder Änderung: ein Wert, der nur bis zum nächsten
+    # Intervall gepuffert wäre, bliebe in /metrics hängen (z.B. eine Analyse,
+    # die nach ihrem Ende weiter als laufend zählt). Sie ändern sich selten.
+    def set(self, value, **labels):
+        with _lock:
+            self.values[_label_key(labels)] = value
+        _maybe_flush(force=True)
+
+    def inc(self, amount=1, **labels):
+        with _lock:
+            key = _label_key(labels)
+            self.values[key] = self.values.get(key, 0) + amount
+        _maybe_flush(force=True)
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def merge(self, per_process):
+        merged = {}
+        for pid, values, alive in per_process:
+            if not alive:
+                continue
+            for key, value in values.items():
+                if self.aggregate == 'pid':
+                    merged[_label_key({**dict(json.loads(key)), 'pid': pid})] = value
+                elif self.aggregate == 'max':
+                    merged[key] = max(merged.get(key, value), value)
+                else:
+                    merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self, merged):
+        for key, value in sorted(merged.items()):
+            yield f'{self.name}{_format_labels([tuple(p) for p in json.loads(key)])} {_format_value(value)}'
+
+
+def _rss_bytes():
+    """Aktueller RSS dieses Prozesses (Linux: /proc), sonst der Höchststand."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+ANALYSIS_SECONDS = Histogram('planli_analysis_seconds', 'Gesamtdauer von analyze_page.')
+ANALYSIS_STAGE_SECONDS = Histogram(
+    'planli_analysis_stage_seconds', 'Dauer pro Schritt von predict_image (model_handler.StageTimings).',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+UPLOAD_SECONDS = Histogram('planli_upload_seconds', 'Dauer eines PDF-Uploads inkl. Rendern.')
+RENDER_SECONDS = Histogram('planli_render_seconds', 'Rendern eines PDFs (cache="hit": aus dem Render-Cache).')
+UPLOAD_PAGES = Histogram('planli_upload_pages', 'Seiten pro hochgeladenem PDF.',
+                         buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+ANALYSES_IN_PROGRESS = Gauge('planli_analyses_in_progress', 'Gerade laufende Analysen über alle Worker.')
+TRACKING_BUFFER_EVENTS = Gauge('planli_tracking_buffer_events',
+                               'Noch nicht geschriebene AnalysisEvents (core/tracking.py).')
+MODEL_LOAD_SECONDS = Gauge('planli_model_load_seconds', 'Ladezeit des Modells beim Prozessstart.',
+                           aggregate='max')
+PROCESS_RSS_BYTES = Gauge('planli_process_resident_memory_bytes', 'Arbeitsspeicher (RSS) pro Worker-Prozess.',
+                          aggregate='pid', function=_rss_bytes)
+
+
+def _snapshot():
+    with _lock:
+        for metric in _registry.values():
+            if getattr(metric, 'function', None):
+                metric.values[_label_key({})] = metric.function()
+        return {name: dict(metric.values) for name, metric in _registry.items()}
+
+
+def flush():
+    """Werte dieses Prozesses nach METRICS_DIR/<pid>.json schreiben."""
+    global _last_flush
+    if not settings.METRICS_DIR:
+        return
+    data = _snapshot()
+    _last_flush = time.monotonic()
+    directory = Path(settings.METRICS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{os.getpid()}.json'
+    tmp = path.with_name(f'.{path.name}.tmp')
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+def _safe_flush():
+    try:
+        flush()
+    except OSError:
+        logger.exception('Metriken konnten nicht geschrieben werden')
+
+
+def _maybe_flush(force=False):
+    """Schreiben, wenn das Intervall um ist (oder force). Sonst einen Timer
+    stellen: die letzte Beobachtung einer Serie käme auf einem danach
+    untätigen Worker sonst erst mit dessen nächstem Request an."""
+    global _pending
+    if not settings.METRICS_DIR:
+        return
+    wait = settings.METRICS_FLUSH_SECONDS - (time.monotonic() - _last_flush)
+    if force or wait <= 0:
+        _safe_flush()
+        return
+    with _timer_lock:
+        if _pending is None or not _pending.is_alive():
+            _pending = threading.Timer(wait, _safe_flush)
+            _pending.daemon = True
+            _pending.start()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def exposition():
+    """Alle Prozessdateien zusammengeführt im Prometheus-Textformat."""
+    if not settings.METRICS_DIR:
+        files = [(os.getpid(), _snapshot())]
+    else:
+        _safe_flush()
+        files = []
+        for path in Path(settings.METRICS_DIR).glob('*.json'):
+            try:
+                files.append((int(path.stem), json.loads(path.read_text())))
+            except (ValueError, OSError):
+                continue
+    alive = {pid: _alive(pid) for pid, _data in files}
+
+    lines = []
+    for name, metric in _registry.items():
+        merged = metric.merge([(pid, data.get(name, {}), alive[pid]) for pid, data in files])
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        lines.extend(metric.render(merged))
+    return '\n'.join(lines) + '\n'
+
+
+# Beim Beenden immer schreiben, auch innerhalb des Intervalls.
+atexit.register(_maybe_flush, force=True)
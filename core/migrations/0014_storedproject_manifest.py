@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedproject',
+            name='manifest',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_storedproject_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedproject',
+            name='format_version',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storedproject',
+            name='labels_summary',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='storedproject',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storedproject',
+            name='thumbnail_sha',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
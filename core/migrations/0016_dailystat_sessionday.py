@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_storedproject_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('uploads', models.PositiveIntegerField(default=0)),
+                ('uploads_registered', models.PositiveIntegerField(default=0)),
+                ('analyses', models.PositiveIntegerField(default=0)),
+                ('sessions', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SessionDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40)),
+                ('day', models.DateField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('session_key', 'day'), name='unique_session_day')],
+            },
+        ),
+    ]
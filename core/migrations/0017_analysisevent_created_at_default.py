@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_dailystat_sessionday'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analysisevent',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_analysisevent_created_at_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analysisevent',
+            index=models.Index(fields=['created_at'], name='analysisevent_created_idx'),
+        ),
+        # Kein Duplikat von project_files_pending_idx: "Statistik: Uploads heute"
+        # (explain_queries) filtert nicht auf files_deleted und fiele ohne ihn
+        # auf einen Full Scan von core_project zurück.
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['created_at'], name='project_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(condition=models.Q(('files_deleted', False)), fields=['created_at'], name='project_files_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storedproject',
+            index=models.Index(fields=['user', '-updated_at'], name='storedproject_user_updated_idx'),
+        ),
+    ]
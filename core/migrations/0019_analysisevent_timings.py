@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisevent',
+            name='timings',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
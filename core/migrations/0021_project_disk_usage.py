@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='disk_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='last_accessed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='renders_evicted',
+            field=models.BooleanField(default=False),
+        ),
+    ]
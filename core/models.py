@@ -1,13 +1,19 @@
+import shutil
 import uuid
+from pathlib import Path
 from django.conf import settings as django_settings
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class StoredProject(models.Model):
     """Online-Ablage: pro User dauerhaft gespeicherte .planli-Projekte
     ("In der Cloud speichern"). Die Datei ist das identische, selbst-enthaltende
-    Projekt-ZIP wie beim lokalen Speichern — geladen wird sie über denselben
+    Projekt-ZIP wie beim lokalen Speichern (gespeichert als Blobs pro
+    ZIP-Mitglied, siehe core/cloud_store.py) — geladen wird sie über denselben
     Pfad wie "Öffnen". Limit pro User: Subscription.max_projects (Gate beim
     Anlegen in cloud_save). Nicht vom projects/-Cleanup berührt."""
 
@@ -15,6 +21,15 @@ class StoredProject(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stored_projects')
     name = models.CharField(max_length=200)
     size_bytes = models.BigIntegerField(default=0)
+    # Inhalt als Liste inhaltsadressierter Blobs (core/cloud_store.py).
+    # None = Altbestand, liegt noch als ganzes ZIP unter file_path.
+    manifest = models.JSONField(null=True, blank=True)
+    # Index für die Projektliste, beim Speichern aus dem Archiv gelesen
+    # (cloud_store.build_index). Altbestand: leer bis zum nächsten Speichern.
+    page_count = models.PositiveIntegerField(null=True, blank=True)
+    format_version = models.PositiveSmallIntegerField(null=True, blank=True)
+    labels_summary = models.JSONField(default=list, blank=True)
+    thumbnail_sha = models.CharField(max_length=64, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     # Für die spätere Inaktivitäts-Archivierung (12 Monate) schon mitgeführt.
@@ -22,6 +37,10 @@ class StoredProject(models.Model):
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # cloud_list: Projekte eines Users, neueste zuerst
+            models.Index(fields=['user', '-updated_at'], name='storedproject_user_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.user.username})"
@@ -43,6 +62,23 @@ class Project(models.Model):
     # Wird vom cleanup_projects-Command gesetzt: Dateien in projects/<uuid>/
     # wurden gelöscht, die DB-Zeile bleibt (für Statistik) erhalten.
     files_deleted = models.BooleanField(default=False)
+    # Plattenbudget (core/disk_quota.py): Grösse von projects/<uuid>/ nach dem
+    # letzten Render, letzter Zugriff (LRU) und ob die Seiten-Renders
+    # verdrängt wurden (werden beim nächsten Zugriff aus dem PDF neu erzeugt).
+    disk_bytes = models.BigIntegerField(default=0)
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
+    renders_evicted = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Statistik: Uploads heute / Rollup pro Tag (core/stats.py) — ohne
+            # Filter auf files_deleted, der partielle Index darunter greift da
+            # nicht (explain_queries: "Statistik: Uploads heute" → SCAN).
+            models.Index(fields=['created_at'], name='project_created_idx'),
+            # cleanup_projects: abgelaufene Projekte, deren Dateien noch da sind
+            models.Index(fields=['created_at'], condition=models.Q(files_deleted=False),
+                         name='project_files_pending_idx'),
+        ]
 
     def __str__(self):
         username = self.user.username if self.user else 'anonym'
@@ -117,14 +153,119 @@ class FeedbackResponse(models.Model):
 
 class AnalysisEvent(models.Model):
     """Serverseitiges Beta-Tracking: ein Eintrag pro durchgeführter Seitenanalyse.
-    session_key dient als anonymer Besucher-Proxy für die Wiederkehr-Schätzung."""
-    created_at = models.DateTimeField(auto_now_add=True)
+    session_key dient als anonymer Besucher-Proxy für die Wiederkehr-Schätzung.
+    Geschrieben gepuffert (core/tracking.py), daher created_at per default
+    statt auto_now_add: es zählt der Zeitpunkt der Analyse."""
+    created_at = models.DateTimeField(default=timezone.now)
     session_key = models.CharField(max_length=40, blank=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='analysis_events')
     page_number = models.IntegerField(null=True, blank=True)
+    # Laufzeit/RSS pro Schritt von predict_image (model_handler.StageTimings)
+    # plus Bildgrösse und Projekt — welcher Schritt wird auf welchen Plänen langsam?
+    timings = models.JSONField(null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Gruppiert nach session_key wird auf SessionDay (core/stats.py),
+            # hier wird nur nach Zeitraum gefiltert
+            models.Index(fields=['created_at'], name='analysisevent_created_idx'),
+        ]
 
     def __str__(self):
         return f"Analyse {self.created_at:%Y-%m-%d %H:%M} (Seite {self.page_number})"
+
+
+class DailyStat(models.Model):
+    """Tages-Rollup für /statistik (core/stats.py): Zähler eines abgeschlossenen
+    Tags (Lokalzeit), damit die Auswertung nicht über alle Rohdaten läuft."""
+    day = models.DateField(unique=True)
+    uploads = models.PositiveIntegerField(default=0)
+    uploads_registered = models.PositiveIntegerField(default=0)
+    analyses = models.PositiveIntegerField(default=0)
+    sessions = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-day']
+
+    def __str__(self):
+        return f"Statistik {self.day:%Y-%m-%d}"
+
+
+class SessionDay(models.Model):
+    """Session X hat an Tag Y analysiert — Basis der Wiederkehr-Schätzung
+    (GROUP BY session_key), verdichtet aus AnalysisEvent."""
+    session_key = models.CharField(max_length=40)
+    day = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session_key', 'day'], name='unique_session_day'),
+        ]
+
+
+class ChunkedUpload(models.Model):
+    """Laufender, fortsetzbarer Upload (core/chunked_upload.py). Die Teildatei
+    liegt schon im Zielverzeichnis; die Zeile verschwindet beim Abschluss
+    (ChunkedFile.move_to) bzw. nach chunked_upload.EXPIRY per cleanup_projects."""
+
+    PURPOSES = [
+        ('pdf', 'PDF-Upload'),
+        ('append', 'PDF anhängen'),
+        ('cloud', 'Online-Ablage'),
+        ('bug', 'Bug-Report-Projekt'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Nullable: im BETA_MODE anonym (Zugriff dann nur per unerratbarer ID, wie Project)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='chunked_uploads')
+    purpose = models.CharField(max_length=10, choices=PURPOSES)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()  # angekündigte Gesamtgrösse in Bytes
+    directory = models.CharField(max_length=500)  # Zielverzeichnis der Teildatei
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)  # Ablauf per cleanup_projects
+
+    def __str__(self):
+        return f"{self.get_purpose_display()}: {self.filename} ({self.offset}/{self.size})"
+
+    @property
+    def part_path(self):
+        return Path(self.directory) / f'.upload_{self.id}.part'
+
+    @property
+    def offset(self):
+        try:
+            return self.part_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+
+class RequestProfile(models.Model):
+    """Auf Zuruf profilierter Request (core/profiling.py). Die Dateien
+    (pstats, Chrome-Trace) liegen unter DIAGNOSTICS_DIR/profiles/<id>/."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='request_profiles')
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view_name = models.CharField(max_length=100)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    has_trace = models.BooleanField(default=False)  # torch.profiler-Trace vorhanden
+    top_functions = models.TextField(blank=True)  # pstats, nach kumulierter Zeit
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Profil {self.created_at:%Y-%m-%d %H:%M} {self.view_name} ({self.duration_ms:.0f} ms)"
+
+    @property
+    def directory(self):
+        from .profiling import profile_dir
+        return profile_dir(self.id)
+
+
+@receiver(post_delete, sender=RequestProfile)
+def _delete_profile_files(sender, instance, **kwargs):
+    shutil.rmtree(instance.directory, ignore_errors=True)
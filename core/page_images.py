@@ -0,0 +1,287 @@
+"""
+Abgeleitete Bilder der Seiten-Renders (projects/<uuid>/uploads/page_<s>_<i>.jpg).
+
+Vorschaubilder (thumb_<s>_<i>.webp): kleine WebP-Previews für die Seitenliste,
+direkt beim Rendern aus demselben Pixelpuffer erzeugt (kein zweiter Decode) und
+wie die Renders unveränderlich.
+
+Bildvarianten (variants/page_<s>_<i>.webp|.avif|.png): moderne Formate für den
+Browser, per Accept-Header ausgehandelt (serve_project_file). Erzeugt beim
+ersten Abruf einer Seite aus dem JPEG-Render — kein zweites Poppler-Rendern
+im Request, das bei grossen Plänen Sekunden kostet. Reine Schwarz-Weiss-Pläne
+bekommen zusätzlich ein verlustfreies PNG mit 4-Grauwert-Palette (kleiner als
+jedes JPEG; die Palette schluckt auch dessen Artefakte). Der kanonische
+page_<s>_<i>.jpg bleibt unverändert die Quelle für Analyse, ZIP und PDF-Export.
+
+Kachel-Pyramide (DeepZoom): statt des vollen Renders lädt der Viewer nur die
+Kacheln, die bei der aktuellen Zoomstufe sichtbar sind. Aufbau wie bei
+DeepZoom/OpenSeadragon üblich: Level 0 ist 1×1 px, jedes weitere Level
+verdoppelt die Kantenlänge, das oberste Level entspricht dem Render in voller
+Auflösung. Kacheln sind TILE_SIZE px gross plus TILE_OVERLAP px Überlappung zu
+den Nachbarn (verhindert sichtbare Nähte beim Zusammensetzen).
+
+Kacheln werden bei der ersten Anfrage erzeugt — auf den oberen Levels gleich
+das ganze Level aus einem Decode, darunter (JPEG-Draft) nur die angefragte
+Kachel, siehe ensure_tile — und liegen danach unter
+uploads/tiles/page_<s>_<i>/<level>/<col>_<row>.jpg. Sie sind wie die
+Renders unveränderlich und verschwinden mit dem projects/-Cleanup.
+"""
+import fcntl
+import json
+import math
+import os
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from PIL import Image, ImageStat, features
+
+TILES_DIR_NAME = 'tiles'
+VARIANTS_DIR_NAME = 'variants'
+
+VARIANT_MIME_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'png': 'image/png',
+}
+
+
+def page_render_path(project_dir, source_index, page):
+    """Pfad des Seiten-Renders, wie ihn _convert_pdf_to_images schreibt."""
+    return project_dir / 'uploads' / f'page_{source_index}_{page}.jpg'
+
+
+def thumbnail_path(project_dir, source_index, page):
+    """Pfad des Vorschaubilds neben dem Seiten-Render."""
+    return project_dir / 'uploads' / f'thumb_{source_index}_{page}.webp'
+
+
+def save_thumbnail(image, path):
+    """Vorschaubild aus dem (noch geöffneten) Render-Bild speichern — längste
+    Seite THUMBNAIL_SIZE px. resize() statt thumbnail(): erspart die Kopie des
+    vollen Renders, reducing_gap verkleinert grosse Pläne erst grob, dann fein."""
+    scale = settings.THUMBNAIL_SIZE / max(image.size)
+    if scale < 1:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    image.save(path, 'WEBP', quality=settings.THUMBNAIL_QUALITY, method=4)
+
+
+def _accepted_types(accept_header):
+    """Explizit akzeptierte Medientypen (q > 0) aus dem Accept-Header.
+    `*/*` zählt bewusst nicht: fetch() schickt nur das — ZIP-Speichern und
+    PDF-Export (pdf-lib kann nur JPEG/PNG) bekommen so weiterhin das JPEG."""
+    types = set()
+    for part in accept_header.split(','):
+        media_type, *params = (p.strip() for p in part.split(';'))
+        q = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type and q > 0:
+            types.add(media_type.lower())
+    return types
+
+
+def _enabled_variants():
+    """Konfigurierte Varianten, die dieses Pillow auch schreiben kann."""
+    return [fmt for fmt in settings.PAGE_IMAGE_VARIANTS
+            if fmt in VARIANT_MIME_TYPES and (fmt == 'png' or features.check(fmt))]
+
+
+def _is_bilevel(image):
+    """Reiner Schwarz-Weiss-Plan? Geprüft auf einer verkleinerten Kopie: kaum
+    Farbe und kaum Mitteltöne (nur Kantenglättung der Linien)."""
+    small = image.convert('RGB')
+    small.thumbnail((512, 512))
+    if ImageStat.Stat(small.convert('HSV').getchannel('S')).mean[0] > 8:
+        return False
+    hist = small.convert('L').histogram()
+    return sum(hist[48:208]) / (small.width * small.height) < 0.03
+
+
+def _bilevel_png(image):
+    """4-Grauwert-Palette (2 bit/px): behält die Kantenglättung dünner Linien,
+    die eine harte 1-bit-Schwelle verschlucken würde."""
+    palette = Image.new('P', (1, 1))
+    palette.putpalette([0, 0, 0, 85, 85, 85, 170, 170, 170, 255, 255, 255])
+    return image.convert('RGB').quantize(palette=palette, dither=Image.Dither.NONE)
+
+
+def _variant_source(project_dir, source_index, page):
+    """Pixel für die Varianten: der JPEG-Render der Seite."""
+    with Image.open(page_render_path(project_dir, source_index, page)) as img:
+        return img.convert('RGB')
+
+
+def _build_variants(project_dir, source_index, page, variants_dir, index_path):
+    image = _variant_source(project_dir, source_index, page)
+    bilevel = _is_bilevel(image)
+    written = []
+    for fmt in _enabled_variants():
+        path = variants_dir / f'page_{source_index}_{page}.{fmt}'
+        if fmt == 'png':
+            if not bilevel:
+                continue
+            _save_atomic(_bilevel_png(image), path, format='PNG', bits=2, optimize=True)
+        elif fmt == 'webp':
+            _save_atomic(image, path, format='WEBP', quality=settings.PAGE_WEBP_QUALITY, method=4)
+        elif fmt == 'avif':
+            _save_atomic(image, path, format='AVIF', quality=settings.PAGE_AVIF_QUALITY)
+        written.append(fmt)
+    index_path.write_text(json.dumps({'bilevel': bilevel, 'variants': written}))
+    return written
+
+
+def negotiate_variant(project_dir, source_index, page, accept_header):
+    """Beste Variante des Seiten-Renders für diesen Accept-Header als
+    (Pfad, Content-Type) — oder None, dann bleibt es beim JPEG. Erzeugt die
+    Varianten beim ersten Abruf der Seite (danach nur noch ein JSON-Lookup).
+
+    Reihenfolge: PNG-Palette (nur Schwarz-Weiss-Pläne, verlustfrei) vor AVIF
+    vor WebP. PNG darf auch per image/* kommen — das kann jeder Browser."""
+    accepted = _accepted_types(accept_header)
+    wanted = [fmt for fmt in ('png', 'avif', 'webp')
+              if VARIANT_MIME_TYPES[fmt] in accepted or (fmt == 'png' and 'image/*' in accepted)]
+    if not wanted or not _enabled_variants():
+        return None
+    if not page_render_path(project_dir, source_index, page).exists():
+        return None
+
+    variants_dir = project_dir / 'uploads' / VARIANTS_DIR_NAME
+    index_path = variants_dir / f'page_{source_index}_{page}.json'
+    if index_path.exists():
+        available = json.loads(index_path.read_text())['variants']
+    else:
+        variants_dir.mkdir(parents=True, exist_ok=True)
+        with _exclusive(variants_dir / f'.page_{source_index}_{page}.lock'):
+            if index_path.exists():
+                available = json.loads(index_path.read_text())['variants']
+            else:
+                available = _build_variants(project_dir, source_index, page, variants_dir, index_path)
+
+    for fmt in wanted:
+        if fmt in available:
+            return variants_dir / f'page_{source_index}_{page}.{fmt}', VARIANT_MIME_TYPES[fmt]
+    return None
+
+
+def max_level(width, height):
+    """Index des obersten (vollaufgelösten) Levels."""
+    return int(math.ceil(math.log2(max(width, height, 1))))
+
+
+def level_size(width, height, level):
+    """Bildgrösse (w, h) auf einem Level; jedes Level darunter halbiert."""
+    scale = 2 ** (max_level(width, height) - level)
+    return max(1, math.ceil(width / scale)), max(1, math.ceil(height / scale))
+
+
+def dzi_descriptor(width, height):
+    """DeepZoom-Beschreibung (.dzi) — direkt von OpenSeadragon lesbar."""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'Format="jpg" Overlap="{settings.TILE_OVERLAP}" TileSize="{settings.TILE_SIZE}">'
+        f'<Size Width="{width}" Height="{height}"/>'
+        '</Image>'
+    )
+
+
+def _tile_box(col, row, level_w, level_h):
+    """Pixel-Ausschnitt (links, oben, rechts, unten) einer Kachel inkl. Überlappung."""
+    size, overlap = settings.TILE_SIZE, settings.TILE_OVERLAP
+    left = col * size - (overlap if col > 0 else 0)
+    top = row * size - (overlap if row > 0 else 0)
+    right = min((col + 1) * size + overlap, level_w)
+    bottom = min((row + 1) * size + overlap, level_h)
+    return left, top, right, bottom
+
+
+def _save_atomic(image, path, **save_kwargs):
+    """Erst in eine temporäre Datei schreiben und dann umbenennen — ein paralleler
+    Request sieht so nie eine halb geschriebene Datei."""
+    tmp = path.with_name(f'.{path.name}.{uuid.uuid4().hex}.tmp')
+    image.save(tmp, **save_kwargs)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _exclusive(lock_path):
+    """Prozessübergreifende Sperre (gunicorn-Worker): parallele Anfragen nach
+    demselben Bild erzeugen es trotzdem nur einmal."""
+    with open(lock_path, 'a') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _render_level(img, level_dir, level_w, level_h):
+    """Alle (noch fehlenden) Kacheln eines Levels aus einem Decode schneiden."""
+    frame = img.convert('RGB')
+    if frame.size != (level_w, level_h):
+        frame = frame.resize((level_w, level_h), Image.Resampling.LANCZOS)
+    size = settings.TILE_SIZE
+    for col in range(math.ceil(level_w / size)):
+        for row in range(math.ceil(level_h / size)):
+            path = level_dir / f'{col}_{row}.jpg'
+            if not path.exists():
+                tile = frame.crop(_tile_box(col, row, level_w, level_h))
+                _save_atomic(tile, path, format='JPEG', quality=settings.JPEG_QUALITY)
+
+
+def _render_tile(img, tile_path, level_w, level_h, col, row):
+    """Eine Kachel: nur ihr Ausschnitt des (per Draft verkleinerten) Decodes
+    wird skaliert, nicht das ganze Level."""
+    left, top, right, bottom = _tile_box(col, row, level_w, level_h)
+    fx, fy = img.width / level_w, img.height / level_h
+    tile = img.resize((right - left, bottom - top), Image.Resampling.LANCZOS,
+                      box=(left * fx, top * fy, right * fx, bottom * fy))
+    _save_atomic(tile.convert('RGB'), tile_path, format='JPEG', quality=settings.JPEG_QUALITY)
+
+
+def ensure_tile(project_dir, source_index, page, level, col, row):
+    """Pfad einer Kachel; erzeugt sie bei Bedarf. None, wenn Seite oder
+    Kachel nicht existieren (Level/Spalte/Zeile ausserhalb der Pyramide).
+
+    Ein Decode kostet auf den oberen Levels fast so viel wie der volle Render
+    — dort wird bei der ersten Anfrage gleich das ganze Level geschnitten
+    (Sperre pro Level). Erst wo der JPEG-Draft den Decode auf höchstens ein
+    Viertel der Pixel drückt, lohnt sich eine Kachel pro Anfrage (Sperre pro
+    Kachel)."""
+    level_dir = project_dir / 'uploads' / TILES_DIR_NAME / f'page_{source_index}_{page}' / str(level)
+    tile_path = level_dir / f'{col}_{row}.jpg'
+    if tile_path.exists():
+        return tile_path
+
+    src_path = page_render_path(project_dir, source_index, page)
+    if not src_path.exists():
+        return None
+    with Image.open(src_path) as img:
+        width, height = img.size
+        if not 0 <= level <= max_level(width, height):
+            return None
+        level_w, level_h = level_size(width, height, level)
+        size = settings.TILE_SIZE
+        if col >= math.ceil(level_w / size) or row >= math.ceil(level_h / size):
+            return None
+
+        if (level_w, level_h) != (width, height):
+            # JPEG-Draft: dekodiert direkt in 1/2, 1/4, 1/8 der Auflösung
+            img.draft('RGB', (level_w, level_h))
+        whole_level = img.width * img.height * 4 > width * height
+        level_dir.mkdir(parents=True, exist_ok=True)
+        lock = level_dir / ('.lock' if whole_level else f'.{col}_{row}.lock')
+        with _exclusive(lock):
+            # Ein anderer Worker kann die Kachel erzeugt haben, während wir warteten.
+            if not tile_path.exists():
+                if whole_level:
+                    _render_level(img, level_dir, level_w, level_h)
+                else:
+                    _render_tile(img, tile_path, level_w, level_h, col, row)
+    return tile_path
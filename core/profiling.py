@@ -0,0 +1,123 @@
+"""
+Profiling einzelner Requests auf Zuruf — wenn ein bestimmter Kundenplan
+langsam ist, lässt sich damit nachvollziehen, wo die Zeit bleibt.
+
+Staff hängt an einen Request `?profile=1` oder schickt den Header
+`X-Planli-Profile: 1`; für alle anderen ist das Flag wirkungslos. Der View
+läuft dann unter cProfile, bei @profiled(torch=True) (analyze_page)
+zusätzlich unter torch.profiler. Abgelegt wird unter
+
+    DIAGNOSTICS_DIR/profiles/<id>/
+        profile.pstats   python -m pstats … / snakeviz
+        trace.json       Chrome-Trace des torch-Teils (chrome://tracing, Perfetto)
+
+plus eine RequestProfile-Zeile (Admin: Dauer, Status, Top-Funktionen,
+Download-Links). Die ID steht in der Antwort im Header X-Planli-Profile-Id.
+Löschen im Admin entfernt auch die Dateien.
+"""
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Planli-Profile'
+PSTATS_NAME = 'profile.pstats'
+TRACE_NAME = 'trace.json'
+TOP_FUNCTIONS = 40
+
+
+def profiles_dir():
+    return Path(settings.DIAGNOSTICS_DIR) / 'profiles'
+
+
+def profile_dir(profile_id):
+    return profiles_dir() / str(profile_id)
+
+
+def requested(request):
+    """Profiling angefordert (und erlaubt)?"""
+    flag = request.headers.get(PROFILE_HEADER) or request.GET.get('profile')
+    return bool(flag) and flag != '0' and request.user.is_authenticated and request.user.is_staff
+
+
+def _torch_profiler():
+    """torch.profiler-Kontext (CPU, mit CUDA falls vorhanden)."""
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    return profile(activities=activities, record_shapes=True)
+
+
+def _top_functions(profiler):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).strip_dirs().sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    return out.getvalue()
+
+
+def profiled(view=None, *, torch=False):
+    """Decorator: profiliert den View, wenn requested(request)."""
+    if view is None:
+        return functools.partial(profiled, torch=torch)
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not requested(request):
+            return view(request, *args, **kwargs)
+
+        from .models import RequestProfile
+
+        profile_id = uuid.uuid4()
+        target = profile_dir(profile_id)
+        target.mkdir(parents=True, exist_ok=True)
+        profiler = cProfile.Profile()
+        torch_profiler = _torch_profiler() if torch else None
+        start = time.perf_counter()
+        response = None
+        try:
+            if torch_profiler is not None:
+                torch_profiler.__enter__()
+            profiler.enable()
+            try:
+                response = view(request, *args, **kwargs)
+            finally:
+                profiler.disable()
+                if torch_profiler is not None:
+                    torch_profiler.__exit__(None, None, None)
+        finally:
+            # Auch wenn der View wirft: gerade dieses Profil ist interessant,
+            # und ohne Zeile fände der Admin die Dateien nie (Status 500).
+            duration_ms = round((time.perf_counter() - start) * 1000, 1)
+            profiler.dump_stats(target / PSTATS_NAME)
+            if torch_profiler is not None:
+                try:
+                    torch_profiler.export_chrome_trace(str(target / TRACE_NAME))
+                except Exception:
+                    logger.exception('Chrome-Trace %s konnte nicht geschrieben werden', profile_id)
+            RequestProfile.objects.create(
+                id=profile_id,
+                user=request.user,
+                method=request.method,
+                path=request.get_full_path()[:500],
+                view_name=view.__name__,
+                status_code=response.status_code if response is not None else 500,
+                duration_ms=duration_ms,
+                has_trace=(target / TRACE_NAME).exists(),
+                top_functions=_top_functions(profiler),
+            )
+            logger.info('Profil %s: %s %s (%s ms)', profile_id, request.method, request.path, duration_ms)
+
+        response['X-Planli-Profile-Id'] = str(profile_id)
+        return response
+
+    return wrapper
@@ -0,0 +1,141 @@
+"""
+Inhaltsadressierter Render-Cache: derselbe Plan wird nur einmal gerendert.
+
+Dasselbe PDF kommt immer wieder (neue Session, in ein anderes Projekt
+angehängt, aus einer .planli wieder geöffnet). Schlüssel ist der SHA-256 der
+PDF-Bytes plus Render-Parameter (DPI, JPEG-Qualität):
+
+    RENDER_CACHE_DIR/<sha256>-<dpi>dpi-q<quality>/
+        document.pdf
+        page_<i>.jpg
+        thumb_<i>.webp
+        meta.json        {page_count, page_sizes}
+
+Sessions bekommen Hardlinks auf diese Dateien (Fallback: Kopie, wenn
+projects/ auf einem anderen Dateisystem liegt) — kein zusätzlicher
+Plattenplatz, und beim Treffer entfällt der Poppler-Render komplett.
+Das geht, weil Seiten-Renders nie an Ort und Stelle überschrieben werden
+(Kacheln/Varianten sind eigene Dateien).
+
+Einträge entstehen atomar (temporäres Verzeichnis + rename). Hängt an keinem
+Seitenbild eines Eintrags mehr ein Hardlink (st_nlink == 1, d.h. alle Sessions
+sind aufgeräumt oder ihre Renders verdrängt), entfernt ihn evict() —
+aufgerufen von cleanup_projects und core/disk_quota.py.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+META_NAME = 'meta.json'
+# Zählen nicht als Benutzung: das PDF bleibt in Sessions liegen, deren Renders
+# das Plattenbudget verdrängt hat (core/disk_quota.py).
+UNTRACKED_NAMES = (META_NAME, 'document.pdf')
+
+
+def pdf_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def entry_dir(digest, dpi, quality):
+    return settings.RENDER_CACHE_DIR / f'{digest}-{dpi}dpi-q{quality}'
+
+
+def _link(src, dest):
+    """dest als Hardlink auf src (ersetzt eine vorhandene Datei)."""
+    tmp = dest.with_name(f'.{dest.name}.link')
+    try:
+        os.link(src, tmp)
+    except OSError:  # anderes Dateisystem / keine Hardlinks
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+def lookup(entry):
+    """meta.json eines fertigen Eintrags, None bei Cache-Miss."""
+    try:
+        with open(entry / META_NAME) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def link_into(entry, meta, output_dir, source_index, pdf_path):
+    """Cache-Treffer in eine Session übernehmen: PDF und Seiten als Hardlinks
+    unter den Session-Namen (document_<s>.pdf, page_<s>_<i>.jpg, thumb_…).
+    OSError, wenn evict() den Eintrag inzwischen entfernt hat — die schon
+    gesetzten Seiten-Links sind dann wieder weg, der Aufrufer rendert selbst."""
+    _link(entry / 'document.pdf', pdf_path)
+    linked = []
+    try:
+        for i in range(1, meta['page_count'] + 1):
+            page = output_dir / f'page_{source_index}_{i}.jpg'
+            _link(entry / f'page_{i}.jpg', page)
+            linked.append(page)
+            thumb = entry / f'thumb_{i}.webp'
+            if thumb.exists():
+                _link(thumb, output_dir / f'thumb_{source_index}_{i}.webp')
+                linked.append(output_dir / f'thumb_{source_index}_{i}.webp')
+        os.utime(entry)  # zuletzt benutzt — Eviction-Schonfrist
+    except OSError:
+        for path in linked:
+            path.unlink(missing_ok=True)
+        raise
+
+
+def store(entry, output_dir, source_index, pdf_path, page_count, page_sizes):
+    """Frisch gerenderte Session-Dateien als Cache-Eintrag verlinken. Gewinnt
+    ein paralleler Render desselben PDFs das rename, wird der eigene verworfen."""
+    if entry.exists():
+        return
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix='.tmp-', dir=entry.parent))
+    try:
+        _link(pdf_path, tmp / 'document.pdf')
+        for i in range(1, page_count + 1):
+            _link(output_dir / f'page_{source_index}_{i}.jpg', tmp / f'page_{i}.jpg')
+            thumb = output_dir / f'thumb_{source_index}_{i}.webp'
+            if thumb.exists():
+                _link(thumb, tmp / f'thumb_{i}.webp')
+        with open(tmp / META_NAME, 'w') as f:
+            json.dump({'page_count': page_count, 'page_sizes': page_sizes}, f)
+        os.rename(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def evict(grace_seconds, dry_run=False):
+    """Einträge ohne Session-Links (und Verwaiste aus abgebrochenen stores)
+    entfernen, die länger als grace_seconds nicht benutzt wurden. Gibt die
+    Anzahl entfernter Einträge zurück."""
+    cache_dir = settings.RENDER_CACHE_DIR
+    if not cache_dir.exists():
+        return 0
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    with os.scandir(cache_dir) as entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                with os.scandir(entry.path) as files:
+                    referenced = any(f.stat().st_nlink > 1 for f in files if f.name not in UNTRACKED_NAMES)
+            except OSError:
+                continue
+            if referenced:
+                continue
+            removed += 1
+            if not dry_run:
+                shutil.rmtree(entry.path, ignore_errors=True)
+    return removed
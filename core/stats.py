@@ -0,0 +1,187 @@
+"""
+Kennzahlen für /statistik aus Tages-Rollups statt aus allen Rohdaten.
+
+Abgeschlossene Tage (Lokalzeit, TIME_ZONE) stehen verdichtet in DailyStat
+(Zähler pro Tag) und SessionDay (Session X hat an Tag Y analysiert). Die
+Wiederkehr-Schätzung ist damit ein GROUP BY session_key über SessionDay statt
+einer Python-Schleife über alle AnalysisEvents; live gezählt wird nur der
+laufende Tag.
+
+rollup() verdichtet fehlende Tage bis gestern — die View ruft es selbst auf,
+der erste Aufruf nach Mitternacht verdichtet also den Vortag (den der Cron
+rollup_stats danach noch einmal rechnet, samt spät geschriebener Events).
+Rollups sind Momentaufnahmen: wird später ein Konto gelöscht (CASCADE auf
+Project), zählen die Uploads weiter mit, bis `manage.py rollup_stats --days N`
+neu rechnet.
+
+Die Laufzeit pro Analyse-Schritt (AnalysisEvent.timings, siehe
+model_handler.StageTimings) wertet stage_timings() über die letzten
+STAGE_SAMPLE Analysen aus — Median/p95 pro Schritt plus die langsamsten Pläne.
+"""
+import statistics
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import tracking
+from .models import AnalysisEvent, BugReport, DailyStat, Project, SessionDay
+
+STAGE_SAMPLE = 500
+SLOWEST_SHOWN = 5
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _first_day():
+    firsts = [qs.aggregate(first=Min('created_at'))['first'] for qs in (Project.objects, AnalysisEvent.objects)]
+    firsts = [timezone.localdate(dt) for dt in firsts if dt is not None]
+    return min(firsts) if firsts else None
+
+
+def rollup(since=None, until=None):
+    """Tage [since, until) verdichten, vorhandene Rollups dieser Tage werden
+    ersetzt. Default: ab dem Tag nach dem letzten Rollup (bzw. dem ersten
+    Upload/Event) bis gestern; noch fehlende Tage vor `since` werden immer
+    mitverdichtet. Gibt die Anzahl verdichteter Tage zurück."""
+    until = until or timezone.localdate()
+    last = DailyStat.objects.order_by('-day').values_list('day', flat=True).first()
+    pending = last + timedelta(days=1) if last else _first_day()
+    # Rollups bleiben lückenlos: ein expliziter Start rechnet Fehlendes mit
+    if since is None or (pending is not None and pending < since):
+        since = pending
+    if since is None or since >= until:
+        return 0
+
+    start, end = _day_start(since), _day_start(until)
+    days = {}
+    for i in range((until - since).days):
+        day = since + timedelta(days=i)
+        days[day] = DailyStat(day=day)
+    uploads = (Project.objects.filter(created_at__gte=start, created_at__lt=end)
+               .annotate(day=TruncDate('created_at')).values('day')
+               .annotate(n=Count('id'), registered=Count('id', filter=Q(user__isnull=False))))
+    for row in uploads:
+        days[row['day']].uploads = row['n']
+        days[row['day']].uploads_registered = row['registered']
+    events = (AnalysisEvent.objects.filter(created_at__gte=start, created_at__lt=end)
+              .annotate(day=TruncDate('created_at')))
+    per_day = events.values('day').annotate(
+        n=Count('id'), sessions=Count('session_key', distinct=True, filter=~Q(session_key='')))
+    for row in per_day:
+        days[row['day']].analyses = row['n']
+        days[row['day']].sessions = row['sessions']
+    pairs = events.exclude(session_key='').values_list('session_key', 'day').distinct().order_by()
+
+    try:
+        with transaction.atomic():
+            DailyStat.objects.filter(day__gte=since, day__lt=until).delete()
+            SessionDay.objects.filter(day__gte=since, day__lt=until).delete()
+            DailyStat.objects.bulk_create(days.values())
+            SessionDay.objects.bulk_create(
+                (SessionDay(session_key=key, day=day) for key, day in pairs.iterator()), batch_size=1000)
+    except IntegrityError:
+        return 0  # paralleler rollup() war schneller
+    return len(days)
+
+
+def stage_timings(sample=STAGE_SAMPLE):
+    """(Zeilen pro Schritt, langsamste Analysen) über die letzten `sample`
+    Analysen mit Timings. Schritte in der Reihenfolge von predict_image."""
+    rows = (AnalysisEvent.objects.filter(timings__isnull=False).order_by('-created_at')
+            .values_list('timings', 'page_number')[:sample])
+    per_stage = defaultdict(lambda: {'ms': [], 'rss_mb': []})
+    analyses = []
+    for timings, page in rows:
+        stages = timings.get('stages') or {}
+        for name, stage in stages.items():
+            per_stage[name]['ms'].append(stage['ms'])
+            if stage.get('rss_mb') is not None:
+                per_stage[name]['rss_mb'].append(stage['rss_mb'])
+        if stages:
+            worst = max(stages, key=lambda name: stages[name]['ms'])
+            analyses.append({
+                'project': timings.get('project', ''), 'page': page,
+                'width': timings.get('width'), 'height': timings.get('height'),
+                'total_ms': round(sum(stage['ms'] for stage in stages.values()), 1),
+                'worst_stage': worst,
+            })
+
+    stage_rows = []
+    for name, values in per_stage.items():
+        ms = sorted(values['ms'])
+        stage_rows.append({
+            'stage': name,
+            'n': len(ms),
+            'median_ms': round(statistics.median(ms), 1),
+            'p95_ms': ms[min(len(ms) - 1, int(len(ms) * 0.95))],
+            'max_rss_mb': max(values['rss_mb'], default=None),
+        })
+    slowest = sorted(analyses, key=lambda a: a['total_ms'], reverse=True)[:SLOWEST_SHOWN]
+    return stage_rows, slowest
+
+
+def dashboard_context():
+    """Template-Kontext für statistik.html."""
+    tracking.analysis_events.flush()  # eigene gepufferte Events mitzählen
+    rollup()
+    now = timezone.now()
+    today = timezone.localdate()
+    today_start = _day_start(today)
+    d30, d7, d14 = today - timedelta(days=30), today - timedelta(days=7), today - timedelta(days=14)
+
+    rolled = DailyStat.objects.aggregate(
+        uploads_total=Sum('uploads', default=0),
+        uploads_30=Sum('uploads', default=0, filter=Q(day__gt=d30)),
+        uploads_7=Sum('uploads', default=0, filter=Q(day__gt=d7)),
+        uploads_registered=Sum('uploads_registered', default=0),
+        analyses_total=Sum('analyses', default=0),
+        analyses_30=Sum('analyses', default=0, filter=Q(day__gt=d30)),
+        analyses_7=Sum('analyses', default=0, filter=Q(day__gt=d7)),
+    )
+    live_uploads = Project.objects.filter(created_at__gte=today_start).aggregate(
+        n=Count('id'), registered=Count('id', filter=Q(user__isnull=False)))
+    live_events = AnalysisEvent.objects.filter(created_at__gte=today_start)
+    live_analyses = live_events.count()
+
+    # Sessions: verdichtete Tage pro Session, dazu heute aktive. Eine heutige
+    # Session mit genau einem früheren Tag ist damit wiedergekehrt.
+    per_session = SessionDay.objects.values('session_key').annotate(days=Count('day')).order_by()
+    today_keys = live_events.exclude(session_key='').values('session_key').distinct().order_by()
+    seen_before = per_session.filter(session_key__in=today_keys)
+    distinct_sessions = per_session.count() + today_keys.count() - seen_before.count()
+    returning_sessions = per_session.filter(days__gte=2).count() + seen_before.filter(days=1).count()
+
+    daily_uploads = [{'day': row['day'], 'n': row['uploads']} for row in
+                     DailyStat.objects.filter(day__gt=d14, uploads__gt=0).order_by('day').values('day', 'uploads')]
+    if live_uploads['n']:
+        daily_uploads.append({'day': today, 'n': live_uploads['n']})
+
+    bugs = BugReport.objects.aggregate(total=Count('id'), open=Count('id', filter=Q(resolved=False)))
+    stage_rows, slowest = stage_timings()
+    uploads_total = rolled['uploads_total'] + live_uploads['n']
+    uploads_registered = rolled['uploads_registered'] + live_uploads['registered']
+    return {
+        'now': now,
+        'uploads_total': uploads_total,
+        'uploads_30': rolled['uploads_30'] + live_uploads['n'],
+        'uploads_7': rolled['uploads_7'] + live_uploads['n'],
+        'uploads_registered': uploads_registered,
+        'uploads_anon': uploads_total - uploads_registered,
+        'analyses_total': rolled['analyses_total'] + live_analyses,
+        'analyses_30': rolled['analyses_30'] + live_analyses,
+        'analyses_7': rolled['analyses_7'] + live_analyses,
+        'distinct_sessions': distinct_sessions,
+        'returning_sessions': returning_sessions,
+        'daily_uploads': daily_uploads,
+        'bugs_total': bugs['total'],
+        'bugs_open': bugs['open'],
+        'stage_timings': stage_rows,
+        'slowest_analyses': slowest,
+        'stage_sample': STAGE_SAMPLE,
+    }
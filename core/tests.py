@@ -1,24 +1,88 @@
+import json
+import os
 import tempfile
+import uuid
 from datetime import timedelta
 from io import StringIO
 from pathlib import Path
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
-from django.test import TestCase, override_settings
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 
+import numpy as np
+from PIL import Image, ImageStat
+
 from accounts.models import subscription_for
-from .models import FeedbackResponse, StoredProject
+from . import disk_quota
+from .models import (AnalysisEvent, ChunkedUpload, DailyStat, FeedbackResponse, Project, RequestProfile, SessionDay,
+                     StoredProject)
 
 CLOUD_TMP = Path(tempfile.mkdtemp(prefix='planli_cloud_test_'))
 
 
-def _zip(content=b'PK\x03\x04 fake zip'):
-    return SimpleUploadedFile('project.planli', content, content_type='application/zip')
+def _pdf(pages=1):
+    """Minimale, gültige PDF (leere A4-Seiten) für die Upload-Tests."""
+    from io import BytesIO
+    from PyPDF2 import PdfWriter
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=595, height=842)
+    buf = BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+
+def _isolated_render_cache(test):
+    """Eigener, leerer Render-Cache pro Test — sonst liefert ein früherer Test
+    mit demselben PDF die Seiten (und der gemockte Render wird übergangen)."""
+    override = override_settings(RENDER_CACHE_DIR=Path(tempfile.mkdtemp(prefix='planli_render_cache_test_')))
+    override.enable()
+    test.addCleanup(override.disable)
+
+
+PROJECT_MEMBERS = {
+    'metadata.json': b'{"project_name": "EFH Muster", "page_count": 1, "format_version": 3}',
+    'canvas_data.json': b'{"1": []}',
+    'pages/page_1.jpg': b'\xff\xd8\xff\xe0 jpeg',
+}
+
+
+def _zip(members=PROJECT_MEMBERS):
+    import zipfile
+    from io import BytesIO
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return SimpleUploadedFile('project.planli', buf.getvalue(), content_type='application/zip')
+
+
+def _zip_members(content):
+    import zipfile
+    from io import BytesIO
+    with zipfile.ZipFile(BytesIO(content)) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def _manifest(members):
+    import hashlib
+    import json
+    return json.dumps([{'name': name, 'sha256': hashlib.sha256(data).hexdigest(), 'size': len(data)}
+                       for name, data in members.items()])
+
+
+def _legacy_stored_project(user, content=b'PK\x03\x04 fake zip'):
+    """Online-Projekt von vor dem Blob-Store: ganzes ZIP unter file_path."""
+    project = StoredProject.objects.create(user=user, name='EFH Muster', size_bytes=len(content))
+    CLOUD_TMP.mkdir(exist_ok=True)
+    project.file_path.write_bytes(content)
+    return project
 
 
 @override_settings(CLOUD_PROJECTS_DIR=CLOUD_TMP)
@@ -40,14 +104,50 @@ class CloudStorageTests(TestCase):
     def test_save_and_list(self):
         response = self._save()
         self.assertEqual(response.status_code, 200)
-        project_id = response.json()['id']
-        self.assertTrue((CLOUD_TMP / f'{project_id}.planli').exists())
+        project = StoredProject.objects.get(id=response.json()['id'])
+        self.assertEqual([e['name'] for e in project.manifest], list(PROJECT_MEMBERS))
+        self.assertFalse(project.file_path.exists())
+        self.assertEqual(project.size_bytes, sum(len(d) for d in PROJECT_MEMBERS.values()))
 
         data = self.client.get(reverse('cloud_list')).json()
         self.assertEqual(len(data['projects']), 1)
         self.assertEqual(data['projects'][0]['name'], 'EFH Muster')
         self.assertEqual(data['limit'], 50)
 
+    def test_save_indexes_project_for_list(self):
+        from io import BytesIO
+        from PIL import Image
+        page = BytesIO()
+        Image.new('RGB', (800, 600), 'white').save(page, 'JPEG')
+        members = {**PROJECT_MEMBERS, 'pages/page_1.jpg': page.getvalue(),
+                   'labels.json': b'[{"id": 1, "name": "Wohnen", "color": "#FF0000"}]'}
+        self._save(project_zip=_zip(members))
+
+        entry = self.client.get(reverse('cloud_list')).json()['projects'][0]
+        self.assertEqual((entry['page_count'], entry['format_version']), (1, 3))
+        self.assertEqual(entry['labels'], [{'name': 'Wohnen', 'color': '#FF0000'}])
+        response = self.client.get(entry['thumbnail_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_unreadable_page_image_saves_without_thumbnail(self):
+        from . import cloud_store
+        self._save()  # PROJECT_MEMBERS: Seitenbild ist kein echtes JPEG
+        entry = self.client.get(reverse('cloud_list')).json()['projects'][0]
+        self.assertEqual(entry['page_count'], 1)
+        self.assertIsNone(entry['thumbnail_url'])
+        self.assertEqual(list(cloud_store.thumbs_dir().glob('.tmp-*')), [])  # keine Temp-Reste
+
+    def test_archive_without_valid_metadata_is_rejected(self):
+        for metadata in (None, b'{kaputt', b'{"page_count": "eins"}', b'{"page_count": 1, "format_version": 99}'):
+            members = {k: v for k, v in PROJECT_MEMBERS.items() if k != 'metadata.json'}
+            if metadata is not None:
+                members['metadata.json'] = metadata
+            response = self._save(project_zip=_zip(members))
+            self.assertEqual(response.status_code, 400, metadata)
+        self.assertEqual(StoredProject.objects.count(), 0)
+
     def test_save_with_id_overwrites(self):
         project_id = self._save().json()['id']
         response = self._save(project_id=project_id)
@@ -70,11 +170,24 @@ class CloudStorageTests(TestCase):
         response = self._save()
         self.assertEqual(response.status_code, 413)
 
+    @override_settings(MAX_PROJECT_MB=1)
+    def test_zip_bomb_is_rejected_before_unpacking(self):
+        from io import BytesIO
+        from . import cloud_store
+        bomb = _zip({**PROJECT_MEMBERS, 'canvas_data.json': b'0' * (2 * 1024 * 1024)})
+        self.assertLess(bomb.size, 1024 * 1024)
+        self.assertEqual(self._save(project_zip=bomb).status_code, 413)
+        self.assertEqual(StoredProject.objects.count(), 0)
+        # Auch ohne (bzw. mit gefälschter) Grössenangabe: nie mehr als der Deckel
+        with self.assertRaises(cloud_store.TooLarge):
+            cloud_store._put_blob(BytesIO(b'x' * 100), max_bytes=99)
+        self.assertEqual(list(cloud_store.blobs_dir().glob('.tmp-*')), [])
+
     def test_download_and_ownership(self):
         project_id = self._save().json()['id']
         response = self.client.get(f'/cloud/projects/{project_id}/download')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(b''.join(response.streaming_content), b'PK\x03\x04 fake zip')
+        self.assertEqual(_zip_members(b''.join(response.streaming_content)), PROJECT_MEMBERS)
         # last_opened_at wird gesetzt (Basis der späteren Archivierung)
         self.assertIsNotNone(StoredProject.objects.get(id=project_id).last_opened_at)
 
@@ -84,6 +197,29 @@ class CloudStorageTests(TestCase):
         self.assertEqual(self.client.get(f'/cloud/projects/{project_id}/download').status_code, 404)
         self.assertEqual(self.client.post(f'/cloud/projects/{project_id}/delete').status_code, 404)
 
+    def test_download_revalidates_with_etag(self):
+        url = f'/cloud/projects/{self._save().json()["id"]}/download'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_legacy_download_resumes_with_range(self):
+        url = f'/cloud/projects/{_legacy_stored_project(self.user).id}/download'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_RANGE='bytes=4-', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 4-12/13')
+        self.assertEqual(b''.join(response.streaming_content), b' fake zip')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'zip')
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=50-').status_code, 416)
+        # Veralteter Validator (Projekt inzwischen überschrieben) → ganze Datei
+        response = self.client.get(url, HTTP_RANGE='bytes=4-', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
     def test_rename_and_delete(self):
         project_id = self._save().json()['id']
         response = self.client.post(f'/cloud/projects/{project_id}/rename', {'name': 'MFH Neu'})
@@ -91,6 +227,106 @@ class CloudStorageTests(TestCase):
 
         self.client.post(f'/cloud/projects/{project_id}/delete')
         self.assertEqual(StoredProject.objects.count(), 0)
+
+    def test_malformed_labels_are_rejected(self):
+        for labels in (b'{"a": 1}', b'42'):
+            response = self._save(project_zip=_zip({**PROJECT_MEMBERS, 'labels.json': labels}))
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('labels.json', response.json()['error'])
+        self.assertEqual(StoredProject.objects.count(), 0)
+
+    def test_invalid_zip_is_rejected(self):
+        data = {'project_zip': SimpleUploadedFile('project.planli', b'PK\x03\x04 fake zip'), 'name': 'X'}
+        self.assertEqual(self.client.post(reverse('cloud_save'), data).status_code, 400)
+        self.assertEqual(StoredProject.objects.count(), 0)
+
+    def test_delta_save_uploads_only_changed_members(self):
+        project_id = self._save().json()['id']
+        changed = {**PROJECT_MEMBERS, 'canvas_data.json': b'{"1": [{"type": "rect"}]}'}
+        # Nur das Manifest: der Server meldet das geänderte Mitglied als fehlend
+        response = self.client.post(reverse('cloud_save'), {'manifest': _manifest(changed), 'project_id': project_id})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['missing'], ['canvas_data.json'])
+
+        response = self.client.post(reverse('cloud_save'), {
+            'manifest': _manifest(changed), 'project_id': project_id,
+            'project_zip': _zip({'canvas_data.json': changed['canvas_data.json']})})
+        self.assertEqual(response.status_code, 200)
+        download = self.client.get(f'/cloud/projects/{project_id}/download')
+        self.assertEqual(_zip_members(b''.join(download.streaming_content)), changed)
+
+    def test_delta_save_ignores_client_sizes(self):
+        import json
+        project_id = self._save().json()['id']
+        changed = {**PROJECT_MEMBERS, 'canvas_data.json': b'{"1": []} '}
+        manifest = [{**entry, 'size': -10 ** 9} for entry in json.loads(_manifest(changed))]
+        response = self.client.post(reverse('cloud_save'), {
+            'manifest': json.dumps(manifest), 'project_id': project_id,
+            'project_zip': _zip({'canvas_data.json': changed['canvas_data.json']})})
+        self.assertEqual(response.status_code, 200)
+        project = StoredProject.objects.get(id=project_id)
+        self.assertEqual([e['size'] for e in project.manifest], [len(data) for data in changed.values()])
+        self.assertEqual(project.size_bytes, sum(len(data) for data in changed.values()))
+        download = self.client.get(f'/cloud/projects/{project_id}/download')
+        self.assertEqual(_zip_members(b''.join(download.streaming_content)), changed)
+
+    def test_delta_save_cannot_reference_foreign_blobs(self):
+        self._save()
+        User.objects.create_user(username='b@example.ch', password='pw')
+        self.client.login(username='b@example.ch', password='pw')
+        response = self.client.post(reverse('cloud_save'), {'manifest': _manifest(PROJECT_MEMBERS)})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(len(response.json()['missing']), len(PROJECT_MEMBERS))
+
+    def test_deleted_project_blobs_go_to_gc(self):
+        from . import cloud_store
+        first = self._save().json()['id']
+        second = self._save(project_zip=_zip({**PROJECT_MEMBERS, 'canvas_data.json': b'{}'})).json()['id']
+        blobs = {e['name']: cloud_store.blob_path(e['sha256'])
+                 for e in StoredProject.objects.get(id=first).manifest}
+        self.client.post(f'/cloud/projects/{first}/delete')
+        # Nicht sofort: ein paralleler Save könnte die Blobs schon eingeplant haben
+        self.assertTrue(blobs['canvas_data.json'].exists())
+        call_command('gc_cloud_blobs', '--grace-hours=0', stdout=StringIO())
+        # Seitenbild teilt sich das erste mit dem zweiten Projekt, canvas_data nicht
+        self.assertTrue(blobs['pages/page_1.jpg'].exists())
+        self.assertFalse(blobs['canvas_data.json'].exists())
+        self.assertEqual(self.client.get(f'/cloud/projects/{second}/download').status_code, 200)
+
+    def test_download_is_a_sized_stored_zip_with_ranges(self):
+        import zipfile
+        from io import BytesIO
+        url = f'/cloud/projects/{self._save().json()["id"]}/download'
+        response = self.client.get(url)
+        content = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())  # CRCs stimmen
+            self.assertEqual({i.compress_type for i in archive.infolist()}, {zipfile.ZIP_STORED})
+        # Byte-identisch bei jedem Abruf → Fortsetzen mitten im Archiv
+        partial = self.client.get(url, HTTP_RANGE='bytes=40-99', HTTP_IF_RANGE=response['ETag'])
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(b''.join(partial.streaming_content), content[40:100])
+
+    def test_zip64_layout_is_readable(self):
+        from . import cloud_store
+        project_id = self._save().json()['id']
+        with mock.patch.object(cloud_store, 'ZIP64_THRESHOLD', 0):  # zip64-Felder erzwingen
+            response = self.client.get(f'/cloud/projects/{project_id}/download')
+            content = b''.join(response.streaming_content)
+        self.assertIn(b'PK\x06\x06', content)  # zip64 end of central directory
+        self.assertEqual(_zip_members(content), PROJECT_MEMBERS)
+
+    def test_gc_removes_unreferenced_blobs_after_grace(self):
+        from . import cloud_store
+        project_id = self._save().json()['id']
+        old_canvas = cloud_store.blob_path(StoredProject.objects.get(id=project_id).manifest[1]['sha256'])
+        self._save(project_id=project_id, project_zip=_zip({**PROJECT_MEMBERS, 'canvas_data.json': b'{}'}))
+        call_command('gc_cloud_blobs', stdout=StringIO())
+        self.assertTrue(old_canvas.exists())  # Schonfrist
+        call_command('gc_cloud_blobs', '--grace-hours=0', stdout=StringIO())
+        self.assertFalse(old_canvas.exists())
+        self.assertEqual(self.client.get(f'/cloud/projects/{project_id}/download').status_code, 200)
         self.assertFalse((CLOUD_TMP / f'{project_id}.planli').exists())
 
     @override_settings(BETA_PRICING=False)
@@ -248,3 +484,950 @@ class ResetTrialsCommandTests(TestCase):
         call_command('reset_trials', '--dry-run', stdout=StringIO())
 
         self.assertEqual(subscription_for(u).trial_ends, before)
+
+
+@override_settings(BETA_MODE=False, TILE_SIZE=256, TILE_OVERLAP=1)
+class PageTileTests(TestCase):
+    """Kachel-Pyramide (DeepZoom) je Seiten-Render, siehe core/page_images.py."""
+
+    def setUp(self):
+        self.projects_dir = Path(tempfile.mkdtemp(prefix='planli_projects_test_'))
+        patcher = mock.patch('core.views.PROJECTS_DIR', self.projects_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username='t@example.ch', password='pw')
+        self.client.login(username='t@example.ch', password='pw')
+        self.project = Project.objects.create(user=self.user, original_filename='plan.pdf')
+        uploads = self.projects_dir / str(self.project.id) / 'uploads'
+        uploads.mkdir(parents=True)
+        Image.new('RGB', (600, 300), 'white').save(uploads / 'page_1_1.jpg')
+
+    def _url(self, suffix):
+        return f'/project_tiles/{self.project.id}/page_1_1{suffix}'
+
+    def test_descriptor(self):
+        response = self.client.get(self._url('.dzi'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Width="600" Height="300"')
+        self.assertContains(response, 'TileSize="256"')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_top_level_tiles_cover_the_render(self):
+        # 600 px → oberstes Level 10 (2^10 >= 600), 3×2 Kacheln à 256 px
+        response = self.client.get(self._url('_files/10/2_1.jpg'))
+        self.assertEqual(response.status_code, 200)
+        tile = Image.open(Path(self.projects_dir / str(self.project.id) /
+                               'uploads/tiles/page_1_1/10/2_1.jpg'))
+        # letzte Spalte: 600 - 512 + 1 px Überlappung nach links
+        self.assertEqual(tile.size, (89, 45))
+        # Oberstes Level: ein Decode, gleich alle Kacheln geschnitten
+        self.assertTrue((self.projects_dir / str(self.project.id) / 'uploads/tiles/page_1_1/10/0_0.jpg').exists())
+        # Kachel ausserhalb der Pyramide
+        self.assertEqual(self.client.get(self._url('_files/10/3_0.jpg')).status_code, 404)
+        self.assertEqual(self.client.get(self._url('_files/11/0_0.jpg')).status_code, 404)
+
+    def test_lower_level_is_downscaled(self):
+        response = self.client.get(self._url('_files/8/0_0.jpg'))
+        self.assertEqual(response.status_code, 200)
+        tile = Image.open(self.projects_dir / str(self.project.id) / 'uploads/tiles/page_1_1/8/0_0.jpg')
+        self.assertEqual(tile.size, (150, 75))
+
+    def test_downscaled_tile_shows_its_region(self):
+        render = Image.new('RGB', (600, 300), 'white')
+        render.paste((0, 0, 0), (520, 0, 600, 300))
+        render.save(self.projects_dir / str(self.project.id) / 'uploads' / 'page_1_1.jpg')
+        tiles = self.projects_dir / str(self.project.id) / 'uploads/tiles/page_1_1/9'
+        # Level 9 = 300×150: Spalte 1 deckt x 255–300 ab, also 510–600 im Render
+        for col, dark in [(0, False), (1, True)]:
+            self.assertEqual(self.client.get(self._url(f'_files/9/{col}_0.jpg')).status_code, 200)
+            mean = ImageStat.Stat(Image.open(tiles / f'{col}_0.jpg').convert('L')).mean[0]
+            self.assertEqual(mean < 128, dark)
+            # Draft auf ¼ der Pixel: nur die angefragte Kachel wird erzeugt
+            self.assertEqual(len(list(tiles.glob('*.jpg'))), col + 1)
+
+    def test_foreign_project_is_hidden(self):
+        User.objects.create_user(username='b@example.ch', password='pw')
+        self.client.login(username='b@example.ch', password='pw')
+        self.assertEqual(self.client.get(self._url('.dzi')).status_code, 404)
+        self.assertEqual(self.client.get(self._url('_files/8/0_0.jpg')).status_code, 404)
+
+
+@override_settings(BETA_MODE=False, THUMBNAIL_SIZE=200)
+class PageThumbnailTests(TestCase):
+    """Vorschaubilder für die Seitenliste, beim Rendern mit erzeugt."""
+
+    def setUp(self):
+        self.projects_dir = Path(tempfile.mkdtemp(prefix='planli_projects_test_'))
+        patcher = mock.patch('core.views.PROJECTS_DIR', self.projects_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Poppler (pdf2image) ist für Tests nicht nötig: der Render liefert
+        # einfach zwei weisse A4-Seiten à 150 DPI.
+        patcher = mock.patch('core.views.convert_from_path',
+                             side_effect=lambda *a, **kw: [Image.new('RGB', (1240, 1754), 'white')
+                                                           for _ in range(2)])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        _isolated_render_cache(self)
+        User.objects.create_user(username='t@example.ch', password='pw')
+        self.client.login(username='t@example.ch', password='pw')
+
+    def test_upload_writes_and_serves_thumbnails(self):
+        pdf = SimpleUploadedFile('plan.pdf', _pdf(2), content_type='application/pdf')
+        data = self.client.post(reverse('upload'), {'file': pdf}).json()
+        self.assertEqual(len(data['all_thumbnails']), 2)
+
+        response = self.client.get(data['all_thumbnails'][1])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        thumb = Image.open(self.projects_dir / data['session_id'] / 'uploads' / 'thumb_1_2.webp')
+        self.assertEqual(thumb.format, 'WEBP')
+        self.assertEqual(max(thumb.size), 200)
+
+
+@override_settings(BETA_MODE=False, PAGE_IMAGE_VARIANTS=['webp', 'png'])
+class PageVariantTests(TestCase):
+    """Moderne Bildformate per Accept-Header (core/page_images.negotiate_variant)."""
+
+    BROWSER_ACCEPT = 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
+
+    def setUp(self):
+        self.projects_dir = Path(tempfile.mkdtemp(prefix='planli_projects_test_'))
+        patcher = mock.patch('core.views.PROJECTS_DIR', self.projects_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='t@example.ch', password='pw')
+        self.client.login(username='t@example.ch', password='pw')
+        self.project = Project.objects.create(user=self.user, original_filename='plan.pdf')
+        self.uploads = self.projects_dir / str(self.project.id) / 'uploads'
+        self.uploads.mkdir(parents=True)
+
+        from PIL import ImageDraw
+        plan = Image.new('RGB', (400, 300), 'white')  # Schwarz-Weiss-Plan
+        ImageDraw.Draw(plan).rectangle([50, 50, 350, 250], outline='black', width=2)
+        plan.save(self.uploads / 'page_1_1.jpg')
+        photo = Image.linear_gradient('L').convert('RGB').resize((400, 300))  # Farbverlauf
+        photo.paste((200, 40, 40), (0, 0, 200, 300))
+        photo.save(self.uploads / 'page_1_2.jpg')
+
+    def _get(self, page, accept):
+        return self.client.get(f'/project_files/{self.project.id}/uploads/page_1_{page}.jpg',
+                               HTTP_ACCEPT=accept)
+
+    def test_fetch_without_explicit_types_gets_the_jpeg(self):
+        response = self._get(1, '*/*')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('Accept', response['Vary'])
+
+    def test_bilevel_plan_gets_palette_png(self):
+        response = self._get(1, self.BROWSER_ACCEPT)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        png = Image.open(self.uploads / 'variants' / 'page_1_1.png')
+        self.assertEqual(png.mode, 'P')
+
+    def test_color_page_gets_webp(self):
+        response = self._get(2, self.BROWSER_ACCEPT)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertFalse((self.uploads / 'variants' / 'page_1_2.png').exists())
+
+    @override_settings(PAGE_IMAGE_VARIANTS=[])
+    def test_disabled_variants_keep_the_jpeg(self):
+        self.assertEqual(self._get(2, self.BROWSER_ACCEPT)['Content-Type'], 'image/jpeg')
+
+
+@override_settings(BETA_MODE=False, CLOUD_PROJECTS_DIR=CLOUD_TMP)
+class FileDeliveryTests(TestCase):
+    """Auslieferung über den Frontproxy (core/file_delivery.py): Django prüft
+    nur den Zugriff, die Bytes schickt nginx."""
+
+    def setUp(self):
+        self.projects_dir = Path(tempfile.mkdtemp(prefix='planli_projects_test_'))
+        patcher = mock.patch('core.views.PROJECTS_DIR', self.projects_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='t@example.ch', password='pw')
+        self.client.login(username='t@example.ch', password='pw')
+        self.project = Project.objects.create(user=self.user, original_filename='plan.pdf')
+        uploads = self.projects_dir / str(self.project.id) / 'uploads'
+        uploads.mkdir(parents=True)
+        Image.new('RGB', (40, 30), 'white').save(uploads / 'page_1_1.jpg')
+        self.url = f'/project_files/{self.project.id}/uploads/page_1_1.jpg'
+        self.locations = {self.projects_dir: '/_protected/projects/', CLOUD_TMP: '/_protected/cloud/'}
+
+    def test_dev_fallback_streams_from_python(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertTrue(b''.join(response.streaming_content))
+
+    def test_accel_redirect_hands_off_to_nginx(self):
+        with override_settings(FILE_DELIVERY='accel', FILE_DELIVERY_ACCEL_LOCATIONS=self.locations):
+            response = self.client.get(self.url, HTTP_ACCEPT='image/jpeg')
+        self.assertEqual(response['X-Accel-Redirect'],
+                         f'/_protected/projects/{self.project.id}/uploads/page_1_1.jpg')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response.content, b'')
+
+    def test_access_check_stays_in_django(self):
+        self.client.logout()
+        User.objects.create_user(username='x@example.ch', password='pw')
+        self.client.login(username='x@example.ch', password='pw')
+        with override_settings(FILE_DELIVERY='accel', FILE_DELIVERY_ACCEL_LOCATIONS=self.locations):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    def test_sendfile_cloud_download_keeps_attachment_name(self):
+        project = _legacy_stored_project(self.user)
+        with override_settings(FILE_DELIVERY='sendfile'):
+            response = self.client.get(reverse('cloud_download', args=[project.id]))
+        self.assertEqual(response['X-Sendfile'], str(project.file_path.resolve()))
+        self.assertIn('attachment; filename="EFH Muster.planli"', response['Content-Disposition'])
+
+
+@override_settings(BETA_MODE=False, BETA_PRICING=True, CLOUD_PROJECTS_DIR=CLOUD_TMP)
+class ChunkedUploadTests(TestCase):
+    """Fortsetzbare Uploads (core/chunked_upload.py): init → PUT-Stücke → Abschluss
+    über den eigentlichen Endpoint mit upload_id + sha256."""
+
+    def setUp(self):
+        self.projects_dir = Path(tempfile.mkdtemp(prefix='planli_projects_test_'))
+        for target, value in [('core.views.PROJECTS_DIR', self.projects_dir),
+                              ('core.views.convert_from_path',
+                               mock.Mock(side_effect=lambda *a, **kw: [Image.new('RGB', (100, 140), 'white')]))]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        _isolated_render_cache(self)
+        self.user = User.objects.create_user(username='t@example.ch', password='pw')
+        self.client.login(username='t@example.ch', password='pw')
+
+    def _init(self, data, purpose, **extra):
+        return self.client.post(reverse('chunked_upload_init'),
+                                {'purpose': purpose, 'filename': 'plan.pdf', 'size': len(data), **extra})
+
+    def _put(self, upload_id, chunk, offset):
+        return self.client.put(reverse('chunked_upload_chunk', args=[upload_id]), chunk,
+                               content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def _upload(self, data, purpose, **extra):
+        upload_id = self._init(data, purpose, **extra).json()['upload_id']
+        for offset in range(0, len(data), 100):
+            self.assertEqual(self._put(upload_id, data[offset:offset + 100], offset).status_code, 200)
+        return upload_id
+
+    def test_resumable_pdf_upload(self):
+        import hashlib
+        data = _pdf(1)
+        upload_id = self._init(data, 'pdf').json()['upload_id']
+        self.assertEqual(self._put(upload_id, data[:100], 0).json()['offset'], 100)
+        # Wiederholtes Stück (Antwort ging verloren) → 409 mit dem Stand des Servers
+        response = self._put(upload_id, data[:100], 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 100)
+        self.assertEqual(self.client.get(reverse('chunked_upload_chunk', args=[upload_id])).json()['offset'], 100)
+        self.assertEqual(self._put(upload_id, data[100:], 100).json()['offset'], len(data))
+
+        response = self.client.post(reverse('upload'), {
+            'upload_id': upload_id, 'sha256': hashlib.sha256(data).hexdigest()})
+        self.assertEqual(response.status_code, 200)
+        # Die Upload-ID wird zur Session-ID, die Teildatei zum document_1.pdf
+        self.assertEqual(response.json()['session_id'], upload_id)
+        uploads = self.projects_dir / upload_id / 'uploads'
+        self.assertEqual((uploads / 'document_1.pdf').read_bytes(), data)
+        self.assertEqual([p.name for p in uploads.glob('.upload_*')], [])
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_checksum_mismatch_is_rejected(self):
+        upload_id = self._upload(_pdf(1), 'pdf')
+        response = self.client.post(reverse('upload'), {'upload_id': upload_id, 'sha256': '0' * 64})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Project.objects.exists())
+
+    def test_chunked_cloud_save(self):
+        import hashlib
+        data = _zip().read()
+        upload_id = self._upload(data, 'cloud', filename='project.planli')
+        response = self.client.post(reverse('cloud_save'), {
+            'upload_id': upload_id, 'sha256': hashlib.sha256(data).hexdigest(), 'name': 'Gross'})
+        self.assertEqual(response.status_code, 200)
+        download = self.client.get(reverse('cloud_download', args=[response.json()['id']]))
+        self.assertEqual(_zip_members(b''.join(download.streaming_content)), PROJECT_MEMBERS)
+        # Teildatei ist nach dem Entpacken in den Blob-Store verworfen
+        self.assertEqual(list(CLOUD_TMP.glob('.upload_*')), [])
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_limits_and_ownership(self):
+        self.assertEqual(self._init(b'x' * (40 * 1024 * 1024 + 1), 'pdf').status_code, 413)
+        upload_id = self._init(b'%PDF', 'pdf').json()['upload_id']
+        self.assertEqual(self._put(upload_id, b'%PDF-zu-lang', 0).status_code, 413)
+        User.objects.create_user(username='b@example.ch', password='pw')
+        self.client.login(username='b@example.ch', password='pw')
+        self.assertEqual(self._put(upload_id, b'%PDF', 0).status_code, 404)
+
+    def test_cleanup_discards_stale_uploads(self):
+        upload_id = self._init(b'%PDF', 'pdf').json()['upload_id']
+        upload = ChunkedUpload.objects.get(id=upload_id)
+        ChunkedUpload.objects.filter(id=upload_id).update(created_at=timezone.now() - timedelta(days=2))
+        with override_settings(PROJECTS_DIR=self.projects_dir):
+            call_command('cleanup_projects', stdout=StringIO())
+        self.assertFalse(upload.part_path.exists())
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+
+@override_settings(BETA_MODE=False)
+class RenderCacheTests(TestCase):
+    """Inhaltsadressierter Render-Cache (core/render_cache.py): dasselbe PDF
+    wird nur einmal gerendert, Sessions teilen die Dateien per Hardlink."""
+
+    def setUp(self):
+        self.projects_dir = Path(tempfile.mkdtemp(prefix='planli_projects_test_'))
+        self.render = mock.Mock(side_effect=lambda *a, **kw: [Image.new('RGB', (100, 140), 'white')
+                                                              for _ in range(2)])
+        for target, value in [('core.views.PROJECTS_DIR', self.projects_dir),
+                              ('core.views.convert_from_path', self.render)]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        _isolated_render_cache(self)
+        User.objects.create_user(username='t@example.ch', password='pw')
+        self.client.login(username='t@example.ch', password='pw')
+
+    def _upload(self, url='upload', **extra):
+        pdf = SimpleUploadedFile('plan.pdf', _pdf(2), content_type='application/pdf')
+        return self.client.post(reverse(url), {'file': pdf, **extra}).json()
+
+    def test_same_pdf_is_rendered_once(self):
+        first = self._upload()
+        second = self._upload()
+        # Zweiter Upload (neue Session) und Anhängen in die erste: kein Render mehr
+        appended = self._upload('upload_append', session_id=first['session_id'])
+        self.assertEqual(self.render.call_count, 1)
+        self.assertEqual(second['page_count'], 2)
+        self.assertEqual(appended['all_pages'][1],
+                         f"/project_files/{first['session_id']}/uploads/page_2_2.jpg")
+        self.assertEqual(second['page_sizes'], first['page_sizes'])
+
+        page = self.projects_dir / second['session_id'] / 'uploads' / 'page_1_2.jpg'
+        # Cache-Eintrag + drei Sessions teilen sich die Datei
+        self.assertEqual(page.stat().st_nlink, 4)
+        self.assertEqual(self.client.get(second['all_thumbnails'][0]).status_code, 200)
+
+    def test_entry_evicted_during_link_falls_back_to_render(self):
+        self._upload()
+        entry, = settings.RENDER_CACHE_DIR.iterdir()
+        (entry / 'page_2.jpg').unlink()  # evict() mitten im Verlinken
+        second = self._upload()
+        self.assertEqual(self.render.call_count, 2)
+        self.assertEqual(second['page_count'], 2)
+        uploads = self.projects_dir / second['session_id'] / 'uploads'
+        self.assertEqual((uploads / 'page_1_1.jpg').stat().st_nlink, 1)  # frisch gerendert
+        self.assertTrue((uploads / 'page_1_2.jpg').exists())
+
+    def test_cleanup_evicts_unreferenced_entries(self):
+        import shutil
+        first = self._upload()
+        shutil.rmtree(self.projects_dir / first['session_id'])  # Session aufgeräumt
+        entry, = settings.RENDER_CACHE_DIR.iterdir()
+        old = (timezone.now() - timedelta(days=30)).timestamp()
+        os.utime(entry, (old, old))
+        with override_settings(PROJECTS_DIR=self.projects_dir):
+            call_command('cleanup_projects', stdout=StringIO())
+        self.assertFalse(entry.exists())
+
+
+@override_settings(BETA_MODE=False)
+class DiskQuotaTests(TestCase):
+    """Plattenbudget (core/disk_quota.py): Belegung pro Session, LRU-Verdrängung
+    der Renders und Wiederherstellung beim nächsten Zugriff."""
+
+    def setUp(self):
+        self.projects_dir = Path(tempfile.mkdtemp(prefix='planli_projects_test_'))
+        self.render = mock.Mock(side_effect=lambda *a, **kw: [Image.new('RGB', (100, 140), 'white')
+                                                              for _ in range(2)])
+        for target, value in [('core.views.PROJECTS_DIR', self.projects_dir),
+                              ('core.views.convert_from_path', self.render)]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        override = override_settings(PROJECTS_DIR=self.projects_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        _isolated_render_cache(self)
+        User.objects.create_user(username='t@example.ch', password='pw')
+        self.client.login(username='t@example.ch', password='pw')
+
+    def _upload(self, pages, hours_idle):
+        pdf = SimpleUploadedFile('plan.pdf', _pdf(pages), content_type='application/pdf')
+        session_id = self.client.post(reverse('upload'), {'file': pdf}).json()['session_id']
+        Project.objects.filter(id=session_id).update(
+            last_accessed_at=timezone.now() - timedelta(hours=hours_idle))
+        return Project.objects.get(id=session_id)
+
+    def test_lru_eviction_and_restore(self):
+        old = self._upload(pages=1, hours_idle=5)
+        recent = self._upload(pages=2, hours_idle=2)
+        self.assertGreater(old.disk_bytes, 0)
+        uploads = self.projects_dir / str(old.id) / 'uploads'
+
+        # Budget knapp unter der Summe: die älteste Session reicht
+        with mock.patch('core.disk_quota.budget_bytes', return_value=old.disk_bytes + recent.disk_bytes - 1):
+            self.assertEqual(disk_quota.enforce()[0], 1)
+        old.refresh_from_db()
+        self.assertTrue(old.renders_evicted)
+        self.assertFalse((uploads / 'page_1_1.jpg').exists())
+        self.assertTrue((uploads / 'document_1.pdf').exists())
+        self.assertFalse(Project.objects.get(id=recent.id).renders_evicted)
+
+        # Nächster Zugriff rendert die Seiten wieder (Render-Cache-Treffer)
+        response = self.client.get(f'/project_files/{old.id}/uploads/page_1_1.jpg')
+        self.assertEqual(response.status_code, 200)
+        old.refresh_from_db()
+        self.assertFalse(old.renders_evicted)
+        self.assertTrue((uploads / 'thumb_1_2.webp').exists())
+        self.assertGreater(old.last_accessed_at, timezone.now() - timedelta(minutes=1))
+
+    def test_session_used_during_enforce_is_spared(self):
+        old = self._upload(pages=1, hours_idle=5)
+        other = self._upload(pages=1, hours_idle=4)
+        evict_renders = disk_quota.evict_renders
+
+        def evict_and_access(project_dir, claim):
+            # Während die erste Session verdrängt wird, greift jemand auf die
+            # zweite zu — sie stand da schon in der Kandidatenliste.
+            Project.objects.filter(id=other.id).update(last_accessed_at=timezone.now())
+            return evict_renders(project_dir, claim)
+
+        with mock.patch('core.disk_quota.budget_bytes', return_value=1), \
+                mock.patch('core.disk_quota.evict_renders', side_effect=evict_and_access):
+            self.assertEqual(disk_quota.enforce()[0], 1)
+        self.assertTrue(Project.objects.get(id=old.id).renders_evicted)
+        self.assertFalse(Project.objects.get(id=other.id).renders_evicted)
+        self.assertTrue((self.projects_dir / str(other.id) / 'uploads' / 'page_1_1.jpg').exists())
+
+    def test_partially_evicted_source_is_rerendered(self):
+        project = self._upload(pages=2, hours_idle=5)
+        uploads = self.projects_dir / str(project.id) / 'uploads'
+        # Verdrängung hat nur Seite 2 erwischt, als der Request kam
+        (uploads / 'page_1_2.jpg').unlink()
+        Project.objects.filter(id=project.id).update(renders_evicted=True)
+        response = self.client.get(f'/project_files/{project.id}/uploads/page_1_2.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Project.objects.get(id=project.id).renders_evicted)
+
+    def test_upload_over_budget_schedules_eviction(self):
+        with mock.patch('core.disk_quota.budget_bytes', return_value=1), \
+                mock.patch('core.disk_quota._run') as run:
+            self._upload(pages=1, hours_idle=0)
+            disk_quota._thread.join()
+        run.assert_called_once()
+
+
+class DebugSnapCacheTests(TestCase):
+    """debug_snap: rohe Detektionen je Seite gecacht (Modell + Schwelle)."""
+
+    def test_detections_cached_per_threshold(self):
+        from core.management.commands import debug_snap
+        cache_dir = Path(tempfile.mkdtemp(prefix='planli_snap_cache_test_'))
+        render = Image.new('RGB', (40, 30), 'white')
+        raw = (None, np.array([[1., 2., 30., 20.]], dtype=np.float32), np.array([1]), np.array([0.9]))
+        with mock.patch.object(debug_snap, '_raw_boxes', return_value=raw) as raw_boxes:
+            path = debug_snap._cache_path(cache_dir, 'a' * 64, 0, 150, 0.5)
+            first = debug_snap._detections(render, 0.5, path)
+            second = debug_snap._detections(render, 0.5, path)
+            self.assertEqual(raw_boxes.call_count, 1)
+            self.assertEqual((first[3], second[3]), (False, True))
+            np.testing.assert_array_equal(second[0], raw[1])
+
+            # Andere Schwelle → anderer Schlüssel, Modell läuft wieder
+            other = debug_snap._cache_path(cache_dir, 'a' * 64, 0, 150, 0.3)
+            self.assertNotEqual(other, path)
+            debug_snap._detections(render, 0.3, other)
+            self.assertEqual(raw_boxes.call_count, 2)
+
+
+class CleanupProjectsTests(TestCase):
+    """cleanup_projects: batchweise, parallel und mit Limit pro Lauf."""
+
+    def setUp(self):
+        self.projects_dir = Path(tempfile.mkdtemp(prefix='planli_projects_test_'))
+        _isolated_render_cache(self)
+        self.old = (timezone.now() - timedelta(days=30)).timestamp()
+
+    def _project(self, days_ago):
+        project = Project.objects.create(original_filename='plan.pdf')
+        Project.objects.filter(pk=project.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        (self.projects_dir / str(project.id)).mkdir()
+        return project
+
+    def _orphan(self, name):
+        path = self.projects_dir / name
+        path.mkdir()
+        os.utime(path, (self.old, self.old))
+        return path
+
+    def _cleanup(self, *args):
+        with override_settings(PROJECTS_DIR=self.projects_dir), \
+                mock.patch('core.management.commands.cleanup_projects.BATCH_SIZE', 2):
+            call_command('cleanup_projects', *args, stdout=StringIO())
+
+    def test_expired_and_orphans(self):
+        expired = [self._project(days_ago=20) for _ in range(5)]
+        fresh = self._project(days_ago=1)
+        orphans = [self._orphan(str(uuid.uuid4())), self._orphan('kein-uuid')]
+        self._cleanup('--max-dirs', '0')
+
+        self.assertEqual(Project.objects.filter(files_deleted=True).count(), 5)
+        self.assertFalse(any((self.projects_dir / str(p.id)).exists() for p in expired))
+        self.assertFalse(any(path.exists() for path in orphans))
+        self.assertTrue((self.projects_dir / str(fresh.id)).exists())
+
+    def test_dry_run_changes_nothing(self):
+        expired = [self._project(days_ago=20) for _ in range(3)]
+        self._cleanup('--dry-run')
+        self.assertFalse(Project.objects.filter(files_deleted=True).exists())
+        self.assertTrue(all((self.projects_dir / str(p.id)).exists() for p in expired))
+
+    def test_max_dirs_continues_next_run(self):
+        for _ in range(5):
+            self._project(days_ago=20)
+        self._cleanup('--max-dirs', '3')
+        self.assertEqual(Project.objects.filter(files_deleted=True).count(), 3)
+        self._cleanup('--max-dirs', '3')
+        self.assertEqual(Project.objects.filter(files_deleted=True).count(), 5)
+        self.assertEqual(list(self.projects_dir.iterdir()), [])
+
+
+class StatistikTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        User.objects.create_user(username='staff@example.ch', password='pw', is_staff=True)
+        self.client.login(username='staff@example.ch', password='pw')
+
+    def _event(self, session_key, days_ago):
+        event = AnalysisEvent.objects.create(session_key=session_key, page_number=1)
+        AnalysisEvent.objects.filter(pk=event.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+
+    def _upload(self, days_ago):
+        project = Project.objects.create(original_filename='plan.pdf')
+        Project.objects.filter(pk=project.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+
+    def test_counts_from_rollups_and_today(self):
+        self._upload(days_ago=40)
+        self._upload(days_ago=3)
+        self._upload(days_ago=0)
+        self._event('a', days_ago=5)
+        self._event('a', days_ago=5)
+        self._event('a', days_ago=2)   # a: zwei Tage → wiedergekehrt
+        self._event('b', days_ago=3)
+        self._event('b', days_ago=0)   # b: früher + heute → wiedergekehrt
+        self._event('c', days_ago=0)   # c: nur heute
+        self._event('', days_ago=1)    # ohne Session: zählt nur als Analyse
+
+        context = self.client.get(reverse('statistik')).context
+        self.assertEqual((context['uploads_total'], context['uploads_30'], context['uploads_7']), (3, 2, 2))
+        self.assertEqual((context['analyses_total'], context['analyses_7']), (7, 7))
+        self.assertEqual((context['distinct_sessions'], context['returning_sessions']), (3, 2))
+        self.assertEqual([row['n'] for row in context['daily_uploads']], [1, 1])
+        # Abgeschlossene Tage sind verdichtet, heute nicht
+        self.assertEqual(DailyStat.objects.order_by('-day').first().day, timezone.localdate() - timedelta(days=1))
+        self.assertEqual(SessionDay.objects.count(), 3)
+
+    def test_context_is_cached(self):
+        self.client.get(reverse('statistik'))
+        self._upload(days_ago=0)
+        self.assertEqual(self.client.get(reverse('statistik')).context['uploads_total'], 0)
+
+    def test_rollup_command_recomputes_days(self):
+        self._event('a', days_ago=2)
+        call_command('rollup_stats', stdout=StringIO())
+        self._event('a', days_ago=1)
+        self._event('a', days_ago=2)
+        call_command('rollup_stats', '--days=3', stdout=StringIO())
+        self.assertEqual(sum(DailyStat.objects.values_list('analyses', flat=True)), 3)
+        self.assertEqual(SessionDay.objects.count(), 2)
+
+    def test_rollup_command_recomputes_yesterday(self):
+        self._event('a', days_ago=1)
+        call_command('rollup_stats', stdout=StringIO())
+        self._event('b', days_ago=1)  # spät aus dem Puffer geschrieben
+        call_command('rollup_stats', stdout=StringIO())
+        yesterday = DailyStat.objects.get(day=timezone.localdate() - timedelta(days=1))
+        self.assertEqual((yesterday.analyses, yesterday.sessions), (2, 2))
+
+
+@mock.patch('core.tracking.EventBuffer._run')  # kein Hintergrund-Thread im Test
+class TrackingBufferTests(TestCase):
+    def test_events_are_written_on_flush(self, _run):
+        from .tracking import EventBuffer
+        buffer = EventBuffer(flush_size=50, flush_seconds=5)
+        buffer.record('a' * 32, None, 1)
+        recorded_at = timezone.now()
+        buffer.record('a' * 32, None, 2)
+        self.assertEqual(AnalysisEvent.objects.count(), 0)
+
+        self.assertEqual(buffer.flush(), 2)
+        events = AnalysisEvent.objects.order_by('page_number')
+        self.assertEqual({e.session_key for e in events}, {'a' * 32})
+        self.assertLessEqual(events[0].created_at, recorded_at)
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_full_buffer_wakes_writer(self, _run):
+        from .tracking import EventBuffer
+        buffer = EventBuffer(flush_size=2, flush_seconds=5)
+        buffer.record('a', None, 1)
+        self.assertFalse(buffer._wake.is_set())
+        buffer.record('a', None, 2)
+        self.assertTrue(buffer._wake.is_set())
+
+    def test_anonymous_visitor_gets_cookie_not_session(self, _run):
+        from django.contrib.sessions.models import Session
+        from django.test import RequestFactory
+        from .tracking import VISITOR_COOKIE, visitor_key
+        request = RequestFactory().get('/')
+        request.session = mock.Mock(session_key=None)
+        key, new = visitor_key(request)
+        self.assertTrue(new)
+        request.COOKIES[VISITOR_COOKIE] = key
+        self.assertEqual(visitor_key(request), (key, False))
+        request.COOKIES[VISITOR_COOKIE] = 'x' * 200  # manipuliert → neuer Schlüssel
+        self.assertNotEqual(visitor_key(request)[0], 'x' * 200)
+        self.assertFalse(Session.objects.exists())
+
+
+class ExplainQueriesTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_queries', '--strict', stdout=out)
+        self.assertIn('keine unerwarteten Scans', out.getvalue())
+
+
+class CopySqliteToDbTests(TestCase):
+    def test_refuses_source_with_other_migration_state(self):
+        import sqlite3
+        from django.core.management.base import CommandError
+        source = Path(tempfile.mkdtemp()) / 'alt.sqlite3'
+        with self.assertRaisesMessage(CommandError, 'nicht gefunden'):
+            call_command('copy_sqlite_to_db', str(source), stdout=StringIO())
+        sqlite3.connect(source).close()  # leere, nie migrierte DB
+        with self.assertRaisesMessage(CommandError, 'Migrationsstand'):
+            call_command('copy_sqlite_to_db', str(source), stdout=StringIO())
+
+
+class CopySqliteToDbDataTests(TransactionTestCase):
+    """Ohne umschliessende Test-Transaktion — sonst lässt sich die Test-DB
+    nicht per SQLite-Backup als Quelle abziehen."""
+
+    def test_keeps_permissions_and_user_permissions(self):
+        import sqlite3
+        from django.contrib.auth.models import Permission
+        from django.db import connection
+        user = User.objects.create_user(username='p@example.ch', password='pw')
+        user.user_permissions.add(Permission.objects.get(codename='view_project'))
+        permissions = Permission.objects.count()
+        source = Path(tempfile.mkdtemp()) / 'alt.sqlite3'
+        connection.ensure_connection()
+        dest = sqlite3.connect(source)
+        connection.connection.backup(dest)
+        dest.close()
+        User.objects.all().delete()  # Ziel leer bis auf ContentTypes/Permissions
+
+        call_command('copy_sqlite_to_db', str(source), stdout=StringIO())
+        self.assertEqual(Permission.objects.count(), permissions)
+        self.assertEqual(User.user_permissions.through.objects.count(), 1)
+        self.assertTrue(User.objects.get(username='p@example.ch').has_perm('core.view_project'))
+
+
+@override_settings(BETA_MODE=False)
+class AnalyzeTimingTests(TestCase):
+    """Schritt-Timings von predict_image in Antwort, Tracking und Statistik."""
+
+    def setUp(self):
+        self.projects_dir = Path(tempfile.mkdtemp(prefix='planli_projects_test_'))
+        patcher = mock.patch('core.views.PROJECTS_DIR', self.projects_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username='t@example.ch', password='pw', is_staff=True)
+        self.client.login(username='t@example.ch', password='pw')
+        self.project = Project.objects.create(user=self.user, original_filename='plan.pdf')
+        uploads = self.projects_dir / str(self.project.id) / 'uploads'
+        uploads.mkdir(parents=True)
+        Image.new('RGB', (600, 300), 'white').save(uploads / 'page_1_1.jpg')
+
+    def test_stage_timings_are_reported_and_tracked(self):
+        import numpy as np
+
+        def fake_predict(image_bytes, timings, **kwargs):
+            with timings.stage('preprocess'):
+                pass
+            with timings.stage('inference'):
+                pass
+            timings.info.update(width=600, height=300)
+            return np.zeros((0, 4)), [], [], []
+
+        with mock.patch('core.views.predict_image', side_effect=fake_predict), \
+                mock.patch('core.tracking.EventBuffer._run'):
+            response = self.client.post(reverse('analyze_page'), {'session_id': str(self.project.id), 'page': 1})
+            self.assertEqual(response.status_code, 200)
+            stages = response.json()['performance_metrics']['stages']
+            self.assertEqual(list(stages), ['preprocess', 'inference'])
+            self.assertEqual(set(stages['inference']), {'ms', 'rss_mb'})
+            from .tracking import analysis_events
+            analysis_events.flush()
+
+        event = AnalysisEvent.objects.get()
+        self.assertEqual(event.timings['project'], str(self.project.id))
+        self.assertEqual(event.timings['width'], 600)
+
+        from django.core.cache import cache
+        cache.clear()
+        context = self.client.get(reverse('statistik')).context
+        self.assertEqual([row['stage'] for row in context['stage_timings']], ['preprocess', 'inference'])
+        self.assertEqual(context['slowest_analyses'][0]['project'], str(self.project.id))
+
+    def test_stage_timings_summary(self):
+        from model_handler import StageTimings
+        timings = StageTimings()
+        with timings.stage('nms'):
+            pass
+        self.assertGreaterEqual(timings.stages['nms']['ms'], 0)
+        self.assertTrue(timings.summary().startswith('nms='))
+
+
+class MetricsTests(TestCase):
+    """/metrics: Prometheus-Textformat, über Prozessdateien zusammengeführt."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='m@example.ch', password='pw')
+
+    def test_requires_staff_or_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with override_settings(METRICS_TOKEN='geheim'):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer geheim')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('# TYPE planli_analysis_stage_seconds histogram', response.content.decode())
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer falsch').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.login(username='m@example.ch', password='pw')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_merges_process_files(self):
+        from . import metrics
+        metrics_dir = Path(tempfile.mkdtemp(prefix='planli_metrics_test_'))
+        # Ein beendeter Worker: Histogramme zählen weiter, Gauges nicht
+        dead = {'planli_upload_pages': {'[]': [0, 1, 0, 0, 0, 0, 0, 0, 1, 2]},
+                'planli_analyses_in_progress': {'[]': 5}}
+        (metrics_dir / '999999999.json').write_text(json.dumps(dead))
+        with override_settings(METRICS_DIR=str(metrics_dir)):
+            metrics.UPLOAD_PAGES.observe(3)
+            text = metrics.exposition()
+        own = metrics.UPLOAD_PAGES.values['[]']
+        self.assertTrue((metrics_dir / f'{os.getpid()}.json').exists())
+        self.assertIn(f'planli_upload_pages_count {own[-2] + 1}', text)
+        self.assertIn('planli_upload_pages_bucket{le="+Inf"}', text)
+        self.assertIn(f'planli_process_resident_memory_bytes{{pid="{os.getpid()}"}}', text)
+        self.assertNotIn('planli_analyses_in_progress 5', text)
+
+    def test_gauges_flush_on_every_change(self):
+        from . import metrics
+        metrics_dir = Path(tempfile.mkdtemp(prefix='planli_metrics_test_'))
+        with override_settings(METRICS_DIR=str(metrics_dir), METRICS_FLUSH_SECONDS=3600):
+            metrics.flush()
+            with metrics.ANALYSES_IN_PROGRESS.track_inprogress():
+                written = json.loads((metrics_dir / f'{os.getpid()}.json').read_text())
+                running = written['planli_analyses_in_progress']['[]']
+            written = json.loads((metrics_dir / f'{os.getpid()}.json').read_text())
+        self.assertEqual(written['planli_analyses_in_progress']['[]'], running - 1)
+
+    def test_observation_inside_interval_is_written_later(self):
+        from . import metrics
+        metrics_dir = Path(tempfile.mkdtemp(prefix='planli_metrics_test_'))
+        if metrics._pending is not None:
+            metrics._pending.cancel()  # Timer aus einem früheren Test
+            metrics._pending = None
+        with override_settings(METRICS_DIR=str(metrics_dir), METRICS_FLUSH_SECONDS=0.2):
+            metrics.flush()
+            metrics.UPLOAD_PAGES.observe(7)  # innerhalb des Intervalls
+            metrics._pending.join(5)
+        written = json.loads((metrics_dir / f'{os.getpid()}.json').read_text())
+        self.assertEqual(written['planli_upload_pages']['[]'], metrics.UPLOAD_PAGES.values['[]'])
+
+
+@override_settings(BETA_MODE=False)
+class RequestProfileTests(TestCase):
+    """?profile=1 / X-Planli-Profile: nur für Staff, Ablage unter DIAGNOSTICS_DIR."""
+
+    def setUp(self):
+        self.projects_dir = Path(tempfile.mkdtemp(prefix='planli_projects_test_'))
+        patcher = mock.patch('core.views.PROJECTS_DIR', self.projects_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        override = override_settings(DIAGNOSTICS_DIR=Path(tempfile.mkdtemp(prefix='planli_diagnostics_test_')))
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username='p@example.ch', password='pw')
+        self.client.login(username='p@example.ch', password='pw')
+        self.project = Project.objects.create(user=self.user, original_filename='plan.pdf')
+        uploads = self.projects_dir / str(self.project.id) / 'uploads'
+        uploads.mkdir(parents=True)
+        Image.new('RGB', (60, 30), 'white').save(uploads / 'page_1_1.jpg')
+
+    def _analyze(self):
+        import numpy as np
+        from .tracking import analysis_events
+        # torch.profiler selbst wird nicht getestet (kein Trace → has_trace=False)
+        with mock.patch('core.views.predict_image', return_value=(np.zeros((0, 4)), [], [], [])), \
+                mock.patch('core.profiling._torch_profiler'), mock.patch('core.tracking.EventBuffer._run'):
+            response = self.client.post(reverse('analyze_page') + '?profile=1',
+                                        {'session_id': str(self.project.id), 'page': 1})
+            analysis_events.flush()
+        return response
+
+    def test_only_staff_can_profile(self):
+        response = self._analyze()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Planli-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_profile_is_stored_listed_and_deleted(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        response = self._analyze()
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(id=response['X-Planli-Profile-Id'])
+        self.assertEqual((profile.view_name, profile.status_code), ('analyze_page', 200))
+        self.assertTrue((profile.directory / 'profile.pstats').exists())
+        self.assertIn('cumulative', profile.top_functions)
+
+        changelist = self.client.get(reverse('admin:core_requestprofile_changelist'))
+        self.assertContains(changelist, reverse('profile_download', args=[profile.id, 'pstats']))
+        download = self.client.get(reverse('profile_download', args=[profile.id, 'pstats']))
+        self.assertEqual(download.status_code, 200)
+
+        directory = profile.directory
+        profile.delete()
+        self.assertFalse(directory.exists())
+
+    def test_failing_view_is_recorded_as_500(self):
+        from django.test import RequestFactory
+        from .profiling import profiled
+        self.user.is_staff = True
+
+        @profiled
+        def broken(request):
+            raise RuntimeError('kaputt')
+
+        request = RequestFactory().get('/?profile=1')
+        request.user = self.user
+        with self.assertRaises(RuntimeError):
+            broken(request)
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.view_name, profile.status_code), ('broken', 500))
+        self.assertTrue((profile.directory / 'profile.pstats').exists())
+
+
+class BenchPipelineTests(TestCase):
+    """manage.py bench_pipeline: Lauf über einen Korpus und Vergleich zweier Läufe."""
+
+    def test_run_and_diff(self):
+        import numpy as np
+        corpus = Path(tempfile.mkdtemp(prefix='planli_bench_test_'))
+        (corpus / 'plan.pdf').write_bytes(_pdf(pages=2))
+        detections = iter([2, 1, 2, 3])
+
+        def fake_predict(image_bytes, timings, **kwargs):
+            with timings.stage('inference'):
+                pass
+            n = next(detections)
+            return np.zeros((n, 4)), [1] * n, [0.9] * n, [1.0] * n
+
+        render = [Image.new('RGB', (100, 140), 'white') for _ in range(2)]
+        with mock.patch('core.management.commands.bench_pipeline.predict_image', side_effect=fake_predict), \
+                mock.patch('core.management.commands.bench_pipeline.convert_from_path', return_value=render):
+            for name in ('vorher', 'nachher'):
+                call_command('bench_pipeline', str(corpus), '--label', name,
+                             '--output', str(corpus / f'{name}.json'), stdout=StringIO())
+
+        run = json.loads((corpus / 'vorher.json').read_text())
+        self.assertEqual(run['summary']['pages'], 2)
+        self.assertEqual(run['summary']['detections'], 3)
+        self.assertEqual(set(run['summary']['stages']), {'render', 'inference'})
+        self.assertEqual(run['pages'][0]['labels'], {'Fenster': 2})
+        # Vollständige Snap-Parameter, auch die Defaults von refine_boxes_to_lines
+        self.assertEqual(run['meta']['snap']['ink_mode'], 'black')
+
+        out = StringIO()
+        call_command('bench_pipeline', '--diff', str(corpus / 'vorher.json'), str(corpus / 'nachher.json'), stdout=out)
+        self.assertIn('plan.pdf S.2: 1 → 3', out.getvalue())
+        self.assertNotIn('S.1:', out.getvalue())
+
+
+class EvaluateModelTests(TestCase):
+    """manage.py evaluate_model: mAP/IoU/Kantenversatz und das Gate."""
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp(prefix='planli_eval_test_'))
+        Image.new('RGB', (200, 200), 'white').save(self.folder / 'plan.jpg')
+        self.gt = [[10, 10, 60, 60], [100, 100, 150, 180]]
+        (self.folder / 'annotations.json').write_text(json.dumps([{
+            'image': 'plan.jpg',
+            'annotations': [{'bbox': box, 'category_id': 1} for box in self.gt],
+        }]))
+
+    def _evaluate(self, boxes, *args):
+        import numpy as np
+        prediction = (np.array(boxes, dtype=float), [1] * len(boxes), [0.9] * len(boxes), [1.0] * len(boxes))
+        with mock.patch('core.management.commands.evaluate_model.predict_image', return_value=prediction):
+            call_command('evaluate_model', str(self.folder), str(self.folder / 'annotations.json'),
+                         *args, stdout=StringIO())
+
+    def test_perfect_prediction_and_baseline_gate(self):
+        from django.core.management.base import CommandError
+        baseline = self.folder / 'baseline.json'
+        self._evaluate(self.gt, '--output', str(baseline))
+        metrics = json.loads(baseline.read_text())['metrics']
+        self.assertEqual((metrics['map50'], metrics['mean_iou'], metrics['edge_error_px']), (1.0, 1.0, 0.0))
+
+        # Jede Kante 3 px daneben: Treffer bleiben, Kantenversatz steigt
+        shifted = [[x1 + 3, y1 + 3, x2 + 3, y2 + 3] for x1, y1, x2, y2 in self.gt]
+        with self.assertRaisesMessage(CommandError, 'Kantenversatz gegenüber Baseline'):
+            self._evaluate(shifted, '--baseline', str(baseline))
+        self._evaluate(shifted, '--baseline', str(baseline), '--max-edge-growth', '5', '--max-map-drop', '0.5',
+                       '--max-latency-growth', '100')
+
+    def test_missed_box_halves_map(self):
+        from django.core.management.base import CommandError
+        from core.management.commands.evaluate_model import average_precision
+        results = [{'boxes': [self.gt[0]], 'labels': [1], 'scores': [0.9],
+                    'gt_boxes': self.gt, 'gt_labels': [1, 1]}]
+        self.assertAlmostEqual(average_precision(results, 1, 0.5), 0.5)
+        with self.assertRaisesMessage(CommandError, 'mAP@0.5 unter Budget'):
+            self._evaluate(self.gt[:1], '--min-map50', '0.9')
+
+    def test_min_darkness_is_validated_and_recorded(self):
+        from django.core.management.base import CommandError
+        with self.assertRaisesMessage(CommandError, "Zahl oder 'auto' erwartet"):
+            self._evaluate(self.gt, '--min-darkness', 'dunkel')
+        output = self.folder / 'run.json'
+        self._evaluate(self.gt, '--min-darkness', '30', '--output', str(output))
+        snap = json.loads(output.read_text())['config']['snap']
+        self.assertEqual((snap['min_darkness'], snap['ink_mode']), (30.0, 'black'))
+
+    def test_swapped_model_is_loaded_before_timing(self):
+        import model_handler
+        weights = self.folder / 'anderes.pth'
+        weights.write_bytes(b'')
+        calls = []
+        with mock.patch.object(model_handler, 'load_model', side_effect=lambda: calls.append('load')), \
+                mock.patch('core.management.commands.evaluate_model.predict_image',
+                           side_effect=lambda *a, **kw: calls.append('predict') or (np.zeros((0, 4)), [], [], [])):
+            call_command('evaluate_model', str(self.folder), str(self.folder / 'annotations.json'),
+                         '--model', str(weights), stdout=StringIO())
+        self.assertEqual(calls, ['load', 'predict'])
+        self.assertNotEqual(model_handler.MODEL_PATH, str(weights.resolve()))  # zurückgesetzt
@@ -0,0 +1,106 @@
+"""
+Gepuffertes Beta-Tracking: AnalysisEvents werden gesammelt per bulk_create
+geschrieben statt synchron im Request.
+
+Auf SQLite (transaction_mode=IMMEDIATE) nimmt jeder INSERT das globale
+Schreib-Lock — im heissen Pfad von analyze_page hiess das: die Antwort
+wartet u.U. auf einen parallel laufenden Cloud-Save. record() hängt das
+Event nur an eine Liste; ein Hintergrund-Thread schreibt, sobald
+TRACKING_FLUSH_SIZE Events beisammen sind bzw. spätestens alle
+TRACKING_FLUSH_SECONDS, und beim Prozessende (atexit) den Rest.
+
+Ein Puffer pro Prozess, der Thread startet erst mit dem ersten Event (nach
+dem Fork des gunicorn-Workers). Stirbt ein Worker hart (SIGKILL, OOM),
+gehen bis zu einem Intervall Events verloren — für die Beta-Schätzung in
+Ordnung. created_at ist der Zeitpunkt von record(), nicht der des Schreibens.
+
+Besucher-Schlüssel (AnalysisEvent.session_key, Proxy für die Wiederkehr-
+Schätzung): der Session-Key eingeloggter Nutzer, sonst ein zufälliges Cookie
+(VISITOR_COOKIE). Früher wurde dafür für jeden anonymen Besucher eine
+DB-Session angelegt — ein synchroner INSERT pro neuem Besucher, genau der
+Schreibzugriff, den der Puffer vermeiden soll.
+"""
+import atexit
+import logging
+import re
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+VISITOR_COOKIE = 'planli_visitor'
+_VISITOR_RE = re.compile(r'[0-9a-f]{32}')
+
+
+def visitor_key(request):
+    """(Schlüssel, neu?) des Besuchers; neu → per remember_visitor() setzen."""
+    if request.session.session_key:
+        return request.session.session_key, False
+    cookie = request.COOKIES.get(VISITOR_COOKIE, '')
+    if _VISITOR_RE.fullmatch(cookie):
+        return cookie, False
+    return uuid.uuid4().hex, True
+
+
+def remember_visitor(response, key):
+    response.set_cookie(VISITOR_COOKIE, key, max_age=settings.SESSION_COOKIE_AGE, httponly=True,
+                        secure=settings.SESSION_COOKIE_SECURE, samesite='Lax')
+    return response
+
+
+class EventBuffer:
+    def __init__(self, flush_size, flush_seconds):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._events = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def record(self, session_key, user_id, page_number, timings=None):
+        """Eine Analyse vormerken (session_key: siehe visitor_key())."""
+        with self._lock:
+            self._events.append((timezone.now(), session_key, user_id, page_number, timings))
+            full = len(self._events) >= self.flush_size
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='analysis-event-flush', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+            connection.close()  # Verbindung des Threads nicht offen halten
+
+    def flush(self):
+        """Alle gepufferten Events schreiben; gibt die Anzahl zurück."""
+        from .models import AnalysisEvent
+
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        try:
+            AnalysisEvent.objects.bulk_create([
+                AnalysisEvent(created_at=created_at, session_key=session_key,
+                              user_id=user_id, page_number=page_number, timings=timings)
+                for created_at, session_key, user_id, page_number, timings in events
+            ])
+        except Exception:
+            logger.exception('%d AnalysisEvents konnten nicht gespeichert werden', len(events))
+            return 0
+        return len(events)
+
+
+analysis_events = EventBuffer(settings.TRACKING_FLUSH_SIZE, settings.TRACKING_FLUSH_SECONDS)
+metrics.TRACKING_BUFFER_EVENTS.function = lambda: len(analysis_events._events)
+atexit.register(analysis_events.flush)
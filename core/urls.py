@@ -10,17 +10,29 @@ urlpatterns = [
     path('impressum/', views.impressum, name='impressum'),
     path('agb/', views.agb, name='agb'),
     path('statistik/', views.statistik, name='statistik'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('diagnostics/profiles/<uuid:profile_id>/<str:kind>', views.profile_download, name='profile_download'),
     path('upload', views.upload_file, name='upload'),
     path('upload_append', views.upload_append, name='upload_append'),
     path('analyze_page', views.analyze_page, name='analyze_page'),
     path('save_training_data', views.save_training_data, name='save_training_data'),
     path('report_bug', views.report_bug, name='report_bug'),
+    # Fortsetzbare Uploads in Stücken (core/chunked_upload.py) für upload,
+    # upload_append, cloud/projects/save und report_bug
+    path('upload/chunked', views.chunked_upload_init, name='chunked_upload_init'),
+    path('upload/chunked/<uuid:upload_id>', views.chunked_upload_chunk, name='chunked_upload_chunk'),
     path('feedback', views.submit_feedback, name='submit_feedback'),
     path('project_files/<str:project_id>/<path:filename>', views.serve_project_file, name='serve_project_file'),
+    # Kachel-Pyramide (DeepZoom) je Seiten-Render, siehe core/page_images.py
+    path('project_tiles/<str:project_id>/page_<int:source_index>_<int:page>.dzi',
+         views.serve_page_tiles, name='serve_page_tiles'),
+    path('project_tiles/<str:project_id>/page_<int:source_index>_<int:page>_files/<int:level>/<int:col>_<int:row>.jpg',
+         views.serve_page_tile, name='serve_page_tile'),
     # Online-Ablage ("Meine Projekte")
     path('cloud/projects', views.cloud_list, name='cloud_list'),
     path('cloud/projects/save', views.cloud_save, name='cloud_save'),
     path('cloud/projects/<uuid:project_id>/download', views.cloud_download, name='cloud_download'),
+    path('cloud/projects/<uuid:project_id>/thumbnail', views.cloud_thumbnail, name='cloud_thumbnail'),
     path('cloud/projects/<uuid:project_id>/rename', views.cloud_rename, name='cloud_rename'),
     path('cloud/projects/<uuid:project_id>/delete', views.cloud_delete, name='cloud_delete'),
 ]
@@ -1,32 +1,38 @@
 import os
+import re
 import uuid
 import gc
 import time
 import json
 import logging
+import zipfile
 
 from datetime import timedelta
-from collections import defaultdict
 
 from django.shortcuts import render
-from django.http import JsonResponse, FileResponse, Http404, HttpResponse
-from django.views.decorators.http import require_POST
+from django.urls import reverse
+from django.http import JsonResponse, Http404, HttpResponse
+from django.views.decorators.http import require_POST, require_http_methods
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.contrib.auth.views import redirect_to_login
 from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db.models import Count
-from django.db.models.functions import TruncDate
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
 from django.conf import settings
 
-from .models import Project, BugReport, AnalysisEvent, StoredProject, FeedbackResponse
+from .models import Project, BugReport, StoredProject, FeedbackResponse, ChunkedUpload, RequestProfile
+from . import chunked_upload, cloud_store, disk_quota, metrics, page_images, profiling, render_cache, stats, tracking
+from .file_delivery import file_response, ranged_response
 from accounts.models import subscription_for
 
 from pdf2image import convert_from_path
+from PIL import Image
 from PyPDF2 import PdfReader
 
-from model_handler import predict_image, cleanup_memory
+from model_handler import StageTimings, predict_image, cleanup_memory
 
 logger = logging.getLogger(__name__)
 
@@ -62,14 +68,18 @@ def _read_only(request):
 
 def _get_project(request, project_id):
     """Projekt mit Ownership-Prüfung holen (im BETA_MODE nur per ID).
-    Gibt None zurück, wenn nicht gefunden, kein Zugriff oder ungültige ID."""
+    Gibt None zurück, wenn nicht gefunden, kein Zugriff oder ungültige ID.
+    Vermerkt den Zugriff für die LRU-Verdrängung (core/disk_quota.py)."""
     try:
         qs = Project.objects.filter(id=project_id)
         if not settings.BETA_MODE:
             qs = qs.filter(user=request.user)
-        return qs.first()
+        project = qs.first()
     except (ValueError, ValidationError):
         return None
+    if project is not None:
+        disk_quota.touch(project)
+    return project
 
 
 @ensure_csrf_cookie  # CSRF-Cookie immer setzen — nötig für die API-POSTs des Frontends
@@ -121,6 +131,7 @@ def robots_txt(request):
         'User-agent: *',
         'Disallow: /accounts/',
         'Disallow: /project_files/',
+        'Disallow: /project_tiles/',
         '',
         'Sitemap: https://planli.net/sitemap.xml',
     ]
@@ -144,73 +155,126 @@ def sitemap_xml(request):
 
 @staff_member_required
 def statistik(request):
-    """Interne Beta-Auswertung (nur für Staff/Superuser)."""
-    now = timezone.now()
-    d7 = now - timedelta(days=7)
-    d30 = now - timedelta(days=30)
-
-    projects = Project.objects.all()
-    events = AnalysisEvent.objects.all()
-
-    uploads_total = projects.count()
-    uploads_registered = projects.filter(user__isnull=False).count()
-
-    # Wiederkehr-Schätzung: Sessions mit Analysen an >= 2 verschiedenen Tagen
-    session_days = defaultdict(set)
-    for sk, dt in events.exclude(session_key='').values_list('session_key', 'created_at'):
-        session_days[sk].add(timezone.localtime(dt).date())
-    returning_sessions = sum(1 for days in session_days.values() if len(days) >= 2)
-
-    daily_uploads = (
-        projects.filter(created_at__gte=now - timedelta(days=14))
-        .annotate(day=TruncDate('created_at'))
-        .values('day').annotate(n=Count('id')).order_by('day')
-    )
-
-    context = {
-        'now': now,
-        'uploads_total': uploads_total,
-        'uploads_30': projects.filter(created_at__gte=d30).count(),
-        'uploads_7': projects.filter(created_at__gte=d7).count(),
-        'uploads_registered': uploads_registered,
-        'uploads_anon': uploads_total - uploads_registered,
-        'analyses_total': events.count(),
-        'analyses_30': events.filter(created_at__gte=d30).count(),
-        'analyses_7': events.filter(created_at__gte=d7).count(),
-        'distinct_sessions': len(session_days),
-        'returning_sessions': returning_sessions,
-        'daily_uploads': daily_uploads,
-        'bugs_total': BugReport.objects.count(),
-        'bugs_open': BugReport.objects.filter(resolved=False).count(),
-    }
+    """Interne Beta-Auswertung (nur für Staff/Superuser). Zahlen aus den
+    Tages-Rollups (core/stats.py), für STATISTIK_CACHE_SECONDS zwischengespeichert."""
+    context = cache.get_or_set('statistik', stats.dashboard_context, settings.STATISTIK_CACHE_SECONDS)
     return render(request, 'statistik.html', context)
 
 
+def metrics_view(request):
+    """Prometheus-Metriken aller Worker (core/metrics.py). Zugriff für Staff
+    oder mit `Authorization: Bearer <METRICS_TOKEN>` (Prometheus-Scraper)."""
+    token = settings.METRICS_TOKEN
+    auth = request.headers.get('Authorization', '')
+    scraper = bool(token) and constant_time_compare(auth, f'Bearer {token}')
+    if not scraper and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+PROFILE_FILES = {'pstats': profiling.PSTATS_NAME, 'trace': profiling.TRACE_NAME}
+
+
+@staff_member_required
+def profile_download(request, profile_id, kind):
+    """Dateien eines RequestProfile (core/profiling.py) für den Admin."""
+    if kind not in PROFILE_FILES:
+        raise Http404
+    try:
+        profile = RequestProfile.objects.get(id=profile_id)
+    except RequestProfile.DoesNotExist:
+        raise Http404
+    path = profile.directory / PROFILE_FILES[kind]
+    if not path.exists():
+        raise Http404
+    return file_response(request, path, as_attachment=True,
+                         filename=f'{profile.view_name}_{profile.created_at:%Y%m%d_%H%M%S}_{PROFILE_FILES[kind]}')
+
+
+PAGE_RENDER_RE = re.compile(r'uploads/page_(?P<source>\d+)_(?P<page>\d+)\.jpg')
+
+
 def serve_project_file(request, project_id, filename):
     denied = _access_denied(request)
     if denied:
         return denied
-    if _get_project(request, project_id) is None:
+    project = _get_project(request, project_id)
+    if project is None:
         raise Http404
+    _restore_renders(project)
     project_dir = PROJECTS_DIR / project_id
     file_path = project_dir / filename
     if not file_path.exists():
         raise Http404("File not found")
     if not str(file_path.resolve()).startswith(str(project_dir.resolve())):
         raise Http404
-    response = FileResponse(open(file_path, 'rb'))
-    # Page renders are immutable for the lifetime of a session (never
-    # re-rendered under the same filename) — cache in the browser so
-    # switching pages doesn't re-fetch them. `private`, not `public`: access
-    # here is guarded by the unguessable session UUID, not meant for shared caches.
-    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    # Seiten-Renders: moderne Formate per Accept-Header (core/page_images.py).
+    # Die URL bleibt page_<s>_<i>.jpg — daher Vary, damit kein Cache dem
+    # JPEG-only-Client die WebP-Antwort gibt.
+    match = PAGE_RENDER_RE.fullmatch(filename)
+    if match:
+        variant = page_images.negotiate_variant(project_dir, int(match['source']), int(match['page']),
+                                                request.headers.get('Accept', ''))
+        content_type = None
+        if variant:
+            file_path, content_type = variant
+        response = _immutable(file_response(request, file_path, content_type=content_type))
+        patch_vary_headers(response, ['Accept'])
+        return response
+    return _immutable(file_response(request, file_path))
+
+
+def _immutable(response):
+    # Page renders (and everything derived from them: tiles) are immutable for
+    # the lifetime of a session (never re-rendered under the same filename) —
+    # cache in the browser so switching pages doesn't re-fetch them. `private`,
+    # not `public`: access here is guarded by the unguessable session UUID, not
+    # meant for shared caches.
+    if response.status_code < 400:
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
     return response
 
 
+def serve_page_tiles(request, project_id, source_index, page):
+    """DeepZoom-Beschreibung (.dzi) eines Seiten-Renders — Einstieg für den
+    Kachel-Viewer, die Kacheln selbst liefert serve_page_tile."""
+    denied = _access_denied(request)
+    if denied:
+        return denied
+    project = _get_project(request, project_id)
+    if project is None:
+        raise Http404
+    _restore_renders(project)
+    render_path = page_images.page_render_path(PROJECTS_DIR / project_id, source_index, page)
+    if not render_path.exists():
+        raise Http404("File not found")
+    with Image.open(render_path) as img:
+        width, height = img.size
+    return _immutable(HttpResponse(page_images.dzi_descriptor(width, height),
+                                   content_type='application/xml'))
+
+
+def serve_page_tile(request, project_id, source_index, page, level, col, row):
+    """Eine Kachel der Pyramide (siehe core/page_images.py); sie wird beim
+    ersten Zugriff erzeugt."""
+    denied = _access_denied(request)
+    if denied:
+        return denied
+    project = _get_project(request, project_id)
+    if project is None:
+        raise Http404
+    _restore_renders(project)
+    tile_path = page_images.ensure_tile(PROJECTS_DIR / project_id, source_index, page, level, col, row)
+    if tile_path is None:
+        raise Http404("Tile not found")
+    return _immutable(file_response(request, tile_path, content_type='image/jpeg'))
+
+
 def _convert_pdf_to_images(pdf_file, project_id=None, source_index=1):
     """Render a PDF into projects/<uuid>/uploads/.
 
-    `source_index` namespaces the output (document_<n>.pdf, page_<n>_<i>.jpg)
+    `source_index` namespaces the output (document_<n>.pdf, page_<n>_<i>.jpg,
+    thumb_<n>_<i>.webp for the page list)
     so multiple PDFs can coexist in the same session — see Seiten-Management
     "Anhängen" (CLAUDE.md). source_index=1 is the original upload.
     """
@@ -221,10 +285,78 @@ def _convert_pdf_to_images(pdf_file, project_id=None, source_index=1):
     output_dir.mkdir(parents=True, exist_ok=True)
 
     pdf_path = output_dir / f"document_{source_index}.pdf"
-    with open(pdf_path, 'wb') as f:
-        for chunk in pdf_file.chunks():
-            f.write(chunk)
+    _write_upload(pdf_file, pdf_path)
+
+    # Derselbe Plan schon einmal gerendert (andere Session, erneut geöffnete
+    # .planli)? Dann Hardlinks aus dem Render-Cache statt Poppler.
+    render_start = time.perf_counter()
+    page_count, page_sizes, cached = _render_cached(pdf_path, output_dir, project_id, source_index)
+    metrics.RENDER_SECONDS.observe(time.perf_counter() - render_start, cache='hit' if cached else 'miss')
+    metrics.UPLOAD_PAGES.observe(page_count)
 
+    pages = range(1, page_count + 1)
+    return {
+        "session_id": project_id,
+        "source_index": source_index,
+        "image_paths": [f"/project_files/{project_id}/uploads/page_{source_index}_{i}.jpg" for i in pages],
+        "thumbnail_paths": [f"/project_files/{project_id}/uploads/thumb_{source_index}_{i}.webp" for i in pages],
+        "tile_sources": [f"/project_tiles/{project_id}/page_{source_index}_{i}.dzi" for i in pages],
+        "local_image_paths": [str(output_dir / f"page_{source_index}_{i}.jpg") for i in pages],
+        "page_count": page_count,
+        "page_sizes": page_sizes,
+    }
+
+
+def _render_cached(pdf_path, output_dir, project_id, source_index):
+    """Seiten eines PDFs aus dem Render-Cache verlinken oder mit Poppler rendern
+    (und in den Cache legen). Gibt (page_count, page_sizes, Cache-Treffer) zurück."""
+    cache_entry = render_cache.entry_dir(render_cache.pdf_digest(pdf_path), PDF_DPI, JPEG_QUALITY)
+    cached = render_cache.lookup(cache_entry)
+    if cached:
+        try:
+            render_cache.link_into(cache_entry, cached, output_dir, source_index, pdf_path)
+            return cached['page_count'], cached['page_sizes'], True
+        except OSError:
+            # Eintrag parallel verdrängt (render_cache.evict) — wie ein Miss
+            logger.warning('Render-Cache-Eintrag %s verschwunden, rendere neu', cache_entry.name)
+    page_count, page_sizes = _render_pdf(pdf_path, output_dir, project_id, source_index)
+    render_cache.store(cache_entry, output_dir, source_index, pdf_path, page_count, page_sizes)
+    return page_count, page_sizes, False
+
+
+def _restore_renders(project):
+    """Vom Plattenbudget verdrängte Renders (core/disk_quota.py) aus den
+    document_<n>.pdf der Session wiederherstellen — vor jedem Zugriff auf
+    Seitenbilder. Parallele Requests rendern dank Sperre nur einmal."""
+    if not project.renders_evicted:
+        return
+    project_id = str(project.id)
+    output_dir = PROJECTS_DIR / project_id / 'uploads'
+    if not output_dir.exists():
+        return
+    with page_images._exclusive(output_dir / '.restore.lock'):
+        project.refresh_from_db(fields=['renders_evicted'])
+        if not project.renders_evicted:
+            return
+        for pdf_path in sorted(output_dir.glob('document_*.pdf')):
+            try:
+                source_index = int(pdf_path.stem[len('document_'):])
+            except ValueError:
+                continue
+            # Nach der Verdrängung angehängte PDFs haben ihre Renders noch —
+            # aber nur, wenn wirklich jede Seite da ist
+            page_count = len(PdfReader(str(pdf_path)).pages)
+            if not all(page_images.page_render_path(PROJECTS_DIR / project_id, source_index, i).exists()
+                       for i in range(1, page_count + 1)):
+                _render_cached(pdf_path, output_dir, project_id, source_index)
+        Project.objects.filter(pk=project.pk).update(renders_evicted=False)
+        project.renders_evicted = False
+    disk_quota.record_usage(PROJECTS_DIR / project_id, project_id)
+
+
+def _render_pdf(pdf_path, output_dir, project_id, source_index):
+    """Poppler-Render aller Seiten (JPEG + Vorschaubild). Gibt (page_count,
+    page_sizes in mm) zurück."""
     pdf_reader = PdfReader(str(pdf_path))
     page_sizes = []
     for page in pdf_reader.pages:
@@ -232,17 +364,13 @@ def _convert_pdf_to_images(pdf_file, project_id=None, source_index=1):
         page_sizes.append((float(media_box.width) * 0.352778, float(media_box.height) * 0.352778))
 
     images = None
-    image_paths = []
-    local_image_paths = []
-
     try:
         images = convert_from_path(str(pdf_path), dpi=PDF_DPI)
         page_count = len(images)
         for i, image in enumerate(images):
             image_path = output_dir / f"page_{source_index}_{i+1}.jpg"
             image.save(str(image_path), "JPEG", quality=JPEG_QUALITY, optimize=True)
-            local_image_paths.append(str(image_path))
-            image_paths.append(f"/project_files/{project_id}/uploads/page_{source_index}_{i+1}.jpg")
+            page_images.save_thumbnail(image, page_images.thumbnail_path(PROJECTS_DIR / project_id, source_index, i+1))
         del images
         gc.collect()
     except Exception as e:
@@ -250,25 +378,144 @@ def _convert_pdf_to_images(pdf_file, project_id=None, source_index=1):
             del images
         gc.collect()
         raise e
-
-    return {
-        "session_id": project_id,
-        "source_index": source_index,
-        "image_paths": image_paths,
-        "local_image_paths": local_image_paths,
-        "page_count": page_count,
-        "page_sizes": page_sizes,
-    }
+    return page_count, page_sizes
 
 
 MAX_UPLOAD_SIZE = 40 * 1024 * 1024  # 40 MB
 
 
-def _validate_pdf_upload(request):
-    """Shared checks for upload_file/upload_append. Returns (file, None) or (None, error_response)."""
-    if 'file' not in request.FILES:
+def _write_upload(upload, dest):
+    """Hochgeladene Datei nach `dest` schreiben. Fortsetzbare Uploads liegen
+    schon im Zielverzeichnis und werden nur umbenannt."""
+    if isinstance(upload, chunked_upload.ChunkedFile):
+        upload.move_to(dest)
+        return
+    with open(dest, 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+
+
+def _get_chunked_upload(request, upload_id):
+    """Laufenden Upload mit Ownership-Prüfung holen (wie _get_project)."""
+    try:
+        qs = ChunkedUpload.objects.filter(id=upload_id)
+        if not settings.BETA_MODE:
+            qs = qs.filter(user=request.user)
+        return qs.first()
+    except (ValueError, ValidationError):
+        return None
+
+
+def _finish_chunked_upload(request, purpose):
+    """upload_id + sha256 aus dem POST → (ChunkedFile, None) oder (None, error_response)."""
+    upload = _get_chunked_upload(request, request.POST.get('upload_id'))
+    if upload is None or upload.purpose != purpose:
+        return None, JsonResponse({'error': 'Upload nicht gefunden'}, status=404)
+    try:
+        return chunked_upload.finalize(upload, request.POST.get('sha256')), None
+    except ValueError as e:
+        return None, JsonResponse({'error': str(e)}, status=400)
+
+
+@require_POST
+def chunked_upload_init(request):
+    """Fortsetzbaren Upload anlegen (Protokoll: core/chunked_upload.py). Zugriff
+    und Grössen-Deckel werden hier schon geprüft, damit kein Client 200 MB
+    hochlädt, die der Ziel-Endpoint dann ablehnt."""
+    purpose = request.POST.get('purpose')
+    if purpose == 'cloud':
+        denied = _cloud_denied(request)
+        if not denied and _read_only(request):
+            denied = JsonResponse({'error': 'Deine Testphase bzw. Lizenz ist abgelaufen, '
+                                   'Online-Speichern ist nur mit aktiver Lizenz möglich.'}, status=403)
+    else:
+        denied = _access_denied(request)
+    if denied:
+        return denied
+
+    limits = {
+        'pdf': MAX_UPLOAD_SIZE,
+        'append': MAX_UPLOAD_SIZE,
+        'cloud': settings.MAX_PROJECT_MB * 1024 * 1024,
+        'bug': MAX_BUG_ZIP_SIZE,
+    }
+    if purpose not in limits:
+        return JsonResponse({'error': 'Unbekannter Upload-Zweck'}, status=400)
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': 'Dateigrösse fehlt'}, status=400)
+    if size <= 0:
+        return JsonResponse({'error': 'Leere Datei'}, status=400)
+    if size > limits[purpose]:
+        return JsonResponse({'error': f'Datei zu gross. Maximum: {limits[purpose] // (1024 * 1024)} MB.'}, status=413)
+
+    upload = ChunkedUpload(
+        user=request.user if request.user.is_authenticated else None,
+        purpose=purpose,
+        filename=(request.POST.get('filename') or '').strip()[:255],
+        size=size,
+    )
+    if purpose == 'pdf':
+        # Die Upload-ID wird zur Session-ID — das PDF landet gleich dort.
+        directory = PROJECTS_DIR / str(upload.id) / 'uploads'
+    elif purpose == 'append':
+        session_id = request.POST.get('session_id')
+        if _get_project(request, session_id) is None:
+            return JsonResponse({'error': 'Projekt nicht gefunden'}, status=404)
+        directory = PROJECTS_DIR / session_id / 'uploads'
+    elif purpose == 'cloud':
+        directory = settings.CLOUD_PROJECTS_DIR
+    else:
+        directory = settings.BUG_REPORTS_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    upload.directory = str(directory)
+    upload.save()
+    upload.part_path.touch()
+    return JsonResponse({'upload_id': str(upload.id), 'offset': 0,
+                         'chunk_size': chunked_upload.CHUNK_SIZE})
+
+
+@require_http_methods(['GET', 'HEAD', 'PUT'])
+def chunked_upload_chunk(request, upload_id):
+    """PUT: Stück ab Upload-Offset anhängen. GET/HEAD: aktuellen Stand abfragen
+    (zum Fortsetzen nach einem Abbruch)."""
+    upload = _get_chunked_upload(request, upload_id)
+    if upload is None:
+        return JsonResponse({'error': 'Upload nicht gefunden'}, status=404)
+    if request.method != 'PUT':
+        response = JsonResponse({'offset': upload.offset, 'size': upload.size})
+        response['Upload-Offset'] = str(upload.offset)
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.headers.get('Content-Length') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'Upload-Offset fehlt'}, status=400)
+    try:
+        offset = chunked_upload.append_chunk(upload, request, offset, length)
+    except chunked_upload.OffsetConflict as e:
+        return JsonResponse({'error': str(e), 'offset': e.offset}, status=409)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=413)
+    response = JsonResponse({'offset': offset, 'size': upload.size})
+    response['Upload-Offset'] = str(offset)
+    return response
+
+
+def _validate_pdf_upload(request, purpose):
+    """Shared checks for upload_file/upload_append. Returns (file, None) or (None, error_response).
+    Accepts either a multipart `file` or a finished chunked upload (`upload_id` + `sha256`)."""
+    if request.POST.get('upload_id'):
+        file, error = _finish_chunked_upload(request, purpose)
+        if error:
+            return None, error
+    elif 'file' not in request.FILES:
         return None, JsonResponse({'error': 'No file part'}, status=400)
-    file = request.FILES['file']
+    else:
+        file = request.FILES['file']
     if not file.name:
         return None, JsonResponse({'error': 'No selected file'}, status=400)
     if not file.name.lower().endswith('.pdf'):
@@ -282,28 +529,38 @@ def _validate_pdf_upload(request):
 
 
 @require_POST
+@profiling.profiled
 def upload_file(request):
     denied = _access_denied(request)
     if denied:
         return denied
+    upload_start = time.perf_counter()
     try:
-        file, error = _validate_pdf_upload(request)
+        file, error = _validate_pdf_upload(request, 'pdf')
         if error:
             return error
 
         try:
-            pdf_info = _convert_pdf_to_images(file)
+            # Fortsetzbarer Upload: liegt schon in projects/<upload_id>/ — die
+            # Upload-ID wird zur Session-ID.
+            chunked = isinstance(file, chunked_upload.ChunkedFile)
+            pdf_info = _convert_pdf_to_images(file, project_id=str(file.upload.id) if chunked else None)
             Project.objects.create(
                 id=pdf_info["session_id"],
                 user=request.user if request.user.is_authenticated else None,
                 original_filename=file.name,
             )
+            disk_quota.record_usage(PROJECTS_DIR / pdf_info["session_id"], pdf_info["session_id"])
+            disk_quota.schedule()
+            metrics.UPLOAD_SECONDS.observe(time.perf_counter() - upload_start, kind='upload')
             return JsonResponse({
                 'is_pdf': True,
                 'session_id': pdf_info["session_id"],
                 'source_index': pdf_info["source_index"],
                 'page_count': int(pdf_info["page_count"]),
                 'all_pages': pdf_info["image_paths"],
+                'all_thumbnails': pdf_info["thumbnail_paths"],
+                'all_tile_sources': pdf_info["tile_sources"],
                 'page_sizes': pdf_info["page_sizes"],
                 'filename': file.name,
             })
@@ -317,6 +574,7 @@ def upload_file(request):
 
 
 @require_POST
+@profiling.profiled
 def upload_append(request):
     """Render an additional PDF into an EXISTING session (Seiten-Management
     "Anhängen") — same session_id, next free source_index. The frontend keeps
@@ -325,12 +583,13 @@ def upload_append(request):
     denied = _access_denied(request)
     if denied:
         return denied
+    upload_start = time.perf_counter()
     try:
         session_id = request.POST.get('session_id')
         if _get_project(request, session_id) is None:
             return JsonResponse({'error': 'Projekt nicht gefunden'}, status=404)
 
-        file, error = _validate_pdf_upload(request)
+        file, error = _validate_pdf_upload(request, 'append')
         if error:
             return error
 
@@ -346,10 +605,15 @@ def upload_append(request):
 
         try:
             pdf_info = _convert_pdf_to_images(file, project_id=session_id, source_index=next_index)
+            disk_quota.record_usage(PROJECTS_DIR / session_id, session_id)
+            disk_quota.schedule()
+            metrics.UPLOAD_SECONDS.observe(time.perf_counter() - upload_start, kind='append')
             return JsonResponse({
                 'source_index': pdf_info["source_index"],
                 'page_count': int(pdf_info["page_count"]),
                 'all_pages': pdf_info["image_paths"],
+                'all_thumbnails': pdf_info["thumbnail_paths"],
+                'all_tile_sources': pdf_info["tile_sources"],
                 'page_sizes': pdf_info["page_sizes"],
             })
         except Exception as e:
@@ -362,6 +626,7 @@ def upload_append(request):
 
 
 @require_POST
+@profiling.profiled(torch=True)
 def analyze_page(request):
     denied = _access_denied(request)
     if denied:
@@ -376,8 +641,10 @@ def analyze_page(request):
     try:
         session_id = request.POST.get('session_id')
 
-        if _get_project(request, session_id) is None:
+        project = _get_project(request, session_id)
+        if project is None:
             return JsonResponse({'error': 'Projekt nicht gefunden'}, status=404)
+        _restore_renders(project)
 
         page = int(request.POST.get('page', 1))
         # Which uploaded PDF this page belongs to (Seiten-Management "Anhängen") —
@@ -422,14 +689,22 @@ def analyze_page(request):
             image_bytes = f.read()
 
         inference_start = time.time()
-        boxes, labels, scores, areas = predict_image(
-            image_bytes,
-            format_size=format_size,
-            dpi=dpi,
-            plan_scale=plan_scale,
-            threshold=threshold,
-        )
+        timings = StageTimings()
+        with metrics.ANALYSES_IN_PROGRESS.track_inprogress():
+            boxes, labels, scores, areas = predict_image(
+                image_bytes,
+                format_size=format_size,
+                dpi=dpi,
+                plan_scale=plan_scale,
+                threshold=threshold,
+                timings=timings,
+            )
         performance_metrics['model_inference_time'] = time.time() - inference_start
+        # Aufschlüsselung pro Schritt — auch im Log und pro AnalysisEvent
+        # gespeichert (Auswertung auf /statistik)
+        performance_metrics['stages'] = timings.stages
+        logger.info('analyze_page %s Seite %s (%sx%s px): %s', session_id, page,
+                    timings.info.get('width'), timings.info.get('height'), timings.summary())
 
         results = [
             {
@@ -448,20 +723,26 @@ def analyze_page(request):
 
         performance_metrics['total_request_time'] = time.time() - request_start
         cleanup_memory()
-
-        # Beta-Tracking (nicht-fatal): eine durchgeführte Analyse protokollieren
+        for stage, values in timings.stages.items():
+            metrics.ANALYSIS_STAGE_SECONDS.observe(values['ms'] / 1000, stage=stage)
+        metrics.ANALYSIS_SECONDS.observe(performance_metrics['total_request_time'])
+
+        # Beta-Tracking (nicht-fatal): eine durchgeführte Analyse protokollieren,
+        # gepuffert (core/tracking.py) — kein DB-Write im Request, auch keine
+        # neue Session: anonyme Besucher bekommen ein Cookie.
+        visitor, new_visitor = None, False
         try:
-            if not request.session.session_key:
-                request.session.save()
-            AnalysisEvent.objects.create(
-                session_key=request.session.session_key or '',
-                user=request.user if request.user.is_authenticated else None,
-                page_number=page,
+            visitor, new_visitor = tracking.visitor_key(request)
+            tracking.analysis_events.record(
+                visitor,
+                request.user.pk if request.user.is_authenticated else None,
+                page,
+                timings={**timings.as_dict(), 'project': session_id},
             )
         except Exception:
-            logger.exception('AnalysisEvent konnte nicht gespeichert werden')
+            logger.exception('AnalysisEvent konnte nicht vorgemerkt werden')
 
-        return JsonResponse({
+        response = JsonResponse({
             'predictions': results,
             'total_area': round(float(sum(areas)), 2),
             'count': len(results),
@@ -474,6 +755,9 @@ def analyze_page(request):
             'actual_dpi': dpi,
             'performance_metrics': performance_metrics,
         })
+        if new_visitor:
+            tracking.remember_visitor(response, visitor)
+        return response
 
     except Exception as e:
         import traceback
@@ -518,19 +802,17 @@ def report_bug(request):
         report_dir = settings.BUG_REPORTS_DIR / str(report.pk)
 
         zip_file = request.FILES.get('project_zip')
+        if request.POST.get('upload_id'):
+            zip_file, _error = _finish_chunked_upload(request, 'bug')  # Anhang optional: ohne ZIP weiter
         if zip_file and zip_file.size <= MAX_BUG_ZIP_SIZE:
             report_dir.mkdir(parents=True, exist_ok=True)
-            with open(report_dir / 'project.zip', 'wb') as f:
-                for chunk in zip_file.chunks():
-                    f.write(chunk)
+            _write_upload(zip_file, report_dir / 'project.zip')
             report.project_zip = f'{report.pk}/project.zip'
 
         screenshot = request.FILES.get('screenshot')
         if screenshot and screenshot.size <= MAX_BUG_SCREENSHOT_SIZE:
             report_dir.mkdir(parents=True, exist_ok=True)
-            with open(report_dir / 'screenshot.jpg', 'wb') as f:
-                for chunk in screenshot.chunks():
-                    f.write(chunk)
+            _write_upload(screenshot, report_dir / 'screenshot.jpg')
             report.screenshot = f'{report.pk}/screenshot.jpg'
 
         report.save()
@@ -656,12 +938,19 @@ def cloud_list(request):
     denied = _cloud_denied(request)
     if denied:
         return denied
+    # Index-Felder stehen in der Zeile selbst (cloud_save) — eine Query,
+    # keine Archive öffnen. Ohne manifest (Altbestand) fehlt der Index.
     projects = [{
         'id': str(p.id),
         'name': p.name,
         'size_bytes': p.size_bytes,
         'updated_at': timezone.localtime(p.updated_at).strftime('%d.%m.%Y %H:%M'),
-    } for p in request.user.stored_projects.all()]
+        'page_count': p.page_count,
+        'format_version': p.format_version,
+        'labels': p.labels_summary,
+        'thumbnail_url': (reverse('cloud_thumbnail', args=[p.id]) + f'?v={p.thumbnail_sha[:12]}'
+                          if p.thumbnail_sha else None),
+    } for p in request.user.stored_projects.defer('manifest')]
     return JsonResponse({
         'projects': projects,
         'limit': subscription_for(request.user).max_projects,
@@ -679,12 +968,22 @@ def cloud_save(request):
         return JsonResponse({'error': 'Deine Testphase bzw. Lizenz ist abgelaufen, '
                              'Online-Speichern ist nur mit aktiver Lizenz möglich.'}, status=403)
 
+    # Voll-Upload: project_zip ist das ganze .planli. Delta-Upload: `manifest`
+    # beschreibt das ganze Projekt, project_zip (optional) enthält nur die
+    # Mitglieder, die der Server noch nicht hat (core/cloud_store.py).
     upload = request.FILES.get('project_zip')
-    if not upload:
+    if request.POST.get('upload_id'):
+        upload, error = _finish_chunked_upload(request, 'cloud')
+        if error:
+            return error
+    manifest_raw = request.POST.get('manifest')
+    if not upload and not manifest_raw:
         return JsonResponse({'error': 'Keine Projektdatei erhalten'}, status=400)
-    if upload.size > settings.MAX_PROJECT_MB * 1024 * 1024:
-        return JsonResponse({'error': f'Projekt zu gross (max. {settings.MAX_PROJECT_MB} MB). '
-                             'Tipp: sehr grosse Original-PDFs vor dem Hochladen verkleinern.'}, status=413)
+    too_large = JsonResponse({'error': f'Projekt zu gross (max. {settings.MAX_PROJECT_MB} MB). '
+                              'Tipp: sehr grosse Original-PDFs vor dem Hochladen verkleinern.'}, status=413)
+    if upload and upload.size > settings.MAX_PROJECT_MB * 1024 * 1024:
+        _discard_upload(upload)
+        return too_large
 
     name = (request.POST.get('name') or '').strip()[:200]
     project_id = request.POST.get('project_id')
@@ -692,37 +991,115 @@ def cloud_save(request):
     if project_id:
         project = _get_stored_project(request, project_id)
         if project is None:
+            _discard_upload(upload)
             return JsonResponse({'error': 'Projekt nicht gefunden'}, status=404)
         if name:
             project.name = name
     else:
         limit = subscription_for(request.user).max_projects
         if request.user.stored_projects.count() >= limit:
+            _discard_upload(upload)
             return JsonResponse({'error': f'Projektlimit erreicht ({limit} Projekte). '
                                  'Lösche nicht mehr benötigte Projekte (vorher ggf. herunterladen) '
                                  'oder kontaktiere uns für ein höheres Limit.'}, status=403)
         project = StoredProject(user=request.user, name=name or 'Unbenanntes Projekt')
 
-    settings.CLOUD_PROJECTS_DIR.mkdir(parents=True, exist_ok=True)
-    with open(project.file_path, 'wb') as f:
-        for chunk in upload.chunks():
-            f.write(chunk)
-    project.size_bytes = upload.size
+    try:
+        members = cloud_store.unpack(upload, settings.MAX_PROJECT_MB * 1024 * 1024) if upload else {}
+    except zipfile.BadZipFile:
+        return JsonResponse({'error': 'Ungültige Projektdatei.'}, status=400)
+    except cloud_store.TooLarge:
+        return too_large
+    finally:
+        _discard_upload(upload)
+
+    if manifest_raw:
+        try:
+            manifest = cloud_store.parse_manifest(manifest_raw)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        if any(e['name'] in members and members[e['name']]['sha256'] != e['sha256'] for e in manifest):
+            return JsonResponse({'error': 'Prüfsumme stimmt nicht — bitte erneut speichern.'}, status=400)
+        own = cloud_store.user_blobs(request.user)
+        reused = [e for e in manifest if e['name'] not in members]
+        missing = [e['name'] for e in reused if e['sha256'] not in own]
+        missing += cloud_store.touch([e for e in reused if e['sha256'] in own])
+        if missing:
+            return JsonResponse({'error': 'Projektteile fehlen', 'missing': missing}, status=409)
+        # Grösse und CRC nie vom Client übernehmen: frisch entpackt bzw. aus
+        # den eigenen Blobs (gerade per touch() auf Existenz geprüft)
+        for entry in manifest:
+            if entry['name'] in members:
+                entry['size'], entry['crc32'] = members[entry['name']]['size'], members[entry['name']]['crc32']
+            else:
+                entry['size'], entry['crc32'] = cloud_store.blob_size(entry['sha256']), own[entry['sha256']]
+    else:
+        manifest = list(members.values())
+
+    size = sum(e['size'] for e in manifest)
+    if size > settings.MAX_PROJECT_MB * 1024 * 1024:
+        return too_large
+    try:
+        index = cloud_store.build_index(manifest)
+    except ValueError as e:
+        return JsonResponse({'error': f'Ungültige Projektdatei: {e}'}, status=400)
+    project.manifest = manifest
+    project.size_bytes = size
+    for field, value in index.items():
+        setattr(project, field, value)
     project.save()
+    project.file_path.unlink(missing_ok=True)  # Altbestand: ganzes ZIP ist jetzt abgelöst
     return JsonResponse({'id': str(project.id), 'name': project.name})
 
 
+def _discard_upload(upload):
+    """Fortsetzbaren Upload verwerfen, nachdem sein Inhalt übernommen (oder
+    abgelehnt) wurde — Multipart-Uploads räumt Django selbst weg."""
+    if isinstance(upload, chunked_upload.ChunkedFile):
+        upload.close()
+        chunked_upload.discard(upload.upload)
+
+
 def cloud_download(request, project_id):
     denied = _cloud_denied(request)
     if denied:
         return denied
     project = _get_stored_project(request, project_id)
-    if project is None or not project.file_path.exists():
+    if project is None or (project.manifest is None and not project.file_path.exists()):
         raise Http404
     project.last_opened_at = timezone.now()
     project.save(update_fields=['last_opened_at'])
-    return FileResponse(open(project.file_path, 'rb'), as_attachment=True,
-                        filename=f'{project.name}.planli')
+    filename = f'{project.name}.planli'
+    if project.manifest is None:
+        response = file_response(request, project.file_path, as_attachment=True, filename=filename)
+    else:
+        # Aus den Blobs zusammengesetzt, Grösse vorab bekannt → Content-Length
+        # und Range-Requests (fortsetzbarer Download) wie bei einer Datei.
+        if cloud_store.ensure_crc(project.manifest):
+            project.save(update_fields=['manifest'])
+        size, read = cloud_store.zip_layout(project.manifest)
+        response = ranged_response(request, size, read, 'application/zip',
+                                   cloud_store.manifest_etag(project.manifest),
+                                   int(project.updated_at.timestamp()), as_attachment=True, filename=filename)
+    # Überschreibbar (cloud_save mit project_id): immer revalidieren — ein
+    # unverändertes Projekt kostet dann nur ein 304 statt des ganzen ZIPs.
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def cloud_thumbnail(request, project_id):
+    """Vorschaubild der ersten Seite für die Projektliste. Die URL trägt den
+    Hash des Seitenbilds (?v=…), ändert sich also mit dem Inhalt."""
+    denied = _cloud_denied(request)
+    if denied:
+        return denied
+    project = _get_stored_project(request, project_id)
+    if project is None or not project.thumbnail_sha:
+        raise Http404
+    path = cloud_store.thumbnail_path(project.thumbnail_sha)
+    if not path.exists():
+        raise Http404
+    return _immutable(file_response(request, path, content_type='image/webp'))
 
 
 @require_POST
@@ -751,5 +1128,6 @@ def cloud_delete(request, project_id):
     if project is None:
         return JsonResponse({'error': 'Projekt nicht gefunden'}, status=404)
     project.file_path.unlink(missing_ok=True)
+    # Blobs räumt gc_cloud_blobs nach der Schonfrist weg (core/cloud_store.py)
     project.delete()
     return JsonResponse({'status': 'ok'})
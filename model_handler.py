@@ -3,8 +3,12 @@ import torch
 from torchvision import models, transforms
 from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
 from PIL import Image
+import inspect
 import io
 import os
+import sys
+import time
+from contextlib import contextmanager
 import cv2
 import numpy as np
 from utils import calculate_scale_factor, apply_nms, refine_boxes_to_lines
@@ -23,6 +27,19 @@ device = None
 # Schalter zum Vergleichen: True = Snap-to-Line-Nachbearbeitung aktiv,
 # False = altes Verhalten (rohe Netz-Boxen ohne Einrasten auf die Planlinien).
 AFTERPROCESS = True
+# Parameter des Snap-to-Line (utils.refine_boxes_to_lines), Begründung siehe
+# predict_image. Hier statt inline, damit `manage.py evaluate_model` Varianten
+# gegen den gelabelten Datensatz prüfen kann, bevor sie Default werden.
+SNAP_OPTIONS = {'search': 16, 'min_darkness': 'auto', 'select': 'nearest'}
+
+
+def resolved_snap_options():
+    """SNAP_OPTIONS samt den Defaults von refine_boxes_to_lines (z.B.
+    ink_mode) — was der Snap tatsächlich benutzt, für Mess-Protokolle."""
+    defaults = {name: param.default
+                for name, param in inspect.signature(refine_boxes_to_lines).parameters.items()
+                if param.default is not inspect.Parameter.empty}
+    return {**defaults, **SNAP_OPTIONS}
 
 def get_model(num_classes=6):
     """
@@ -120,7 +137,58 @@ def resize_image_if_large(image, max_size=2048):
     
     return image, 1.0
 
-def predict_image(image_bytes, format_size=(210, 297), dpi=300, plan_scale=100, threshold=0.5):
+def _peak_rss_mb():
+    """Bisheriger Spitzenwert des Arbeitsspeichers (RSS) dieses Prozesses in MB,
+    None wo `resource` fehlt (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KiB, macOS: Bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageTimings:
+    """
+    Laufzeit und RSS-Spitzenzuwachs pro Verarbeitungsschritt von predict_image.
+
+    rss_mb ist, um wie viel der Spitzenwert des Prozesses während des Schritts
+    gestiegen ist — 0, solange ein Schritt unter dem bisherigen Höchststand
+    bleibt. So sieht man, welcher Schritt bei grossen Plänen den Speicher
+    hochtreibt. `info` nimmt Eckdaten des Bildes auf (Grösse, Treffer).
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.info = {}
+
+    @contextmanager
+    def stage(self, name):
+        rss_before = _peak_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            rss_after = _peak_rss_mb()
+            self.stages[name] = {
+                'ms': round((time.perf_counter() - start) * 1000, 1),
+                'rss_mb': round(rss_after - rss_before, 1) if rss_before is not None else None,
+            }
+
+    def as_dict(self):
+        return {'stages': self.stages, **self.info}
+
+    def summary(self):
+        """Einzeilig fürs Log: "preprocess=120ms inference=850ms(+310MB) ..." """
+        parts = []
+        for name, stage in self.stages.items():
+            rss = f"(+{stage['rss_mb']:g}MB)" if stage['rss_mb'] else ''
+            parts.append(f"{name}={stage['ms']:g}ms{rss}")
+        return ' '.join(parts)
+
+
+def predict_image(image_bytes, format_size=(210, 297), dpi=300, plan_scale=100, threshold=0.5, timings=None):
     """
     Führt memory-effiziente Objekterkennung auf einem Bild durch.
     
@@ -130,19 +198,23 @@ def predict_image(image_bytes, format_size=(210, 297), dpi=300, plan_scale=100,
         dpi: Auflösung in Dots Per Inch
         plan_scale: Massstab des Plans (z.B. 100 für 1:100)
         threshold: Schwellenwert für die Erkennungssicherheit
+        timings: optional StageTimings — wird pro Verarbeitungsschritt gefüllt
         
     Returns:
         boxes, labels, scores, areas: Arrays mit Erkennungsergebnissen
     """
+    timings = timings if timings is not None else StageTimings()
     try:
         global device
         
         # Modell laden (nur einmal)
-        model = load_model()
+        with timings.stage('load_model'):
+            model = load_model()
         
         # Vorverarbeitung mit OpenCV (NUR für die KI – das Modell ist auf genau
         # diese Vorverarbeitung trainiert, siehe image_preprocessing.preprocess_image)
-        processed_image = preprocess_image(image_bytes)
+        with timings.stage('preprocess'):
+            processed_image = preprocess_image(image_bytes)
 
         # Sauberes Vollauflösungs-Farbbild NUR für den Snap-to-Line: das Original
         # ohne CLAHE/GaussianBlur (die verfälschen die Tinten-/Schwellenwerte, auf
@@ -150,42 +222,50 @@ def predict_image(image_bytes, format_size=(210, 297), dpi=300, plan_scale=100,
         # ink_mode bunte Hilfslinien wie gelbe Abbruchlinien aussortieren kann).
         # So snappt die Produktion auf demselben Bild wie `manage.py debug_snap`.
         # (vor dem Verkleinern – die Boxen werden in diese Auflösung zurückskaliert.)
-        _snap_bgr = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
-        full_res_rgb = cv2.cvtColor(_snap_bgr, cv2.COLOR_BGR2RGB)
+        with timings.stage('decode_snap'):
+            _snap_bgr = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+            full_res_rgb = cv2.cvtColor(_snap_bgr, cv2.COLOR_BGR2RGB)
+        timings.info['width'], timings.info['height'] = full_res_rgb.shape[1], full_res_rgb.shape[0]
 
         # Bild verkleinern falls zu gross (höhere Inferenz-Auflösung = präzisere Boxen)
-        processed_image, coord_scale = resize_image_if_large(processed_image, max_size=2048)
+        with timings.stage('resize'):
+            processed_image, coord_scale = resize_image_if_large(processed_image, max_size=2048)
         
         # Bild transformieren und direkt auf GPU verschieben
-        transform = transforms.Compose([transforms.ToTensor()])
-        image_tensor = transform(processed_image).unsqueeze(0).to(device)
+        with timings.stage('to_tensor'):
+            transform = transforms.Compose([transforms.ToTensor()])
+            image_tensor = transform(processed_image).unsqueeze(0).to(device)
         
         # Berechne den Umrechnungsfaktor
         pixels_per_meter = calculate_scale_factor(format_size, dpi, plan_scale)
         
         # GPU-optimierte Inferenz mit Memory-Management
-        with torch.no_grad():
-            prediction = model(image_tensor)
+        with timings.stage('inference'):
+            with torch.no_grad():
+                prediction = model(image_tensor)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()  # sonst landet die GPU-Zeit im nächsten Schritt
         
         # Sofortiges Memory-Cleanup für GPU-Effizienz
         del image_tensor
         if torch.cuda.is_available():
             torch.cuda.empty_cache()  # GPU-Cache sofort leeren
         
-        # Ergebnisse extrahieren
-        boxes = prediction[0]['boxes'].cpu().numpy()
-        labels = prediction[0]['labels'].cpu().numpy()
-        scores = prediction[0]['scores'].cpu().numpy()
-        
-        # Koordinaten zurück skalieren falls Bild verkleinert wurde
-        if coord_scale != 1.0:
-            boxes = boxes * coord_scale
-        
-        # Schwellenwert anwenden
-        valid_detections = scores >= threshold
-        boxes = boxes[valid_detections]
-        labels = labels[valid_detections]
-        scores = scores[valid_detections]
+        with timings.stage('extract'):
+            # Ergebnisse extrahieren
+            boxes = prediction[0]['boxes'].cpu().numpy()
+            labels = prediction[0]['labels'].cpu().numpy()
+            scores = prediction[0]['scores'].cpu().numpy()
+
+            # Koordinaten zurück skalieren falls Bild verkleinert wurde
+            if coord_scale != 1.0:
+                boxes = boxes * coord_scale
+
+            # Schwellenwert anwenden
+            valid_detections = scores >= threshold
+            boxes = boxes[valid_detections]
+            labels = labels[valid_detections]
+            scores = scores[valid_detections]
 
         # Snap-to-Line: Box-Kanten auf die echten Planlinien einrasten
         # (per AFTERPROCESS-Schalter abschaltbar, um mit dem alten Verhalten zu vergleichen)
@@ -199,36 +279,41 @@ def predict_image(image_bytes, format_size=(210, 297), dpi=300, plan_scale=100,
             # abgeleitet (siehe utils._auto_darkness) – ein fester Wert tötet auf
             # manchen Plänen die blassen Rahmenlinien (Snap greift dann ins Leere
             # oder springt auf Schatten). Diagnose/Vergleich: `manage.py debug_snap`.
-            boxes = refine_boxes_to_lines(boxes, full_res_rgb, search=16, min_darkness='auto', select='nearest')
+            with timings.stage('snap'):
+                boxes = refine_boxes_to_lines(boxes, full_res_rgb, **SNAP_OPTIONS)
 
         # Flächen berechnen
-        areas = []
-        for box in boxes:
-            x1, y1, x2, y2 = box
-            width_pixels = x2 - x1
-            height_pixels = y2 - y1
-            
-            # Umrechnung in Meter
-            width_meters = width_pixels / pixels_per_meter
-            height_meters = height_pixels / pixels_per_meter
-            
-            # Fläche in m²
-            area = width_meters * height_meters
-            areas.append(area)
+        with timings.stage('areas'):
+            areas = []
+            for box in boxes:
+                x1, y1, x2, y2 = box
+                width_pixels = x2 - x1
+                height_pixels = y2 - y1
+
+                # Umrechnung in Meter
+                width_meters = width_pixels / pixels_per_meter
+                height_meters = height_pixels / pixels_per_meter
+
+                # Fläche in m²
+                area = width_meters * height_meters
+                areas.append(area)
         
         # Non-Maximum Suppression anwenden
-        boxes, labels, scores, areas = apply_nms(
-            boxes, 
-            labels, 
-            scores, 
-            areas, 
-            iou_threshold=0.5,
-            overlap_ratio_threshold=0.7,
-            tolerance=5
-        )
+        with timings.stage('nms'):
+            boxes, labels, scores, areas = apply_nms(
+                boxes,
+                labels,
+                scores,
+                areas,
+                iou_threshold=0.5,
+                overlap_ratio_threshold=0.7,
+                tolerance=5
+            )
+        timings.info['detections'] = len(boxes)
         
         # Final cleanup
-        cleanup_memory()
+        with timings.stage('cleanup'):
+            cleanup_memory()
         
         return boxes, labels, scores, areas
     
@@ -1,6 +1,6 @@
 #!/usr/bin/env bash
 #
-# Beta-Backup für Planvision: sichert db.sqlite3 (konsistent), bug_reports/,
+# Beta-Backup für Planvision: sichert die Datenbank (db.sqlite3 bzw. pg_dump), bug_reports/
 # training_data_opt-in/ und cloud_projects/ (Online-Ablage: Hardlink-Snapshots,
 # KEEP_DAYS zurück). Danach Offsite-Sync nach pCloud via rclone (verschlüsseltes
 # Remote RCLONE_REMOTE).
@@ -30,9 +30,16 @@ STAMP="$(date +%F_%H%M%S)"
 
 mkdir -p "$BACKUP_DIR/db" "$BACKUP_DIR/bug_reports"
 
-# 1) SQLite konsistent sichern (Online-Backup-API, kein halb-geschriebener Stand).
-#    Kopiert die DB auch dann sauber, wenn gerade geschrieben wird.
-if [ -f "$DB_FILE" ]; then
+# 1) DB konsistent sichern. PostgreSQL (DJANGO_DB_ENGINE=postgresql, siehe
+#    config/settings.py): pg_dump im Custom-Format, Zugang über ~/.pgpass.
+#    SQLite: Online-Backup-API, kein halb-geschriebener Stand — kopiert die DB
+#    auch dann sauber, wenn gerade geschrieben wird.
+if [ "${DJANGO_DB_ENGINE:-sqlite}" = "postgresql" ]; then
+  DB_DEST="$BACKUP_DIR/db/db-$STAMP.pgdump"
+  pg_dump -Fc -h "${DJANGO_DB_HOST:-localhost}" -U "${DJANGO_DB_USER:-planvision}" \
+    -f "$DB_DEST" "${DJANGO_DB_NAME:-planvision}"
+  echo "$(date '+%F %T')  DB gesichert -> $DB_DEST"
+elif [ -f "$DB_FILE" ]; then
   DB_DEST="$BACKUP_DIR/db/db-$STAMP.sqlite3"
   "$PYTHON" - "$DB_FILE" "$DB_DEST" <<'PY'
 import sqlite3, sys
@@ -83,7 +90,7 @@ fi
 #    werden bewusst nicht rotiert).
 #    cloud_projects-Snapshots nach Name (=Datum) rotieren, nicht nach mtime —
 #    rsync -a überträgt die Quell-Zeitstempel auf die Snapshot-Verzeichnisse.
-find "$BACKUP_DIR/db" -name 'db-*.sqlite3' -type f -mtime +"$KEEP_DAYS" -delete
+find "$BACKUP_DIR/db" \( -name 'db-*.sqlite3' -o -name 'db-*.pgdump' \) -type f -mtime +"$KEEP_DAYS" -delete
 ls -1d "$BACKUP_DIR/cloud_projects"/????-??-??_* 2>/dev/null | head -n -"$KEEP_DAYS" | xargs -r rm -rf
 echo "$(date '+%F %T')  Rotation: Stände älter als $KEEP_DAYS Tage/Läufe entfernt"
 
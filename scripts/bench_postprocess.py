@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Benchmark der Nachbearbeitung (utils.py): Kanten-Snap, Linien-/Kantensuche
+und NMS — ohne Modell, ohne Django, nur numpy.
+
+Damit lässt sich eine Änderung am Snap-Code messen statt raten: die Suite
+erzeugt synthetische Pläne (weisser Grund, schwarze Wände, Fenster als
+Doppellinie Rahmen/Glas, rote Fensterlinien, bunte Bemassung) in mehreren
+Grössen und mit unterschiedlich vielen Boxen, misst
+
+  refine_boxes_to_lines   jede select-Strategie (ink 'black') und jeder
+                          ink_mode (select 'second_inner'), dazu min_darkness='auto'
+                          — mit --full das volle Kreuzprodukt
+  _find_lines / _threshold_crossings
+                          je ein Stapel echter Suchband-Profile aus dem Plan
+  apply_nms / calculate_overlap
+                          Detektionen mit Doppeltreffern je Fenster
+
+und vergleicht optional mit einer gespeicherten Baseline. Neben der Zeit
+wird pro Benchmark ein Digest des Ergebnisses festgehalten: ändert sich der,
+hat die "Optimierung" das Verhalten verändert.
+
+Aufruf (aus dem Repo-Verzeichnis):
+  python scripts/bench_postprocess.py                         # Tabelle
+  python scripts/bench_postprocess.py --save-baseline bench_baseline.json
+  python scripts/bench_postprocess.py --baseline bench_baseline.json   # Exit 1 bei Regression
+  python scripts/bench_postprocess.py --json bench.json --filter nms --repeat 9
+
+Baselines sind maschinenabhängig — nur auf demselben Rechner vergleichen
+(vorher/nachher), nicht zwischen Dev-PC und Server.
+"""
+
+import argparse
+import hashlib
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from statistics import median
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import utils  # noqa: E402
+
+SELECTS = ['second_inner', 'nearest', 'edge', 'outer_near', 'innermost', 'outermost']
+INK_MODES = ['black', 'black_red', 'red', 'min']
+# (Name, Breite, Höhe): A4 und A3 @150 dpi, A1 @100 dpi
+SIZES = [('a4', 1754, 1240), ('a3', 2480, 1754), ('a1', 3311, 2339)]
+BOX_COUNTS = [20, 100, 400]
+SEARCH = 16
+
+
+def make_plan(width, height, n_windows, seed=0):
+    """Synthetischer Plan: Bild (H,W,3 uint8) plus die echten Fensterrechtecke."""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    # Wandraster (dicke schwarze Linien) und Bemassung (gelb/cyan, dünn)
+    for y in range(80, height, 300):
+        img[y:y + 6, :] = 20
+    for x in range(80, width, 400):
+        img[:, x:x + 6] = 20
+    for y in range(140, height, 300):
+        img[y, :] = (230, 200, 30)
+    for x in range(160, width, 400):
+        img[:, x] = (40, 200, 220)
+
+    windows = []
+    for _ in range(n_windows):
+        w, h = int(rng.integers(40, 140)), int(rng.integers(30, 110))
+        x1, y1 = int(rng.integers(10, width - w - 10)), int(rng.integers(10, height - h - 10))
+        x2, y2 = x1 + w, y1 + h
+        frame = (200, 20, 20) if rng.random() < 0.25 else (15, 15, 15)
+        # Rahmen (2 px) und Glaslinie (1 px, 5 px weiter innen)
+        img[y1:y1 + 2, x1:x2] = frame
+        img[y2 - 2:y2, x1:x2] = frame
+        img[y1:y2, x1:x1 + 2] = frame
+        img[y1:y2, x2 - 2:x2] = frame
+        img[y1 + 5, x1 + 5:x2 - 5] = 90
+        img[y2 - 6, x1 + 5:x2 - 5] = 90
+        img[y1 + 5:y2 - 5, x1 + 5] = 90
+        img[y1 + 5:y2 - 5, x2 - 6] = 90
+        windows.append((x1, y1, x2, y2))
+
+    noise = rng.integers(0, 12, size=img.shape[:2], dtype=np.uint8)
+    img = np.clip(img.astype(np.int16) - noise[..., None], 0, 255).astype(np.uint8)
+    return img, np.array(windows, dtype=np.float32)
+
+
+def make_detections(windows, seed=0):
+    """Detektionen wie vom Modell: je Fenster 1–3 verrauschte Treffer."""
+    rng = np.random.default_rng(seed + 1)
+    boxes, labels, scores = [], [], []
+    for win in windows:
+        label = int(rng.integers(1, 5))
+        for _ in range(int(rng.integers(1, 4))):
+            boxes.append(win + rng.normal(0, 5, size=4).astype(np.float32))
+            labels.append(label)
+            scores.append(float(rng.uniform(0.5, 1.0)))
+    boxes = np.array(boxes, dtype=np.float32)
+    areas = [float((b[2] - b[0]) * (b[3] - b[1])) for b in boxes]
+    return boxes, labels, np.array(scores), areas
+
+
+def band_profiles(img, boxes):
+    """Die Suchband-Profile, die refine_boxes_to_lines für die oberen und
+    linken Kanten bildet (ink 'black')."""
+    ink = utils._ink_from_image(img, 'black')
+    h, w = ink.shape
+    profiles = []
+    for x1, y1, x2, y2 in boxes.astype(int):
+        x1, y1 = max(0, x1), max(0, y1)
+        profiles.append(np.median(ink[max(0, y1 - SEARCH):min(h, y1 + SEARCH + 1), x1:x2], axis=1))
+        profiles.append(np.median(ink[y1:y2, max(0, x1 - SEARCH):min(w, x1 + SEARCH + 1)], axis=0))
+    return [p for p in profiles if len(p)]
+
+
+def digest(value):
+    """Kurzer Hash des Ergebnisses — erkennt Verhaltensänderungen."""
+    h = hashlib.sha256()
+
+    def feed(v):
+        if isinstance(v, np.ndarray):
+            h.update(np.round(v.astype(np.float64), 3).tobytes())
+        elif isinstance(v, (list, tuple)):
+            for item in v:
+                feed(item)
+        else:
+            h.update(repr(round(float(v), 3) if isinstance(v, (float, np.floating)) else v).encode())
+    feed(value)
+    return h.hexdigest()[:16]
+
+
+def benchmarks(full=False):
+    """(Name, Funktion ohne Argumente) aller Benchmarks."""
+    for size_name, width, height in SIZES:
+        for count in BOX_COUNTS:
+            img, windows = make_plan(width, height, count)
+            boxes = windows + np.random.default_rng(2).normal(0, 4, size=windows.shape).astype(np.float32)
+            case = f'{size_name}/{count}'
+
+            combos = ([(s, i) for s in SELECTS for i in INK_MODES] if full else
+                      [(s, 'black') for s in SELECTS] + [('second_inner', i) for i in INK_MODES[1:]])
+            for select, ink_mode in combos:
+                yield (f'refine[{case}] select={select} ink={ink_mode}',
+                       lambda b=boxes, im=img, s=select, i=ink_mode:
+                       utils.refine_boxes_to_lines(b, im, search=SEARCH, ink_mode=i, select=s))
+            yield (f'refine[{case}] select=second_inner ink=black darkness=auto',
+                   lambda b=boxes, im=img: utils.refine_boxes_to_lines(b, im, search=SEARCH, min_darkness='auto'))
+
+            det_boxes, labels, scores, areas = make_detections(windows)
+            yield (f'apply_nms[{case}] detections={len(det_boxes)}',
+                   lambda b=det_boxes, l=labels, s=scores, a=areas: utils.apply_nms(b, l, s, a)[0])
+
+        # Profile, Überlappungen: unabhängig von der Boxzahl, einmal je Grösse
+        img, windows = make_plan(width, height, BOX_COUNTS[-1])
+        profiles = band_profiles(img, windows)
+        yield (f'_find_lines[{size_name}] profiles={len(profiles)}',
+               lambda p=profiles: [utils._find_lines(prof, 25) for prof in p])
+        yield (f'_threshold_crossings[{size_name}] profiles={len(profiles)}',
+               lambda p=profiles: [utils._threshold_crossings(prof, 25, rising=True) for prof in p])
+        rows = [utils._ink_from_image(img, 'black')[y] for y in range(0, height, height // 20)]
+        yield (f'_find_lines[{size_name}] full_rows={len(rows)}',
+               lambda r=rows: [utils._find_lines(row, 25) for row in r])
+        det_boxes = make_detections(windows)[0]
+        pairs = [(det_boxes[i], det_boxes[j]) for i in range(0, len(det_boxes), 7) for j in range(0, len(det_boxes), 11)]
+        yield (f'calculate_overlap[{size_name}] pairs={len(pairs)}',
+               lambda p=pairs: [utils.calculate_overlap(a, b)['iou'] for a, b in p])
+
+
+def run(fn, repeat):
+    result = fn()  # Aufwärmen (und Ergebnis für den Digest)
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - t0) * 1000)
+    return {'min_ms': round(min(runs), 3), 'median_ms': round(median(runs), 3), 'repeat': repeat,
+            'digest': digest(result)}
+
+
+def compare(results, baseline, tolerance):
+    """Vergleich mit der Baseline; gibt die Anzahl Regressionen zurück."""
+    regressions = 0
+    print(f"\n── Vergleich mit Baseline (Toleranz {tolerance:.0%}) ─────────────")
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"  neu      {name}")
+            continue
+        ratio = res['median_ms'] / base['median_ms'] if base['median_ms'] else 1.0
+        flags = []
+        if ratio > 1 + tolerance:
+            flags.append('LANGSAMER')
+            regressions += 1
+        elif ratio < 1 - tolerance:
+            flags.append('schneller')
+        if res['digest'] != base['digest']:
+            flags.append('ERGEBNIS GEÄNDERT')
+            regressions += 1
+        print(f"  {ratio:6.2f}×  {name}  {' '.join(flags)}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark der Detektions-Nachbearbeitung (utils.py)")
+    ap.add_argument("--repeat", type=int, default=5, help="Messläufe pro Benchmark (nach 1 Aufwärmlauf)")
+    ap.add_argument("--filter", default="", help="nur Benchmarks, deren Name diesen Text enthält")
+    ap.add_argument("--full", action="store_true", help="select × ink_mode komplett statt je einzeln")
+    ap.add_argument("--json", help="Ergebnisse als JSON hierhin schreiben")
+    ap.add_argument("--baseline", help="mit dieser Baseline (JSON) vergleichen, Exit 1 bei Regression")
+    ap.add_argument("--save-baseline", help="Ergebnisse als neue Baseline speichern")
+    ap.add_argument("--tolerance", type=float, default=0.2,
+                    help="erlaubte Abweichung des Medians gegenüber der Baseline (Default 0.2 = 20%%)")
+    args = ap.parse_args()
+
+    results = {}
+    for name, fn in benchmarks(full=args.full):
+        if args.filter not in name:
+            continue
+        results[name] = res = run(fn, args.repeat)
+        print(f"  {res['median_ms']:10.2f} ms  (min {res['min_ms']:.2f})  {name}")
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': f'{platform.node()} {platform.machine()} {platform.processor()}'.strip(),
+        },
+        'results': results,
+    }
+    for path in filter(None, [args.json, args.save_baseline]):
+        Path(path).write_text(json.dumps(report, indent=2))
+        print(f"\nGeschrieben: {path}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if baseline['meta'].get('machine') != report['meta']['machine']:
+            print(f"⚠ Baseline stammt von einer anderen Maschine ({baseline['meta'].get('machine')})")
+        if compare(results, baseline['results'], args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
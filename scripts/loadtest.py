@@ -1,10 +1,28 @@
 #!/usr/bin/env python3
 """
-Lasttest für Planvision-Analyse (CPU-intensiv) – nur Standardbibliothek.
+Lasttest für Planvision – Szenarien mit gemischter Last, nur Standardbibliothek.
 
-Misst, wie sich /analyze_page unter parallelen Anfragen verhält: Latenzen,
-Erfolg/Fehler, Timeouts. Damit lässt sich vor dem Beta-Launch abschätzen, ob ein
-CX22 (2 vCPU / 4 GB) reicht.
+Ursprünglich misst das Skript, wie sich /analyze_page unter parallelen
+Anfragen verhält (Szenario "analyze", weiterhin der Default). Mit
+Szenarien lässt sich realistischere Last erzeugen:
+
+  Endpunkte   upload, append (Seiten anhängen), page_image (Seitenbild
+              abrufen), analyze (zufällige Seite einer zufälligen Session),
+              cloud_save (Projekt online speichern, braucht --username)
+  Mix         Gewichte je Endpunkt, z.B. {"analyze": 50, "page_image": 30, …}
+  Ankunft     closed: C virtuelle Nutzer, jeder schickt nach der Antwort
+                      (plus --think) den nächsten Request
+              open:   Requests kommen mit fester Rate (Poisson, req/s),
+                      unabhängig davon, wie schnell der Server antwortet —
+                      so sieht man Warteschlangen statt sie zu verstecken.
+                      Die Latenz zählt ab dem geplanten Sendezeitpunkt.
+  Rampe       Stützpunkte [Sekunde, Wert] — Wert = Rate (open) bzw.
+              Parallelität (closed), dazwischen linear interpoliert.
+
+Pro Endpunkt: Latenz-Histogramm (log. Buckets, ~1 % Auflösung wie
+HdrHistogram) mit p50/p90/p99/p99.9/max, Fehlerarten, Durchsatz. --json
+speichert den Lauf komplett (inkl. Histogramme), --csv hängt eine Zeile pro
+Endpunkt an eine Datei an — für den Vergleich über die Zeit.
 
 WICHTIG: Auf dem ZIEL-Server laufen lassen (oder gegen dessen URL), nicht auf dem
 Dev-Rechner mit GPU – nur die CPU-Zeiten des CX22 sind aussagekräftig. Ideal vom
@@ -12,28 +30,62 @@ Server selbst gegen http://127.0.0.1:8000 (bzw. den gunicorn-Socket/Port), damit
 das Netz nicht mitmisst.
 
 Ablauf:
-  1. GET /app/        -> holt das csrftoken-Cookie
-  2. POST /upload     -> lädt einmal eine Test-PDF hoch, bekommt session_id
-  3. N x POST /analyze_page mit Parallelität C -> misst die Analyse unter Last
+  1. GET /app/ (bzw. Login mit --username/--password) -> csrftoken-Cookie
+  2. POST /upload     -> legt die Start-Sessions an (Szenario "sessions")
+  3. Last gemäss Szenario bis --duration bzw. -n Requests
 
 Aufruf:
   python scripts/loadtest.py --url http://127.0.0.1:8000 --pdf plan.pdf -n 12 -c 3
   python scripts/loadtest.py --url https://planli.net --pdf plan.pdf -n 20 -c 5 --page 1
+  python scripts/loadtest.py --url http://127.0.0.1:8000 --pdf a.pdf b.pdf --scenario beta \\
+      --username last@planli.net --password … --json lauf.json --csv verlauf.csv
+  python scripts/loadtest.py … --scenario beta --arrival open --ramp 0:0.05,120:0.5 --duration 600
+  python scripts/loadtest.py … --scenario eigenes_szenario.json
+
+Szenario-Datei (JSON, alle Schlüssel optional; ohne -n/--duration 60 s):
+  {"mix": {"analyze": 6, "page_image": 3, "upload": 1}, "sessions": 3,
+   "arrival": "open", "ramp": [[0, 0.1], [60, 0.5]], "duration": 300}
 
 Begleitend auf dem Server beobachten (zweites Terminal):
   watch -n1 'free -m; echo; ps -C gunicorn -o pid,rss,%cpu,cmd --no-headers'
 """
 
 import argparse
+import csv
+import io
 import json
+import math
+import random
 import sys
+import threading
 import time
 import uuid
+import zipfile
 import http.cookiejar
+import urllib.error
 import urllib.request
 import urllib.parse
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from statistics import median
+from datetime import datetime
+from pathlib import Path
+
+ENDPOINTS = ["upload", "append", "page_image", "analyze", "cloud_save"]
+
+# Grundwerte, die jedes Szenario überschreiben kann
+DEFAULTS = {"mix": {"analyze": 1}, "sessions": 1, "arrival": "closed", "fixed_page": False}
+
+SCENARIOS = {
+    # Bisheriges Verhalten: eine Session, immer dieselbe Seite analysieren
+    "analyze": {"mix": {"analyze": 1}, "sessions": 1, "arrival": "closed",
+                "concurrency": 3, "requests": 12, "fixed_page": True},
+    # Beta-Alltag: viel Anschauen und Analysieren, ab und zu neue Pläne und Speichern
+    "beta": {"mix": {"analyze": 40, "page_image": 40, "upload": 8, "append": 4, "cloud_save": 8},
+             "sessions": 3, "arrival": "open", "ramp": [[0, 0.05], [60, 0.3]], "duration": 300},
+    # Montagmorgen: viele neue Uploads gleichzeitig (Rendern, Render-Cache)
+    "upload_burst": {"mix": {"upload": 6, "page_image": 3, "analyze": 1}, "sessions": 1,
+                     "arrival": "closed", "ramp": [[0, 1], [30, 6]], "duration": 120},
+}
 
 
 def build_opener():
@@ -70,97 +122,440 @@ def encode_multipart(fields, file_field, filename, file_bytes, content_type):
     return body, f"multipart/form-data; boundary={boundary}"
 
 
+class LatencyHistogram:
+    """Latenzen in log. Buckets (relative Auflösung `precision`, ab 0.1 ms) —
+    Perzentile ohne alle Einzelwerte zu speichern, Läufe lassen sich über
+    to_dict() ablegen und vergleichen."""
+
+    LOWEST_MS = 0.1
+
+    def __init__(self, precision=0.01):
+        self.precision = precision
+        self.counts = Counter()
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        index = int(math.log(max(ms, self.LOWEST_MS) / self.LOWEST_MS) / math.log1p(self.precision))
+        self.counts[index] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        target, seen = q / 100 * self.count, 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                # obere Bucket-Grenze, aber nie über dem gemessenen Maximum
+                return min(self.LOWEST_MS * (1 + self.precision) ** (index + 1), self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {"precision": self.precision, "lowest_ms": self.LOWEST_MS, "count": self.count,
+                "sum_ms": round(self.sum_ms, 1), "max_ms": round(self.max_ms, 1),
+                "buckets": {str(k): v for k, v in sorted(self.counts.items())}}
+
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+class Stats:
+    """Ergebnisse pro Endpunkt (thread-safe)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hist = {}
+        self.errors = {}
+        self.ok = Counter()
+
+    def record(self, endpoint, status, ms):
+        with self.lock:
+            if status == "ok":
+                self.ok[endpoint] += 1
+                self.hist.setdefault(endpoint, LatencyHistogram()).record(ms)
+            else:
+                self.errors.setdefault(endpoint, Counter())[status] += 1
+
+    def endpoints(self):
+        return sorted(set(self.ok) | set(self.errors), key=ENDPOINTS.index)
+
+    def summary(self, endpoint, wall):
+        hist = self.hist.get(endpoint, LatencyHistogram())
+        errors = self.errors.get(endpoint, Counter())
+        return {
+            "ok": self.ok[endpoint],
+            "errors": dict(errors),
+            "rps": round(self.ok[endpoint] / wall, 3) if wall else None,
+            "mean_ms": round(hist.sum_ms / hist.count, 1) if hist.count else None,
+            "percentiles_ms": {f"p{q:g}": round(hist.percentile(q), 1) if hist.count else None
+                               for q in PERCENTILES},
+            "max_ms": round(hist.max_ms, 1),
+            "histogram": hist.to_dict(),
+        }
+
+
+class Target:
+    """Der Server unter Last: Sessions, Cookies, ein Aufruf je Endpunkt."""
+
+    def __init__(self, args, pdfs):
+        self.base = args.url.rstrip("/")
+        self.args = args
+        self.pdfs = pdfs
+        self.lock = threading.Lock()
+        self.sessions = []        # {"id", "sources": {source_index: page_count}}
+        self.cloud_projects = []  # in diesem Lauf angelegte Cloud-Projekte
+        self.headers = {}
+
+    # Verbindung ----------------------------------------------------------
+
+    def connect(self):
+        opener, jar = build_opener()
+        if self.args.username:
+            login = self.base + "/accounts/login/"
+            opener.open(login, timeout=30).read()
+            form = urllib.parse.urlencode({
+                "username": self.args.username, "password": self.args.password or "",
+                "csrfmiddlewaretoken": get_cookie(jar, "csrftoken") or "",
+            }).encode()
+            req = urllib.request.Request(login, data=form, method="POST")
+            req.add_header("Referer", login)
+            req.add_header("Origin", self.base)
+            opener.open(req, timeout=30).read()
+            if not get_cookie(jar, "sessionid"):
+                sys.exit("FEHLER: Login fehlgeschlagen (kein sessionid-Cookie).")
+        opener.open(self.base + "/app/", timeout=30).read()
+        csrf = get_cookie(jar, "csrftoken")
+        if not csrf:
+            sys.exit("FEHLER: kein csrftoken-Cookie von /app/ erhalten.")
+        # Cookies + csrf für die parallelen Threads einmal einfrieren (thread-safe ohne shared opener)
+        # Über HTTPS prüft Django CSRF zusätzlich Origin/Referer gegen CSRF_TRUSTED_ORIGINS
+        # – ohne diese Header gibt es 403, obwohl der Token stimmt.
+        self.headers = {"Cookie": cookie_header(jar), "X-CSRFToken": csrf,
+                        "Origin": self.base, "Referer": self.base + "/app/"}
+
+    def request(self, method, path, data=None, content_type=None, extra_headers=None):
+        headers = dict(self.headers, **(extra_headers or {}))
+        if content_type:
+            headers["Content-Type"] = content_type
+        req = urllib.request.Request(self.base + path, data=data, headers=headers, method=method)
+        with urllib.request.urlopen(req, timeout=self.args.timeout) as r:
+            body = r.read()
+        return json.loads(body) if r.headers.get_content_type() == "application/json" else body
+
+    # Sessions ------------------------------------------------------------
+
+    def random_session(self):
+        with self.lock:
+            return random.choice(self.sessions) if self.sessions else None
+
+    def random_page(self, session):
+        if self.args.fixed_page:
+            return 1, min(self.args.page, session["sources"][1])
+        with self.lock:
+            source, count = random.choice(list(session["sources"].items()))
+        return source, random.randint(1, count)
+
+    # Endpunkte -----------------------------------------------------------
+
+    def upload(self):
+        name, pdf = random.choice(self.pdfs)
+        body, ctype = encode_multipart({}, "file", name, pdf, "application/pdf")
+        up = self.request("POST", "/upload", body, ctype)
+        session = {"id": up["session_id"], "sources": {1: up.get("page_count", 1)}}
+        with self.lock:
+            self.sessions.append(session)
+            if len(self.sessions) > self.args.max_sessions:
+                self.sessions.pop(random.randrange(len(self.sessions) - 1))
+        return session
+
+    def append(self):
+        session = self.random_session()
+        name, pdf = random.choice(self.pdfs)
+        body, ctype = encode_multipart({"session_id": session["id"]}, "file", name, pdf, "application/pdf")
+        up = self.request("POST", "/upload_append", body, ctype)
+        with self.lock:
+            session["sources"][up["source_index"]] = up.get("page_count", 1)
+
+    def page_image(self):
+        session = self.random_session()
+        source, page = self.random_page(session)
+        self.request("GET", f"/project_files/{session['id']}/uploads/page_{source}_{page}.jpg",
+                     extra_headers={"Accept": "image/webp,image/*"})
+
+    def analyze(self):
+        session = self.random_session()
+        source, page = self.random_page(session)
+        payload = urllib.parse.urlencode({
+            "session_id": session["id"], "page": page, "source_index": source,
+            "format_width": 210, "format_height": 297, "dpi": 150,
+            "plan_scale": self.args.plan_scale, "threshold": self.args.threshold,
+        }).encode()
+        self.request("POST", "/analyze_page", payload, "application/x-www-form-urlencoded")
+
+    def cloud_save(self):
+        """Minimales .planli aus einer Session (metadata, labels, erstes
+        Seitenbild). Die ersten Saves legen Projekte an, danach wird
+        überschrieben — so läuft kein Projektlimit voll."""
+        session = self.random_session()
+        image = self.request("GET", f"/project_files/{session['id']}/uploads/page_1_1.jpg")
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as z:
+            z.writestr("metadata.json", json.dumps({"page_count": 1, "format_version": 3}))
+            z.writestr("labels.json", json.dumps([{"name": "Fenster", "color": "#0000FF"}]))
+            z.writestr("pages/page_1.jpg", image)
+        fields = {"name": f"Lasttest {datetime.now():%H:%M:%S}"}
+        with self.lock:
+            if len(self.cloud_projects) >= self.args.cloud_projects:
+                fields["project_id"] = random.choice(self.cloud_projects)
+        saved = self.request("POST", "/cloud/projects/save",
+                             *encode_multipart(fields, "project_zip", "lasttest.planli", buf.getvalue(),
+                                               "application/zip"))
+        if "project_id" not in fields:
+            with self.lock:
+                self.cloud_projects.append(saved["id"])
+
+
+def call(target, stats, endpoint, intended=None):
+    """Einen Request ausführen und messen. `intended`: geplanter Sendezeitpunkt
+    (open loop) — Wartezeit im Client zählt mit zur Latenz."""
+    start = intended if intended is not None else time.perf_counter()
+    try:
+        getattr(target, endpoint)()
+        status = "ok"
+    except urllib.error.HTTPError as e:
+        status = f"HTTP {e.code}"
+    except Exception as e:
+        status = type(e).__name__
+    ms = (time.perf_counter() - start) * 1000
+    stats.record(endpoint, status, ms)
+    if target.args.verbose:
+        mark = "✓" if status == "ok" else "✗"
+        print(f"  {mark} {endpoint:<11} {status:<14} {ms / 1000:6.1f}s")
+
+
+def ramp_value(ramp, t):
+    """Linear zwischen den Stützpunkten [(sekunde, wert), …], danach konstant."""
+    if t <= ramp[0][0]:
+        return ramp[0][1]
+    for (t0, v0), (t1, v1) in zip(ramp, ramp[1:]):
+        if t < t1:
+            return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+    return ramp[-1][1]
+
+
+class Schedule:
+    """Welcher Endpunkt als nächstes, und wann ist Schluss."""
+
+    def __init__(self, mix, requests, duration):
+        self.endpoints, self.weights = zip(*mix.items())
+        self.remaining = requests
+        self.deadline = time.perf_counter() + duration if duration else None
+        self.lock = threading.Lock()
+
+    def done(self):
+        if self.deadline:
+            return time.perf_counter() >= self.deadline
+        return self.remaining is not None and self.remaining <= 0
+
+    def next(self):
+        """Nächster Endpunkt oder None, wenn der Lauf vorbei ist."""
+        with self.lock:
+            if self.deadline and time.perf_counter() >= self.deadline:
+                return None
+            if self.remaining is not None:
+                if self.remaining <= 0:
+                    return None
+                self.remaining -= 1
+        return random.choices(self.endpoints, self.weights)[0]
+
+
+def run_closed(target, stats, schedule, ramp, think):
+    """C virtuelle Nutzer; Nutzer i ist aktiv, solange i < Parallelität(t)."""
+    t0 = time.perf_counter()
+    workers = max(1, math.ceil(max(v for _, v in ramp)))
+
+    def user(i):
+        while True:
+            if i >= ramp_value(ramp, time.perf_counter() - t0):
+                if schedule.done():
+                    return
+                time.sleep(0.2)
+                continue
+            endpoint = schedule.next()
+            if endpoint is None:
+                return
+            call(target, stats, endpoint)
+            if think:
+                time.sleep(random.expovariate(1 / think))
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for fut in as_completed([ex.submit(user, i) for i in range(workers)]):
+            fut.result()
+
+
+def run_open(target, stats, schedule, ramp, max_inflight):
+    """Poisson-Ankünfte mit Rate(t) req/s, unabhängig von den Antwortzeiten."""
+    t0 = time.perf_counter()
+    next_at = t0
+    with ThreadPoolExecutor(max_workers=max_inflight) as ex:
+        while True:
+            elapsed = next_at - t0
+            rate = ramp_value(ramp, elapsed)
+            if rate <= 0:
+                # Rampe bleibt bei 0 (z.B. 0:1,60:0): es kommt nichts mehr
+                if schedule.done() or all(v <= 0 for t, v in ramp if t >= elapsed):
+                    break
+                next_at += 0.1
+                time.sleep(max(0.0, next_at - time.perf_counter()))
+                continue
+            next_at += random.expovariate(rate)
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+            endpoint = schedule.next()
+            if endpoint is None:
+                break
+            ex.submit(call, target, stats, endpoint, next_at)
+
+
+def load_scenario(name):
+    scenario = json.loads(json.dumps(DEFAULTS))
+    if name in SCENARIOS:
+        scenario.update(json.loads(json.dumps(SCENARIOS[name])))
+    else:
+        try:
+            scenario.update(json.loads(Path(name).read_text()))
+        except (OSError, ValueError) as e:
+            sys.exit(f"FEHLER: Szenario {name!r} weder eingebaut ({', '.join(SCENARIOS)}) noch lesbar: {e}")
+    unknown = set(scenario["mix"]) - set(ENDPOINTS)
+    if unknown:
+        sys.exit(f"FEHLER: unbekannte Endpunkte im Mix: {', '.join(sorted(unknown))}")
+    return scenario
+
+
+def parse_ramp(text):
+    try:
+        return [[float(t), float(v)] for t, v in (point.split(":") for point in text.split(","))]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Format: sekunde:wert,sekunde:wert,… (z.B. 0:0.1,60:1)")
+
+
+def write_outputs(args, scenario, stats, wall, started_at):
+    endpoints = {e: stats.summary(e, wall) for e in stats.endpoints()}
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "meta": {"label": args.label, "scenario": args.scenario, "url": args.url,
+                     "started_at": started_at, "wall_s": round(wall, 1),
+                     "arrival": scenario["arrival"], "ramp": scenario["ramp"], "mix": scenario["mix"]},
+            "endpoints": endpoints,
+        }, indent=2))
+        print(f"Geschrieben: {args.json}")
+    if args.csv:
+        path = Path(args.csv)
+        new = not path.exists()
+        with path.open("a", newline="") as f:
+            writer = csv.writer(f)
+            if new:
+                writer.writerow(["started_at", "label", "scenario", "endpoint", "ok", "errors", "rps",
+                                 "mean_ms"] + [f"p{q:g}_ms" for q in PERCENTILES] + ["max_ms"])
+            for endpoint, s in endpoints.items():
+                writer.writerow([started_at, args.label, args.scenario, endpoint, s["ok"],
+                                 sum(s["errors"].values()), s["rps"], s["mean_ms"]]
+                                + list(s["percentiles_ms"].values()) + [s["max_ms"]])
+        print(f"Angehängt: {args.csv}")
+
+
 def main():
-    ap = argparse.ArgumentParser(description="Lasttest für /analyze_page")
+    ap = argparse.ArgumentParser(description="Lasttest für Planvision (Szenarien mit gemischter Last)")
     ap.add_argument("--url", required=True, help="Basis-URL, z.B. http://127.0.0.1:8000")
-    ap.add_argument("--pdf", required=True, help="Pfad zur Test-PDF (wird einmal hochgeladen)")
-    ap.add_argument("-n", "--requests", type=int, default=12, help="Anzahl Analyse-Requests gesamt")
-    ap.add_argument("-c", "--concurrency", type=int, default=3, help="parallele Requests")
-    ap.add_argument("--page", type=int, default=1, help="welche Seite analysieren")
+    ap.add_argument("--pdf", required=True, nargs="+", help="Test-PDF(s) für Uploads (zufällig gewählt)")
+    ap.add_argument("--scenario", default="analyze",
+                    help=f"eingebaut ({', '.join(SCENARIOS)}) oder Pfad zu einer Szenario-JSON")
+    ap.add_argument("-n", "--requests", type=int, help="Anzahl Requests gesamt (statt --duration)")
+    ap.add_argument("--duration", type=float, help="Laufzeit in s (statt -n)")
+    ap.add_argument("--arrival", choices=["closed", "open"], help="closed = C Nutzer, open = feste Rate")
+    ap.add_argument("-c", "--concurrency", type=int, help="parallele Nutzer (closed, ohne Rampe)")
+    ap.add_argument("--rate", type=float, help="Requests/s (open, ohne Rampe)")
+    ap.add_argument("--ramp", type=parse_ramp, help="Rampe sekunde:wert,… (Rate bzw. Parallelität)")
+    ap.add_argument("--think", type=float, default=0, help="mittlere Denkpause in s zwischen Requests (closed)")
+    ap.add_argument("--max-inflight", type=int, default=32, help="höchstens so viele offene Requests (open)")
+    ap.add_argument("--sessions", type=int, help="Start-Sessions (je ein Upload vor der Messung)")
+    ap.add_argument("--max-sessions", type=int, default=20, help="Sessions im Pool, ältere fallen raus")
+    ap.add_argument("--cloud-projects", type=int, default=3,
+                    help="so viele Cloud-Projekte anlegen, danach überschreiben")
+    ap.add_argument("--username", help="Login (nötig für cloud_save bzw. ausserhalb BETA_MODE)")
+    ap.add_argument("--password")
+    ap.add_argument("--page", type=int, default=1, help="welche Seite analysieren (Szenario analyze)")
     ap.add_argument("--plan-scale", type=float, default=100)
     ap.add_argument("--threshold", type=float, default=0.5)
     ap.add_argument("--timeout", type=float, default=310,
                     help="Request-Timeout in s (knapp über gunicorn 300, um Timeouts zu sehen)")
+    ap.add_argument("--label", default="", help="Name des Laufs in JSON/CSV")
+    ap.add_argument("--json", help="Ergebnis (inkl. Histogramme) als JSON schreiben")
+    ap.add_argument("--csv", help="eine Zeile pro Endpunkt an diese CSV anhängen")
+    ap.add_argument("-q", "--quiet", dest="verbose", action="store_false", help="keine Zeile pro Request")
     args = ap.parse_args()
+    if args.max_sessions < 1:
+        ap.error("--max-sessions muss mindestens 1 sein")
 
-    base = args.url.rstrip("/")
-    opener, jar = build_opener()
-
-    # 1) csrftoken holen
-    opener.open(base + "/app/", timeout=30).read()
-    csrf = get_cookie(jar, "csrftoken")
-    if not csrf:
-        print("FEHLER: kein csrftoken-Cookie von /app/ erhalten.", file=sys.stderr)
-        sys.exit(1)
-
-    # 2) PDF einmal hochladen -> session_id
-    with open(args.pdf, "rb") as f:
-        pdf_bytes = f.read()
-    body, ctype = encode_multipart({}, "file", args.pdf.split("/")[-1], pdf_bytes, "application/pdf")
-    req = urllib.request.Request(base + "/upload", data=body, method="POST")
-    req.add_header("Content-Type", ctype)
-    req.add_header("X-CSRFToken", csrf)
-    # Über HTTPS prüft Django CSRF zusätzlich Origin/Referer gegen CSRF_TRUSTED_ORIGINS
-    # – ohne diese Header gibt es 403, obwohl der Token stimmt.
-    req.add_header("Origin", base)
-    req.add_header("Referer", base + "/app/")
-    up = json.loads(opener.open(req, timeout=120).read())
-    session_id = up["session_id"]
-    page_count = up.get("page_count", 1)
-    print(f"Upload ok: session={session_id}, Seiten={page_count}")
-    page = min(args.page, page_count)
-
-    # Cookies + csrf für die parallelen Threads einmal einfrieren (thread-safe ohne shared opener)
-    cookies = cookie_header(jar)
-    headers = {"Cookie": cookies, "X-CSRFToken": csrf,
-               "Content-Type": "application/x-www-form-urlencoded",
-               "Origin": base, "Referer": base + "/app/"}
-    payload = urllib.parse.urlencode({
-        "session_id": session_id, "page": page,
-        "format_width": 210, "format_height": 297, "dpi": 150,
-        "plan_scale": args.plan_scale, "threshold": args.threshold,
-    }).encode()
-
-    def one_call(i):
-        t0 = time.perf_counter()
-        req = urllib.request.Request(base + "/analyze_page", data=payload, headers=headers, method="POST")
-        try:
-            with urllib.request.urlopen(req, timeout=args.timeout) as r:
-                data = json.loads(r.read())
-            dt = time.perf_counter() - t0
-            return ("ok", dt, data.get("count"))
-        except urllib.error.HTTPError as e:
-            return (f"HTTP {e.code}", time.perf_counter() - t0, None)
-        except Exception as e:
-            return (f"{type(e).__name__}", time.perf_counter() - t0, None)
-
-    print(f"Starte {args.requests} Analysen, Parallelität {args.concurrency}, Seite {page} …\n")
-    results = []
+    scenario = load_scenario(args.scenario)
+    for key in ("arrival", "sessions"):
+        if getattr(args, key) is not None:
+            scenario[key] = getattr(args, key)
+    if args.requests or args.duration:
+        scenario["requests"], scenario["duration"] = args.requests, args.duration
+    elif not scenario.get("requests") and not scenario.get("duration"):
+        scenario["duration"] = 60
+    if "cloud_save" in scenario["mix"] and not args.username:
+        print("Hinweis: cloud_save braucht --username/--password – aus dem Mix genommen.")
+        del scenario["mix"]["cloud_save"]
+    if args.ramp:
+        scenario["ramp"] = args.ramp
+    elif scenario["arrival"] == "open" and (args.rate or "ramp" not in scenario):
+        scenario["ramp"] = [[0, args.rate or scenario.get("rate", 1.0)]]
+    elif scenario["arrival"] == "closed" and (args.concurrency or "ramp" not in scenario):
+        scenario["ramp"] = [[0, args.concurrency or scenario.get("concurrency", 3)]]
+    args.fixed_page = scenario.get("fixed_page", False)
+
+    pdfs = [(Path(p).name, Path(p).read_bytes()) for p in args.pdf]
+    target = Target(args, pdfs)
+    target.connect()
+    for _ in range(max(1, scenario["sessions"])):
+        session = target.upload()
+        print(f"Upload ok: session={session['id']}, Seiten={session['sources'][1]}")
+
+    stats = Stats()
+    schedule = Schedule(scenario["mix"], scenario.get("requests"), scenario.get("duration"))
+    ramp = scenario["ramp"]
+    limit = f"{scenario['requests']} Requests" if scenario.get("requests") else f"{scenario.get('duration')} s"
+    print(f"Starte Szenario {args.scenario} ({scenario['arrival']}, Rampe {ramp}, {limit}) …\n")
+    started_at = datetime.now().isoformat(timespec="seconds")
     wall0 = time.perf_counter()
-    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
-        futs = {ex.submit(one_call, i): i for i in range(args.requests)}
-        for fut in as_completed(futs):
-            status, dt, count = fut.result()
-            results.append((status, dt))
-            mark = "✓" if status == "ok" else "✗"
-            print(f"  {mark} {status:<14} {dt:6.1f}s  Objekte={count}")
+    if scenario["arrival"] == "open":
+        run_open(target, stats, schedule, ramp, args.max_inflight)
+    else:
+        run_closed(target, stats, schedule, ramp, args.think)
     wall = time.perf_counter() - wall0
 
-    oks = [dt for s, dt in results if s == "ok"]
-    fails = [s for s, _ in results if s != "ok"]
     print("\n── Ergebnis ─────────────────────────────────────────────")
-    print(f"Erfolgreich: {len(oks)}/{len(results)}   Fehler: {len(fails)}")
-    if fails:
-        from collections import Counter
-        print("Fehlerarten:", dict(Counter(fails)))
-    if oks:
-        oks.sort()
-        p90 = oks[min(len(oks) - 1, int(len(oks) * 0.9))]
-        print(f"Analyse-Latenz (s): min {oks[0]:.1f}  median {median(oks):.1f}  "
-              f"p90 {p90:.1f}  max {oks[-1]:.1f}")
-    print(f"Gesamtdauer: {wall:.1f}s   Durchsatz: {len(oks)/wall:.2f} Analysen/s")
-    if any(s.startswith(("HTTP 502", "HTTP 504")) or s == "URLError" for s in fails):
+    print(f"{'Endpunkt':<11} {'ok':>5} {'Fehler':>6} {'req/s':>7} "
+          + " ".join(f"{f'p{q:g}':>8}" for q in PERCENTILES) + f" {'max':>8}   (Latenz in s)")
+    all_errors = Counter()
+    for endpoint in stats.endpoints():
+        s = stats.summary(endpoint, wall)
+        all_errors.update(s["errors"])
+        pct = " ".join(f"{v / 1000:8.2f}" if v is not None else f"{'–':>8}" for v in s["percentiles_ms"].values())
+        print(f"{endpoint:<11} {s['ok']:>5} {sum(s['errors'].values()):>6} {s['rps']:>7.2f} {pct} "
+              f"{s['max_ms'] / 1000:8.2f}")
+    if all_errors:
+        print("Fehlerarten:", dict(all_errors))
+    total_ok = sum(stats.ok.values())
+    print(f"Gesamtdauer: {wall:.1f}s   Durchsatz: {total_ok / wall:.2f} Requests/s")
+    if any(s.startswith(("HTTP 502", "HTTP 504")) or s in ("URLError", "TimeoutError") for s in all_errors):
         print("\n⚠ Timeouts/502/504 aufgetreten -> gunicorn-Timeout gerissen oder Worker überlastet.")
+    write_outputs(args, scenario, stats, wall, started_at)
 
 
 if __name__ == "__main__":